@@ -0,0 +1,5 @@
+""" Benchmarks of notty's operations on synthetic project trees.
+
+    python -m benchmarks run --files 10000 -o results.json
+    python -m benchmarks compare baseline.json results.json --threshold 0.1
+"""
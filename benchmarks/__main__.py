@@ -0,0 +1,77 @@
+""" Command line of the benchmark suite. """
+import json
+import sys
+import click
+
+from benchmarks.synthetic import TreeSpec
+from benchmarks import suite
+
+
+@click.group()
+def benchmarks():
+    """ Measure notty's operations and catch performance regressions. """
+
+@benchmarks.command("run")
+@click.option("--files", default=1000, show_default=True, type=click.IntRange(min=1), help="Number of generated files.")
+@click.option("--median-size", default=4096, show_default=True, type=click.IntRange(min=1), help="Median file size in bytes.")
+@click.option("--size-sigma", default=1.5, show_default=True, type=click.FloatRange(min=0), help="Spread of log-normal file size distribution.")
+@click.option("--max-size", default=64 * 1024 * 1024, show_default=True, type=click.IntRange(min=1), help="Largest file size in bytes.")
+@click.option("--depth", default=4, show_default=True, type=click.IntRange(min=0), help="Depth of directory tree.")
+@click.option("--fanout", default=6, show_default=True, type=click.IntRange(min=1), help="Most subdirectories per directory.")
+@click.option("--binary-ratio", default=0.2, show_default=True, type=click.FloatRange(0, 1), help="Share of binary (incompressible) files.")
+@click.option("--churn", "churn_rate", default=0.05, show_default=True, type=click.FloatRange(0, 1), help="Share of files changed between saves.")
+@click.option("--seed", default=0, show_default=True, type=int, help="Seed of generated tree.")
+@click.option("--repeat", default=5, show_default=True, type=click.IntRange(min=1), help="Warm runs of every operation.")
+@click.option("--workdir", default=None, type=click.Path(file_okay=False), help="Directory for generated projects (default: system temp).")
+@click.option("-o", "--output", default="-", show_default=True, type=click.File("w"), help="Where to write JSON results.")
+def run(files, median_size, size_sigma, max_size, depth, fanout, binary_ratio, churn_rate, seed, repeat, workdir, output):
+    """ Generate synthetic project and measure every operation. """
+    spec = TreeSpec(files, median_size, size_sigma, max_size, depth, fanout, binary_ratio, seed)
+    results = suite.Suite(spec, churn_rate, repeat, workdir=workdir).run()
+    json.dump(results, output, indent=2)
+    output.write("\n")
+
+    if not results["meta"]["caches_dropped"]:
+        click.echo("warning: page cache could not be dropped (needs root on Linux), cold runs are only in-process cold.", err=True)
+    for key, seconds in suite.summarize(results).items():
+        click.echo(f"{key:<32} {seconds * 1000:10.2f} ms", err=True)
+
+@benchmarks.command("compare")
+@click.argument("baseline", type=click.File("r"))
+@click.argument("current", type=click.File("r"))
+@click.option("--threshold", default=0.1, show_default=True, type=click.FloatRange(min=0),
+              help="Allowed slowdown of median time (0.1 = 10%).")
+def compare(baseline, current, threshold):
+    """ Compare results with baseline, exit with status 1 on regression. """
+    baseline_results = json.load(baseline)
+    current_results = json.load(current)
+    if baseline_results["meta"]["spec"] != current_results["meta"]["spec"]:
+        click.echo("warning: results were measured on different trees.", err=True)
+
+    rows = suite.compare(baseline_results, current_results, threshold)
+    regressions = 0
+    for key, old, new, ratio, is_regression in rows:
+        regressions += is_regression
+        mark = "REGRESSION" if is_regression else ""
+        click.echo(f"{key:<32} {old * 1000:10.2f} ms {new * 1000:10.2f} ms {ratio:7.2f}x {mark}")
+
+    click.echo(f"{regressions} of {len(rows)} measurements regressed by more than {threshold:.0%}.")
+    sys.exit(1 if regressions else 0)
+
+@benchmarks.command("check")
+@click.argument("results", type=click.File("r"))
+def check(results):
+    """ Check results against absolute targets, exit with status 1 if any is missed. """
+    rows = suite.check_targets(json.load(results))
+    missed = 0
+    for key, seconds, target, is_met in rows:
+        missed += not is_met
+        mark = "" if is_met else "MISSED"
+        click.echo(f"{key:<32} {seconds * 1000:10.2f} ms {target * 1000:10.2f} ms {mark}")
+
+    click.echo(f"{missed} of {len(rows)} targets missed.")
+    sys.exit(1 if missed else 0)
+
+
+if __name__ == "__main__":
+    benchmarks()
@@ -0,0 +1,272 @@
+""" Benchmarked operations. Every operation is measured once in cold state
+(new Repository object, in-process caches cleared and, when permitted,
+OS page cache dropped) and then `repeat` times in warm state. """
+
+from contextlib import contextmanager, redirect_stdout
+from typing import Callable, Iterator
+import subprocess
+import platform
+import statistics
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+from benchmarks.synthetic import TreeSpec, generate, churn
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from core.repository import Repository
+from core.store import MetadataStore
+from core.index import RACY_WINDOW_NS
+import core.ignore as Ignore
+import core.todo as Todo
+
+RESULTS_VERSION = 1
+DROP_CACHES_PATH = "/proc/sys/vm/drop_caches"
+# Absolute limits of median seconds, checked by `check`. Editor hooks run
+# notty hundreds of times per session, so startup has to stay short.
+TARGETS: dict[str, float] = {
+    "startup_help/warm": 0.3,
+    "startup_list/warm": 0.3,
+    "status_clean/warm": 0.05,
+}
+# Seconds per file of generated project added to TARGETS, clean status
+# of a 300k files project has to take less than a second.
+PER_FILE_TARGETS: dict[str, float] = {
+    "status_clean/warm": 1 / 300_000,
+}
+
+
+def drop_caches() -> bool:
+    """ Drop OS page cache. Possible only on Linux as root, returns whether it worked. """
+    os.sync()
+    try:
+        with open(DROP_CACHES_PATH, "w") as file:
+            file.write("3\n")
+    except OSError:
+        return False
+    return True
+
+
+@contextmanager
+def quiet() -> Iterator[None]:
+    """ Hide notty's progress output while operation is measured. """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def _timed(function: Callable[[], object]) -> float:
+    with quiet():
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+
+def _git_revision() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PACKAGE_ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+class Suite:
+    """ Run all benchmarks against a synthetic project.
+    >>> Suite(spec, churn_rate, repeat).run() -> dict  # JSON serializable results
+    """
+
+    def __init__(self, spec: TreeSpec, churn_rate: float = 0.05, repeat: int = 5,
+                 extra_saves: int = 20, tasks: int = 200, workdir: str | None = None) -> None:
+        self.spec = spec
+        self.churn_rate = churn_rate
+        self.repeat = repeat
+        self.extra_saves = extra_saves
+        self.tasks = tasks
+        self.workdir = workdir
+        self.results: dict[str, dict[str, list[float]]] = {}
+        self.caches_dropped = False
+        self.project = ""
+
+    def _fresh_repository(self) -> Repository:
+        """ Repository as seen by a new notty process. """
+        Ignore._cache.clear()
+        return Repository(self.project)
+
+    def _cold(self) -> Repository:
+        self.caches_dropped = drop_caches()
+        return self._fresh_repository()
+
+    def _record(self, name: str, phase: str, seconds: float) -> None:
+        self.results.setdefault(name, {}).setdefault(phase, []).append(seconds)
+
+    def measure(self, name: str, operation: Callable[[Repository], object],
+                prepare: Callable[[], object] | None = None) -> None:
+        """ Measure operation once cold and repeat times warm, on the same
+        repository object. prepare is called before every run and is not measured. """
+        for phase, runs in (("cold", 1), ("warm", self.repeat)):
+            for _ in range(runs):
+                if prepare is not None:
+                    with quiet():
+                        prepare()
+                if phase == "cold":
+                    repository = self._cold()
+                self._record(name, phase, _timed(lambda: operation(repository)))
+
+    def run(self) -> dict:
+        root = tempfile.mkdtemp(prefix="notty-bench-", dir=self.workdir)
+        self.project = f"{root}/project"
+        try:
+            os.makedirs(self.project)
+            written = generate(self.project, self.spec)
+            with quiet():
+                Repository.create(self.project)
+
+            self._bench_startup()
+            self._bench_saves()
+            self._bench_catalog()
+            self._bench_rollback()
+            self._bench_status()
+            self._bench_remove()
+            self._bench_todo()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        return {
+            "version": RESULTS_VERSION,
+            "meta": {
+                "date": int(time.time()),
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "spec": self.spec.as_dict(),
+                "bytes": written,
+                "churn_rate": self.churn_rate,
+                "repeat": self.repeat,
+                "caches_dropped": self.caches_dropped,
+            },
+            "results": self.results,
+        }
+
+    def _bench_startup(self) -> None:
+        """ Wall time of whole CLI process, including interpreter start. """
+        for name, arguments in (("startup_help", ["--help"]), ("startup_list", ["list"])):
+            command = [sys.executable, f"{PACKAGE_ROOT}/main.py", *arguments]
+            for phase, runs in (("cold", 1), ("warm", self.repeat)):
+                for _ in range(runs):
+                    if phase == "cold":
+                        self.caches_dropped = drop_caches()
+                    start = time.perf_counter()
+                    subprocess.run(command, cwd=self.project, capture_output=True, check=True)
+                    self._record(name, phase, time.perf_counter() - start)
+
+    def _bench_saves(self) -> None:
+        repository = self._cold()
+        self._record("create_save_initial", "cold", _timed(lambda: repository.create_save("initial")))
+        self.measure("create_save_unchanged", lambda repository: repository.create_save("unchanged"))
+
+        seeds = iter(range(self.spec.seed + 1000, self.spec.seed + 2000))
+        self.measure(
+            "create_save_churn",
+            lambda repository: repository.create_save("churn"),
+            prepare=lambda: churn(self.project, self.spec, self.churn_rate, next(seeds))
+        )
+
+        with quiet():
+            repository = self._fresh_repository()
+            for index in range(self.extra_saves):
+                repository.create_save(f"extra {index}")
+
+    def _bench_catalog(self) -> None:
+        self.measure("get_all_saves", lambda repository: repository.get_all_saves())
+
+        prefix = self._fresh_repository().get_all_saves()[0].hash.full[:6]
+        self.measure("find_save", lambda repository: repository.find_save(prefix))
+
+    def _bench_rollback(self) -> None:
+        """ Cold run rolls back to the first save (everything churned has to be
+        restored), warm runs roll back to the same save again (nothing differs). """
+        first = self._fresh_repository().get_all_saves()[0]
+        self.measure("rollback_save", lambda repository: repository.rollback_save(first))
+
+        latest = self._fresh_repository().get_all_saves()[-1]
+        with quiet():
+            self._fresh_repository().rollback_save(latest)
+
+    def _bench_status(self) -> None:
+        """ Status of working tree identical to the head save. Files written just
+        before a scan are never trusted by index, so they become old first. """
+        time.sleep(RACY_WINDOW_NS / 1e9)
+        with quiet():
+            self._fresh_repository().status()
+        self.measure("status_clean", lambda repository: repository.status())
+
+    def _bench_remove(self) -> None:
+        victims = iter(self._fresh_repository().get_all_saves()[-(self.repeat + 1):])
+        self.measure("remove_save", lambda repository: repository.remove_save(next(victims)))
+
+    def _bench_todo(self) -> None:
+        repo_path = f"{self.project}/.notty"
+
+        def clear_tasks() -> None:
+            store = MetadataStore(repo_path)
+            store.clear_tasks()
+            store.close()
+
+        def add_tasks(_=None) -> None:
+            todo_list = Todo.TodoList(MetadataStore(repo_path))
+            for index in range(self.tasks):
+                todo_list.append_task(Todo.Task(f"task {index}", Todo.State.PENDING, Todo.Importance.LOW))
+            todo_list.store.close()
+
+        def show_tasks(_) -> None:
+            todo_list = Todo.TodoList(MetadataStore(repo_path))
+            todo_list.display_tasks()
+            todo_list.store.close()
+
+        def remove_tasks(_) -> None:
+            todo_list = Todo.TodoList(MetadataStore(repo_path))
+            for task in list(todo_list.iter_tasks()):
+                todo_list.remove_task(task.id)
+            todo_list.store.close()
+
+        self.measure("todo_add", add_tasks, prepare=clear_tasks)
+        self.measure("todo_show", show_tasks)
+        self.measure("todo_remove", remove_tasks, prepare=add_tasks)
+
+
+def summarize(results: dict) -> dict[str, float]:
+    """ Return {"operation/phase": median seconds} of results. """
+    return {
+        f"{name}/{phase}": statistics.median(runs)
+        for name, phases in results["results"].items()
+        for phase, runs in phases.items()
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[tuple[str, float, float, float, bool]]:
+    """ Return (key, baseline, current, ratio, is_regression) of every key present in
+    both results. Operation regressed if it got slower by more than threshold (0.1 = 10%). """
+    old = summarize(baseline)
+    new = summarize(current)
+    rows = []
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / old[key] if old[key] else float("inf")
+        rows.append((key, old[key], new[key], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def check_targets(results: dict) -> list[tuple[str, float, float, bool]]:
+    """ Return (key, median seconds, target, is_met) of every measured key with a target.
+    Per file targets are scaled by number of files of the measured project. """
+    medians = summarize(results)
+    files = results["meta"]["spec"]["files"]
+    rows = []
+    for key, target in TARGETS.items():
+        if key in medians:
+            target += PER_FILE_TARGETS.get(key, 0) * files
+            rows.append((key, medians[key], target, medians[key] <= target))
+    return rows
@@ -0,0 +1,121 @@
+""" Reproducible synthetic project trees. The same spec and seed always
+produce byte for byte identical trees, so results of different runs (and
+different notty versions) are comparable. """
+
+from dataclasses import dataclass, asdict
+import random
+import math
+import os
+
+WORDS = (
+    "def class return import self value data path file save tree index hash "
+    "for while if else try except with open read write list dict none true "
+    "false print result error state config test main core object stage"
+).split()
+TEXT_BLOCK_SIZE = 256 * 1024
+
+
+@dataclass
+class TreeSpec:
+    """ Shape of generated tree. File sizes follow log-normal distribution
+    around median_size (size_sigma controls spread), capped at max_size. """
+    files: int = 1000
+    median_size: int = 4096
+    size_sigma: float = 1.5
+    max_size: int = 64 * 1024 * 1024
+    depth: int = 4
+    fanout: int = 6
+    binary_ratio: float = 0.2
+    seed: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _text_block(rng: random.Random) -> bytes:
+    """ Source-code like text, compressible about as much as real code. """
+    lines = []
+    size = 0
+    while size < TEXT_BLOCK_SIZE:
+        indent = "    " * rng.randint(0, 3)
+        line = indent + " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 10))) + "\n"
+        lines.append(line)
+        size += len(line)
+    return "".join(lines).encode()
+
+
+def _directories(rng: random.Random, spec: TreeSpec) -> list[str]:
+    """ Return relative paths (empty for root, else ending with /) of all directories. """
+    directories = [""]
+    level = [""]
+    for depth in range(spec.depth):
+        next_level = []
+        for parent in level:
+            for index in range(rng.randint(1, spec.fanout)):
+                next_level.append(f"{parent}d{depth}_{index}/")
+        directories.extend(next_level)
+        level = next_level
+    return directories
+
+
+def _content(rng: random.Random, spec: TreeSpec, text: bytes) -> bytes:
+    size = min(spec.max_size, int(rng.lognormvariate(math.log(spec.median_size), spec.size_sigma)))
+    if rng.random() < spec.binary_ratio:
+        return rng.randbytes(size)
+
+    start = rng.randrange(len(text))
+    content = (text[start:] + text) * (size // len(text) + 1)
+    return content[:size]
+
+
+def _write(path: str, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def generate(root: str, spec: TreeSpec) -> int:
+    """ Fill root with tree described by spec. Return number of written bytes. """
+    rng = random.Random(spec.seed)
+    text = _text_block(rng)
+    directories = _directories(rng, spec)
+
+    written = 0
+    for index in range(spec.files):
+        directory = rng.choice(directories)
+        extension = ".bin" if rng.random() < spec.binary_ratio else ".py"
+        content = _content(rng, spec, text)
+        _write(f"{root}/{directory}f{index}{extension}", content)
+        written += len(content)
+    return written
+
+
+def churn(root: str, spec: TreeSpec, rate: float, seed: int) -> dict[str, int]:
+    """ Change rate (0-1) of files in the tree: 70% of them are modified, 15% deleted
+    and as many new files are added as 15% of them. Return counts of each change. """
+    rng = random.Random(seed)
+    text = _text_block(rng)
+    files = sorted(
+        os.path.join(directory, name)
+        for directory, dirnames, names in os.walk(root)
+        for name in names
+        if ".notty" not in directory
+    )
+    dirnames = sorted({os.path.dirname(path) for path in files}) or [root]
+
+    changed = rng.sample(files, min(len(files), round(len(files) * rate)))
+    counts = {"modified": 0, "deleted": 0, "added": 0}
+    for position, path in enumerate(changed):
+        kind = position % 20
+        if kind < 14:
+            with open(path, "r+b") as file:
+                file.seek(rng.randrange(max(1, os.path.getsize(path))))
+                file.write(_content(rng, spec, text)[:4096] or b"x")
+            counts["modified"] += 1
+        elif kind < 17:
+            os.remove(path)
+            counts["deleted"] += 1
+        else:
+            _write(f"{rng.choice(dirnames)}/new_{seed}_{position}.py", _content(rng, spec, text))
+            counts["added"] += 1
+    return counts
@@ -0,0 +1,131 @@
+""" Moving saves between machines as tar archives. Export streams blobs
+straight from object store into the archive and import stores members as
+they are read, so memory usage does not depend on size of the save and
+nothing is staged on disk. Archives are read and written as streams, so
+they can be piped (e.g. through ssh). """
+
+from typing import BinaryIO, Iterator
+import tarfile
+import stat
+
+from core.objects import ObjectStore
+from core.tree import Tree, TreeEntry
+from core.visuals import Progress
+import core.errors as Errors
+
+COMPRESSIONS: tuple[str, ...] = ("tar", "gz", "xz")
+SUFFIX_COMPRESSIONS: dict[str, str] = {
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+}
+DIRECTORY_MODE: int = 0o755
+
+
+def compression_for(file_name: str) -> str:
+    """ Return compression matching suffix of archive's file name. """
+    for suffix, compression in SUFFIX_COMPRESSIONS.items():
+        if file_name.endswith(suffix):
+            return compression
+    return "tar"
+
+
+class BlobReader:
+    """ Read-only file object over blocks of a stored blob. Blocks are
+    sliced, never joined, so reading in small pieces stays linear. """
+    __slots__ = ("_blocks", "_block", "_offset")
+
+    def __init__(self, blocks: Iterator[bytes]) -> None:
+        self._blocks = blocks
+        self._block = b""
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._block):
+                block = next(self._blocks, None)
+                if block is None:
+                    break
+                self._block, self._offset = block, 0
+
+            end = len(self._block) if size < 0 else min(len(self._block), self._offset + size)
+            parts.append(self._block[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return b"".join(parts)
+
+
+def export_tree(objects: ObjectStore, tree: Tree, output: BinaryIO, compression: str,
+                mtime: int, progress: Progress) -> None:
+    """ Write every directory and file of tree into tar archive streamed into output. """
+    mode = "w|" if compression == "tar" else f"w|{compression}"
+    with tarfile.open(fileobj=output, mode=mode, format=tarfile.PAX_FORMAT) as archive:
+        for directory in tree.directories:
+            info = tarfile.TarInfo(directory.rstrip("/"))
+            info.type = tarfile.DIRTYPE
+            info.mode = DIRECTORY_MODE
+            info.mtime = mtime
+            archive.addfile(info)
+
+        for entry in sorted(tree.entries.values(), key=lambda entry: entry.path):
+            info = tarfile.TarInfo(entry.path)
+            info.size = entry.size
+            info.mode = stat.S_IMODE(entry.mode)
+            info.mtime = mtime
+            archive.addfile(info, BlobReader(objects.iter_blocks(entry.hash)))
+            progress.advance(1, entry.size)
+
+
+def _member_path(name: str) -> str:
+    """ Return member's path relative to project's root ("" for the root). """
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if name.startswith("/") or ".." in parts:
+        raise Errors.ArchiveError(f"Member points outside of project: {name}")
+    return "/".join(parts)
+
+
+def import_tree(objects: ObjectStore, archive_input: BinaryIO, progress: Progress) -> tuple[Tree, list[str]]:
+    """ Store every regular file of tar archive (compressed or not) read from
+    archive_input and return tree of it with names of skipped members (links,
+    devices, repository's own directory). Members are read in archive's order. """
+    tree = Tree()
+    directories: set[str] = set()
+    skipped = []
+
+    try:
+        archive = tarfile.open(fileobj=archive_input, mode="r|*")
+    except tarfile.TarError as error:
+        raise Errors.ArchiveError(f"Cannot read archive: {error}") from error
+
+    with archive, objects.packing():
+        try:
+            for member in archive:
+                path = _member_path(member.name)
+                if not path:
+                    continue
+                if path == ".notty" or path.startswith(".notty/") or not (member.isdir() or member.isreg()):
+                    skipped.append(member.name)
+                    continue
+
+                if member.isdir():
+                    directories.add(path + "/")
+                    continue
+
+                full_hash = objects.store_stream(archive.extractfile(member), member.size)
+                tree.add(TreeEntry(path, full_hash, stat.S_IFREG | stat.S_IMODE(member.mode), member.size))
+                progress.advance(1, member.size)
+                if "/" in path:
+                    directories.add(path.rpartition("/")[0] + "/")
+        except tarfile.TarError as error:
+            raise Errors.ArchiveError(f"Cannot read archive: {error}") from error
+
+    # Archives do not need to list every directory, parents are added here.
+    for directory in list(directories):
+        while (directory := directory.rstrip("/").rpartition("/")[0]) and directory + "/" not in directories:
+            directories.add(directory + "/")
+
+    tree.directories = sorted(directories)
+    return tree, skipped
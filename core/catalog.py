@@ -0,0 +1,186 @@
+""" Append-only index of all saves stored in .notty/notty.catalog.
+Every line is a JSON record, so adding or forgetting a save appends a single
+line and listing saves never opens save directories. Lookups by abbreviated
+hash of any length use binary search over sorted hashes.
+Catalog is only written under a lock (notty.catalog.lock, where fcntl is
+available) and every writer first reads records other processes appended
+since, so compacting the catalog never drops a record. Reading never writes. """
+
+from dataclasses import dataclass, asdict
+from contextlib import contextmanager
+from typing import Iterator
+import bisect
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, catalog is then not locked against other processes.
+    fcntl = None
+
+CATALOG_FILE: str = "notty.catalog"
+LOCK_SUFFIX: str = ".lock"
+COMPACTION_RATIO: int = 2
+
+
+@dataclass
+class CatalogEntry:
+    """ Everything `list` and `desc` need to know about a save. """
+    hash: str
+    date_created: int | None
+    comment: str
+    size: int
+    parent: str | None
+
+
+class SaveCatalog:
+    """ In-memory view of catalog file. Records are applied in order:
+    >>> {"op": "add", "hash": ..., "date_created": ..., "comment": ..., "size": ..., "parent": ...}
+    >>> {"op": "remove", "hash": ...}
+    >>> {"op": "head", "hash": ...}
+    `head` is the save which working tree was last saved as or rolled back to,
+    it becomes the parent of the next save.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: dict[str, CatalogEntry] = {}
+        self.head: str | None = None
+        self._sorted_hashes: list[str] | None = None
+        self._records = 0
+        self._offset = 0
+        self._inode: int | None = None
+
+        if os.path.exists(path):
+            self._read_tail()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """ Hold exclusive lock of catalog, so no other process writes it. """
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + LOCK_SUFFIX, "a") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read_tail(self) -> bool:
+        """ Apply records appended since catalog was last read. Catalog replaced
+        by another process is read again from the start. Return whether the
+        last line is complete (interrupted append leaves it cut). """
+        try:
+            with open(self.path, "rb") as file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode != self._inode:
+                    self.entries, self.head, self._records, self._offset = {}, None, 0, 0
+                    self._inode = inode
+                file.seek(self._offset)
+                data = file.read()
+        except FileNotFoundError:
+            return True
+
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                # Line cut by an interrupted append.
+                continue
+            self._apply(record)
+            self._records += 1
+        self._offset += end
+        self._sorted_hashes = None
+        return end == len(data)
+
+    def _apply(self, record: dict) -> None:
+        operation = record.pop("op", None)
+        if operation == "add":
+            entry = CatalogEntry(**record)
+            self.entries[entry.hash] = entry
+        elif operation == "remove":
+            self.entries.pop(record["hash"], None)
+            if self.head == record["hash"]:
+                self.head = None
+        elif operation == "head":
+            self.head = record["hash"]
+        self._sorted_hashes = None
+
+    def _append(self, record: dict) -> None:
+        """ Append record after records of other processes. Catalog holding
+        much more records than entries is compacted then. """
+        with self._locked():
+            is_complete = self._read_tail()
+            line = json.dumps(record).encode("utf8") + b"\n"
+            with open(self.path, "ab") as file:
+                # Cut line is ended, so this record is not glued to it.
+                file.write(line if is_complete else b"\n" + line)
+                self._offset = file.tell()
+                self._inode = os.fstat(file.fileno()).st_ino
+            self._apply(dict(record))
+            self._records += 1
+
+            if self._records > COMPACTION_RATIO * (len(self.entries) + 1):
+                self._write(list(self.entries.values()))
+
+    def add(self, entry: CatalogEntry, is_head: bool = True) -> None:
+        """ Register new save and make it the head, unless is_head is False. """
+        self._append({"op": "add", **asdict(entry)})
+        if is_head:
+            self.set_head(entry.hash)
+
+    def remove(self, full_hash: str) -> None:
+        self._append({"op": "remove", "hash": full_hash})
+
+    def set_head(self, full_hash: str | None) -> None:
+        self._append({"op": "head", "hash": full_hash})
+
+    def rewrite(self, entries: list[CatalogEntry]) -> None:
+        """ Atomically replace catalog with given entries, dropping history. """
+        with self._locked():
+            self._write(entries)
+
+    def _write(self, entries: list[CatalogEntry]) -> None:
+        """ Replace catalog with entries, lock has to be held. """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf8") as file:
+            for entry in entries:
+                file.write(json.dumps({"op": "add", **asdict(entry)}) + "\n")
+            if self.head is not None and any(entry.hash == self.head for entry in entries):
+                file.write(json.dumps({"op": "head", "hash": self.head}) + "\n")
+            file.flush()
+            self._offset = file.tell()
+            self._inode = os.fstat(file.fileno()).st_ino
+        os.replace(temp_path, self.path)
+
+        head = self.head
+        self.entries = {entry.hash: entry for entry in entries}
+        self.head = head if head in self.entries else None
+        self._sorted_hashes = None
+        self._records = len(entries) + (self.head is not None)
+
+    def __iter__(self) -> Iterator[CatalogEntry]:
+        """ Yield entries in order they were saved. """
+        return iter(self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def find(self, prefix: str) -> list[CatalogEntry]:
+        """ Return all entries which hash starts with prefix. """
+        if self._sorted_hashes is None:
+            self._sorted_hashes = sorted(self.entries)
+
+        prefix = prefix.strip().lower()
+        position = bisect.bisect_left(self._sorted_hashes, prefix)
+        found = []
+        while position < len(self._sorted_hashes) and self._sorted_hashes[position].startswith(prefix):
+            found.append(self.entries[self._sorted_hashes[position]])
+            position += 1
+        return found
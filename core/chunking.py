@@ -0,0 +1,116 @@
+""" Content defined chunking of big files (FastCDC). Chunk boundaries depend
+only on the content around them, so inserting or changing bytes in the middle
+of a file changes only the chunks around the edit and all other chunks are
+shared with previous versions of the file and with other files.
+
+Gear hash is computed with numpy (optional dependency), a loop over every
+byte in Python would be hundreds of times slower than copying the file.
+Without numpy big files are stored whole, see is_available(). """
+
+from typing import BinaryIO, Iterator
+from functools import cache
+import importlib.util
+import hashlib
+
+MIN_SIZE: int = 256 * 1024
+AVERAGE_SIZE: int = 1024 * 1024
+MAX_SIZE: int = 4 * 1024 * 1024
+CHUNKING_THRESHOLD: int = 16 * 1024 * 1024
+NORMALIZATION_LEVEL: int = 2
+WINDOW_SIZE: int = 64
+SCAN_BLOCK_SIZE: int = 32 * 1024
+
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+# Gear table has to stay the same forever, otherwise files saved before
+# a change would be split differently and stop sharing chunks.
+GEAR: list[int] = [
+    int.from_bytes(hashlib.sha256(f"notty-gear-{byte}".encode()).digest()[:8], "big")
+    for byte in range(256)
+]
+
+
+def _mask(bits: int) -> int:
+    """ Mask over the highest bits of gear hash, which depend on the last 64 bytes. """
+    return ((1 << bits) - 1) << (_HASH_BITS - bits)
+
+_AVERAGE_BITS = AVERAGE_SIZE.bit_length() - 1
+MASK_SMALL: int = _mask(_AVERAGE_BITS + NORMALIZATION_LEVEL)
+MASK_LARGE: int = _mask(_AVERAGE_BITS - NORMALIZATION_LEVEL)
+
+
+@cache
+def is_available() -> bool:
+    """ Check if numpy is installed, without importing it (it is slow to import). """
+    return importlib.util.find_spec("numpy") is not None
+
+
+@cache
+def _gear_array():
+    import numpy
+    return numpy.array(GEAR, dtype=numpy.uint64)
+
+
+def _first_match(data: bytes, context_start: int, begin: int, end: int, mask: int) -> int | None:
+    """ Return first position in data[begin:end] where gear hash of bytes
+    data[context_start:position+1] has no bit of mask set, or None. Bit k of
+    hash is shifted out after k bytes, so only the last WINDOW_SIZE bytes
+    matter: hash = sum(GEAR[byte[position-k]] << k for k < WINDOW_SIZE).
+    The sum is built by doubling the window, 6 array operations in total. """
+    import numpy
+
+    first = max(context_start, begin - (WINDOW_SIZE - 1))
+    values = _gear_array()[numpy.frombuffer(data, dtype=numpy.uint8, count=end - first, offset=first)]
+    width = 1
+    while width < WINDOW_SIZE:
+        values[width:] += values[:-width] << numpy.uint64(width)
+        width *= 2
+
+    matches = numpy.flatnonzero((values[begin - first:] & numpy.uint64(mask)) == 0)
+    return begin + int(matches[0]) if len(matches) else None
+
+
+def find_boundary(data: bytes, start: int, end: int) -> int:
+    """ Return length of the chunk starting at data[start] and limited to data[:end].
+    First MIN_SIZE bytes are skipped, until AVERAGE_SIZE a stricter mask is used and
+    a looser one after that (normalized chunking), so chunk sizes stay close to average.
+    Hash is computed from the first byte after skipped ones. """
+    length = end - start
+    if length <= MIN_SIZE:
+        return length
+
+    normal_end = start + min(AVERAGE_SIZE, length)
+    limit = start + min(MAX_SIZE, length)
+    context_start = start + MIN_SIZE
+
+    for mask, begin, stop in ((MASK_SMALL, context_start, normal_end), (MASK_LARGE, normal_end, limit)):
+        # Scanned in blocks small enough to stay in CPU cache, which also lets
+        # the scan stop soon after the boundary.
+        for block_start in range(begin, stop, SCAN_BLOCK_SIZE):
+            position = _first_match(data, context_start, block_start, min(block_start + SCAN_BLOCK_SIZE, stop), mask)
+            if position is not None:
+                return position + 1 - start
+
+    return limit - start
+
+
+def iter_chunks(file: BinaryIO) -> Iterator[bytes]:
+    """ Split opened binary file into content defined chunks.
+    At most two MAX_SIZE blocks are held in memory. """
+    buffer = b""
+    eof = False
+
+    while True:
+        if not eof and len(buffer) < MAX_SIZE:
+            block = file.read(MAX_SIZE)
+            eof = not block
+            buffer += block
+            continue
+
+        if not buffer:
+            return
+
+        cut = find_boundary(buffer, 0, len(buffer))
+        yield buffer[:cut]
+        buffer = buffer[cut:]
@@ -0,0 +1,119 @@
+""" Comparing two states of a project (saves or working tree). States are
+compared by content hashes only, so unchanged files are never read. Line
+diffs are produced lazily and only for changed text files. """
+
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator
+from enum import Enum
+import difflib
+import stat
+
+BINARY_CHECK_SIZE: int = 8000
+DIFF_SIZE_LIMIT: int = 2 * 1024 * 1024
+
+State = dict[str, tuple[str, int]]
+
+
+class ChangeKind(Enum):
+    ADDED = "added"
+    DELETED = "deleted"
+    MODIFIED = "modified"
+    RENAMED = "renamed"
+    MODE = "mode changed"
+
+
+@dataclass
+class Change:
+    """ Single difference between two states. old_path is set for renames. """
+    kind: ChangeKind
+    path: str
+    old_hash: str | None
+    new_hash: str | None
+    old_path: str | None = None
+
+    def describe(self) -> str:
+        if self.kind == ChangeKind.RENAMED:
+            return f"{self.kind.value}: {self.old_path} -> {self.path}"
+        return f"{self.kind.value}: {self.path}"
+
+
+def compare(old: State, new: State) -> list[Change]:
+    """ Compare two {relative_path: (hash, mode)} states. Deleted and added
+    files with identical content are reported as renames. """
+    changes = []
+    deleted_by_hash: dict[str, list[str]] = {}
+
+    for path in sorted(old.keys() - new.keys()):
+        deleted_by_hash.setdefault(old[path][0], []).append(path)
+
+    for path in sorted(new.keys()):
+        new_hash, new_mode = new[path]
+        if path not in old:
+            renamed_from = deleted_by_hash.get(new_hash)
+            if renamed_from:
+                changes.append(Change(ChangeKind.RENAMED, path, new_hash, new_hash, renamed_from.pop(0)))
+            else:
+                changes.append(Change(ChangeKind.ADDED, path, None, new_hash))
+            continue
+
+        old_hash, old_mode = old[path]
+        if old_hash != new_hash:
+            changes.append(Change(ChangeKind.MODIFIED, path, old_hash, new_hash))
+        elif stat.S_IMODE(old_mode) != stat.S_IMODE(new_mode):
+            changes.append(Change(ChangeKind.MODE, path, old_hash, new_hash))
+
+    for paths in deleted_by_hash.values():
+        for path in paths:
+            changes.append(Change(ChangeKind.DELETED, path, old[path][0], None))
+
+    changes.sort(key=lambda change: change.path)
+    return changes
+
+
+def is_binary(data: bytes) -> bool:
+    """ Treat content with NUL byte in it's beginning or not encoded in UTF-8 as binary. """
+    if b"\0" in data[:BINARY_CHECK_SIZE]:
+        return True
+    try:
+        data.decode("utf8")
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def read_limited(blocks: Iterable[bytes]) -> bytes:
+    """ Join blocks, but stop after DIFF_SIZE_LIMIT + 1 bytes, which is enough
+    to tell the content is too big to be compared. """
+    data = bytearray()
+    for block in blocks:
+        data += block
+        if len(data) > DIFF_SIZE_LIMIT:
+            break
+    return bytes(data[:DIFF_SIZE_LIMIT + 1])
+
+
+def unified_diff(change: Change, read_old: Callable[[str, str], bytes], read_new: Callable[[str, str], bytes]) -> Iterator[str]:
+    """ Yield lines of unified diff of a change. read_old/read_new(path, hash) return
+    content of a file in the old/new state, at most DIFF_SIZE_LIMIT + 1 bytes of it.
+    Binary and too big files are only reported. """
+    if change.kind not in (ChangeKind.ADDED, ChangeKind.DELETED, ChangeKind.MODIFIED):
+        return
+
+    old_path = change.old_path or change.path
+    old_data = read_old(old_path, change.old_hash) if change.old_hash is not None else b""
+    new_data = read_new(change.path, change.new_hash) if change.new_hash is not None else b""
+
+    if max(len(old_data), len(new_data)) > DIFF_SIZE_LIMIT:
+        yield f"Files a/{old_path} and b/{change.path} differ (too big to compare)"
+        return
+    if is_binary(old_data) or is_binary(new_data):
+        yield f"Binary files a/{old_path} and b/{change.path} differ"
+        return
+
+    old_lines = old_data.decode("utf8").splitlines(keepends=True)
+    new_lines = new_data.decode("utf8").splitlines(keepends=True)
+    from_file = f"a/{old_path}" if change.old_hash is not None else "/dev/null"
+    to_file = f"b/{change.path}" if change.new_hash is not None else "/dev/null"
+
+    for line in difflib.unified_diff(old_lines, new_lines, from_file, to_file):
+        yield line.rstrip("\n")
@@ -8,3 +8,9 @@ class SaveError(Exception):
 
 class HashError(Exception):
     """ This exception is raised when an Hash is wrong. (e.g it's length) """
+
+class WatchError(Exception):
+    """ Raised when working tree cannot be watched for changes. """
+
+class ArchiveError(Exception):
+    """ Raised when archive cannot be imported as a save. """
@@ -0,0 +1,257 @@
+""" Garbage collection of the object store. Objects reachable from surviving
+saves are marked, unreachable loose objects are swept and small loose objects
+together with packs holding dead or few objects are rewritten into one new pack.
+Work is split into units (one fanout directory, one pack) and stops between
+them once time budget is used, remembering where to continue next run.
+Marking is not budgeted, sweeping without complete reachable set would remove
+live objects, so every run reads trees of all saves first. Saves running at
+the same time can merge packs, files gone meanwhile are skipped. """
+
+from dataclasses import dataclass
+from typing import Iterable
+import json
+import stat
+import time
+import os
+
+from core.objects import ObjectStore, OBJECT_MODE, PACK_OBJECT_LIMIT, COMPRESSED_SUFFIX, CHUNKED_SUFFIX
+from core.pack import PackIndex, PackWriter, FLAG_COMPRESSED, FLAG_CHUNKED, INDEX_SUFFIX
+from core.chunking import CHUNKING_THRESHOLD
+from core.tree import Tree
+import core.trace as Trace
+
+GC_STATE_FILE: str = "notty.gc"
+GRACE_PERIOD_S: int = 60 * 60
+SMALL_PACK_OBJECTS: int = 1024
+MAX_DEAD_RATIO: float = 0.2
+TEMP_SUFFIX: str = ".tmp"
+
+
+@dataclass
+class GcReport:
+    """ Summary of a single collection run. """
+    reachable: int = 0
+    removed_objects: int = 0
+    packed_objects: int = 0
+    rewritten_packs: int = 0
+    freed_bytes: int = 0
+    is_finished: bool = True
+
+
+def mark(objects: ObjectStore, trees: Iterable[Tree]) -> set[str]:
+    """ Return hashes of all objects referenced by trees, including chunks
+    of big files. Only files big enough to be chunked are looked up. """
+    reachable = set()
+    for tree in trees:
+        for entry in tree.entries.values():
+            if entry.hash in reachable:
+                continue
+            reachable.add(entry.hash)
+            if entry.size >= CHUNKING_THRESHOLD:
+                reachable.update(objects.chunk_hashes(entry.hash))
+    return reachable
+
+
+def _loose_object(fanout: str, name: str) -> tuple[str, int]:
+    """ Return hash and flags of loose object file. """
+    if name.endswith(COMPRESSED_SUFFIX):
+        return fanout + name.removesuffix(COMPRESSED_SUFFIX), FLAG_COMPRESSED
+    if name.endswith(CHUNKED_SUFFIX):
+        return fanout + name.removesuffix(CHUNKED_SUFFIX), FLAG_CHUNKED
+    return fanout + name, 0
+
+
+def _remove_empty_directory(path: str) -> None:
+    try:
+        os.rmdir(path)
+    except OSError:
+        # Directory still holds objects.
+        pass
+
+
+class GarbageCollector:
+    """ Single run of garbage collection over objects with given reachable set.
+    Files younger than grace_period seconds are never removed or rewritten, as
+    they can belong to a save which is being created right now. Age is taken
+    from ctime, as copied blobs can keep mtime of their source.
+    >>> GarbageCollector(objects, reachable, state_path, budget).run() -> GcReport
+    budget is a number of seconds or None to collect everything at once. It
+    starts when collector is made, after reachable set was marked.
+    """
+
+    def __init__(self, objects: ObjectStore, reachable: set[str], state_path: str,
+                 budget: float | None = None, grace_period: float = GRACE_PERIOD_S) -> None:
+        self.objects = objects
+        self.reachable = reachable
+        self.state_path = state_path
+        self.report = GcReport(reachable=len(reachable))
+        self._deadline = time.monotonic() + budget if budget is not None else None
+        self._young_after = time.time() - grace_period
+        self._packed_loose: list[str] = []
+
+    def _out_of_time(self) -> bool:
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self.report.is_finished = False
+            return True
+        return False
+
+    def _load_cursor(self) -> str:
+        try:
+            with open(self.state_path, "r", encoding="utf8") as file:
+                return json.load(file).get("cursor", "")
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return ""
+
+    def _dump_cursor(self, cursor: str) -> None:
+        with open(self.state_path, "w", encoding="utf8") as file:
+            json.dump({"cursor": cursor}, file)
+
+    def _remove(self, path: str, size: int | None = None) -> None:
+        """ Remove file and count it's size (read now if not given) as freed.
+        File removed meanwhile by another process is skipped. """
+        try:
+            if size is None:
+                size = os.path.getsize(path)
+            os.chmod(path, stat.S_IWRITE | OBJECT_MODE)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.report.freed_bytes += size
+
+    def run(self) -> GcReport:
+        writer = PackWriter(self.objects.pack_path)
+        try:
+            with Trace.span("sweep loose objects", "gc"):
+                self._sweep(writer)
+            with Trace.span("repack", "gc"):
+                consumed = self._select_packs()
+                rewritten = self._repack(writer, consumed)
+        except BaseException:
+            writer.abort()
+            raise
+
+        new_pack = writer.finish()
+        if new_pack is not None:
+            self.report.freed_bytes -= new_pack.size + new_pack.index_size
+            new_pack.close()
+
+        # New pack is in place, so objects copied into it can be removed.
+        self.objects.reload()
+        for pack in rewritten:
+            self._remove(pack.index_path)
+            self._remove(pack.pack_path)
+        for pack in consumed:
+            pack.close()
+        for path in self._packed_loose:
+            self._remove(path)
+            _remove_empty_directory(os.path.dirname(path))
+
+        self.report.rewritten_packs = len(rewritten)
+        self._remove_temp_files(self.objects.path)
+        self._remove_temp_files(self.objects.pack_path)
+        return self.report
+
+    def _sweep(self, writer: PackWriter) -> None:
+        """ Remove unreachable loose objects and pack small reachable ones,
+        one fanout directory at a time, starting where previous run stopped. """
+        if not os.path.isdir(self.objects.path):
+            return
+
+        cursor = self._load_cursor()
+        fanouts = sorted(
+            name for name in os.listdir(self.objects.path)
+            if len(name) == 2 and name >= cursor and os.path.isdir(f"{self.objects.path}/{name}")
+        )
+        for fanout in fanouts:
+            if self._out_of_time():
+                self._dump_cursor(fanout)
+                return
+            self._sweep_directory(fanout, writer)
+        self._dump_cursor("")
+
+    def _sweep_directory(self, fanout: str, writer: PackWriter) -> None:
+        directory = f"{self.objects.path}/{fanout}"
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                file_stat = entry.stat()
+                if file_stat.st_ctime > self._young_after:
+                    continue
+                if entry.name.endswith(TEMP_SUFFIX):
+                    self._remove(entry.path, file_stat.st_size)
+                    continue
+
+                full_hash, flags = _loose_object(fanout, entry.name)
+                if full_hash not in self.reachable:
+                    self._remove(entry.path, file_stat.st_size)
+                    self.report.removed_objects += 1
+                elif file_stat.st_size <= PACK_OBJECT_LIMIT:
+                    with open(entry.path, "rb") as file:
+                        writer.add(full_hash, file.read(), flags)
+                    self._packed_loose.append(entry.path)
+                    self.report.packed_objects += 1
+
+        _remove_empty_directory(directory)
+
+    def _select_packs(self) -> list[PackIndex]:
+        """ Return packs worth rewriting: holding more than MAX_DEAD_RATIO of dead
+        data or only a few objects, most dead data first. Packs younger than
+        grace period are never chosen. """
+        if not os.path.isdir(self.objects.pack_path):
+            return []
+
+        candidates = []
+        for name in sorted(os.listdir(self.objects.pack_path)):
+            index_path = f"{self.objects.pack_path}/{name}"
+            if not name.endswith(INDEX_SUFFIX):
+                continue
+            try:
+                if os.stat(index_path).st_ctime > self._young_after:
+                    continue
+                pack = PackIndex(index_path)
+            except FileNotFoundError:
+                continue
+
+            total = dead = 0
+            for full_hash, _, length, _ in pack.entries():
+                total += length
+                if full_hash not in self.reachable:
+                    dead += length
+
+            if dead > total * MAX_DEAD_RATIO or len(pack) < SMALL_PACK_OBJECTS:
+                candidates.append((dead, pack))
+            else:
+                pack.close()
+
+        # Rewriting single small pack without anything to merge it with saves nothing.
+        if len(candidates) == 1 and candidates[0][0] == 0 and not self._packed_loose:
+            candidates[0][1].close()
+            return []
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [pack for _, pack in candidates]
+
+    def _repack(self, writer: PackWriter, packs: list[PackIndex]) -> list[PackIndex]:
+        """ Copy reachable objects of packs into writer until time runs out.
+        Return packs which were copied completely. """
+        rewritten = []
+        for pack in packs:
+            if self._out_of_time():
+                break
+            for full_hash, offset, length, flags in pack.entries():
+                if full_hash in self.reachable:
+                    writer.add(full_hash, pack.read(offset, length), flags)
+                else:
+                    self.report.removed_objects += 1
+            rewritten.append(pack)
+        return rewritten
+
+    def _remove_temp_files(self, directory: str) -> None:
+        """ Remove temporary files left by interrupted saves. """
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(TEMP_SUFFIX) and entry.is_file():
+                    file_stat = entry.stat()
+                    if file_stat.st_ctime <= self._young_after:
+                        self._remove(entry.path, file_stat.st_size)
@@ -0,0 +1,258 @@
+""" Searching content of saves. Every text blob is indexed by the set of it's
+trigrams (3 byte sequences) kept in the metadata store. Blobs stored by a
+save are indexed by a detached process started after the save, so saving
+does not wait for it. A regular expression is turned into trigrams every
+match must contain, only blobs having all of them are read, and every blob
+is searched once, no matter how many saves contain it. Blobs which are not
+indexed yet are always searched, so results never depend on the index. """
+
+from dataclasses import dataclass, field
+from typing import Iterable
+import re
+import os
+
+from core.store import MetadataStore
+from core.objects import ObjectStore
+from core.tree import Tree, TREE_FILE
+import core.diff as Diff
+import core.process as Process
+import core.trace as Trace
+
+INDEX_BATCH_SIZE: int = 256
+MAX_LINE_LENGTH: int = 300
+
+# Query is None (anything can match), a literal every match contains, or
+# ("and" | "or", [queries]).
+Query = None | bytes | tuple[str, list["Query"]]
+
+
+def trigrams(data: bytes) -> set[int]:
+    """ Return every 3 byte sequence of data as 24 bit integer. Unique
+    sequences are found first, as converting each of them costs more. """
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+def _is_text(first_block: bytes) -> bool:
+    """ Binary blobs are told by NUL byte in their beginning, like in diff. """
+    return b"\0" not in first_block[:Diff.BINARY_CHECK_SIZE]
+
+
+def blob_trigrams(objects: ObjectStore, full_hash: str) -> set[int] | None:
+    """ Return trigrams of stored blob, None if it is binary. Blob is read
+    in blocks, so memory usage does not depend on it's size. """
+    found: set[int] = set()
+    tail = b""
+    for index, block in enumerate(objects.iter_blocks(full_hash)):
+        if index == 0 and not _is_text(block):
+            return None
+        data = tail + block
+        found |= trigrams(data)
+        tail = data[-2:]
+    return found
+
+
+def index_blobs(objects: ObjectStore, store: MetadataStore, hashes: Iterable[str]) -> int:
+    """ Add blobs which are not indexed yet to the index, INDEX_BATCH_SIZE
+    per transaction. Return number of indexed blobs. """
+    known = store.indexed_blobs()
+    pending = sorted({full_hash for full_hash in hashes if full_hash not in known})
+    indexed = 0
+    for start in range(0, len(pending), INDEX_BATCH_SIZE):
+        blobs: dict[str, bool] = {}
+        postings: dict[str, set[int]] = {}
+        for full_hash in pending[start:start + INDEX_BATCH_SIZE]:
+            try:
+                found = blob_trigrams(objects, full_hash)
+            except FileNotFoundError:
+                continue
+            blobs[full_hash] = found is not None
+            if found is not None:
+                postings[full_hash] = found
+        indexed += store.add_trigram_batch(blobs, postings)
+    return indexed
+
+
+def tree_hashes(repo_path: str, save_hashes: Iterable[str]) -> set[str]:
+    """ Return hashes of blobs referenced by trees of given saves. """
+    hashes = set()
+    for save_hash in save_hashes:
+        tree_path = f"{repo_path}/saves/{save_hash}/{TREE_FILE}"
+        if os.path.exists(tree_path):
+            hashes.update(Tree.load(tree_path).hashes())
+    return hashes
+
+
+def update_index(repo_path: str, save_hashes: list[str]) -> None:
+    """ Index blobs of given saves, run in background by index_in_background. """
+    store = MetadataStore(repo_path)
+    try:
+        index_blobs(ObjectStore(f"{repo_path}/objects"), store, tree_hashes(repo_path, save_hashes))
+    finally:
+        store.close()
+
+
+def index_in_background(repo_path: str, save_hashes: list[str]) -> None:
+    """ Start detached process indexing blobs of given saves. """
+    Process.run_detached("from core.grep import update_index; update_index(sys.argv[1], sys.argv[2:])",
+                         repo_path, *save_hashes, cwd=repo_path)
+
+
+# -- QUERY --
+
+def _sequence_query(items) -> Query:
+    """ Return query of parsed regular expression sequence. Neighbouring
+    literals form a run, runs of at least 3 bytes are required in matches. """
+    from re import _constants as constants
+
+    required: list[Query] = []
+    run = bytearray()
+
+    def flush() -> None:
+        if len(run) >= 3:
+            required.append(bytes(run))
+        run.clear()
+
+    for op, argument in items:
+        if op is constants.LITERAL:
+            run += chr(argument).encode("utf8")
+            continue
+        flush()
+
+        if op is constants.SUBPATTERN:
+            _, add_flags, _, pattern = argument
+            if not add_flags & constants.SRE_FLAG_IGNORECASE:
+                required.append(_sequence_query(pattern))
+        elif op in (constants.MAX_REPEAT, constants.MIN_REPEAT, constants.POSSESSIVE_REPEAT):
+            minimum, _, pattern = argument
+            if minimum >= 1:
+                required.append(_sequence_query(pattern))
+        elif op is constants.ATOMIC_GROUP:
+            required.append(_sequence_query(argument))
+        elif op is constants.BRANCH:
+            branches = [_sequence_query(branch) for branch in argument[1]]
+            if all(branch is not None for branch in branches):
+                required.append(("or", branches))
+    flush()
+
+    required = [query for query in required if query is not None]
+    if not required:
+        return None
+    return required[0] if len(required) == 1 else ("and", required)
+
+
+def required_query(pattern: str) -> Query:
+    """ Return what every match of pattern has to contain. Patterns which
+    cannot be analysed (or are case insensitive) can match anything. """
+    from re import _parser as parser, _constants as constants
+
+    try:
+        parsed = parser.parse(pattern)
+    except re.error:
+        return None
+    if parsed.state.flags & constants.SRE_FLAG_IGNORECASE:
+        return None
+    return _sequence_query(parsed)
+
+
+def _candidates(store: MetadataStore, query: Query, cache: dict[int, set[int]]) -> set[int] | None:
+    """ Return ids of indexed blobs which can match query, None if any can. """
+    if query is None:
+        return None
+
+    if isinstance(query, bytes):
+        found = None
+        for trigram in sorted(trigrams(query)):
+            if trigram not in cache:
+                cache[trigram] = store.trigram_postings(trigram)
+            found = cache[trigram] if found is None else found & cache[trigram]
+            if not found:
+                break
+        return found
+
+    kind, queries = query
+    results = [_candidates(store, subquery, cache) for subquery in queries]
+    if kind == "or":
+        if any(result is None for result in results):
+            return None
+        return set().union(*results)
+
+    known = [result for result in results if result is not None]
+    if not known:
+        return None
+    return set.intersection(*known)
+
+
+# -- SEARCH --
+
+@dataclass
+class Match:
+    """ Lines of a file matching pattern. saves are short hashes of all searched
+    saves containing this content under this path, oldest first. """
+    path: str
+    hash: str
+    saves: list[str] = field(default_factory=list)
+    lines: list[tuple[int, str]] = field(default_factory=list)
+
+
+def _search_blob(objects: ObjectStore, full_hash: str, regex: re.Pattern) -> list[tuple[int, str]] | None:
+    """ Return numbered lines of stored blob matching regex, None if it is
+    binary. Blob is read in blocks and searched line by line. """
+    lines = []
+    lineno = 0
+    rest = b""
+    for index, block in enumerate(objects.iter_blocks(full_hash)):
+        if index == 0 and not _is_text(block):
+            return None
+        *complete, rest = (rest + block).split(b"\n")
+        for line in complete:
+            lineno += 1
+            text = line.decode("utf8", errors="replace")
+            if regex.search(text):
+                lines.append((lineno, text.strip()[:MAX_LINE_LENGTH]))
+    if rest:
+        text = rest.decode("utf8", errors="replace")
+        if regex.search(text):
+            lines.append((lineno + 1, text.strip()[:MAX_LINE_LENGTH]))
+    return lines
+
+
+def search(objects: ObjectStore, store: MetadataStore, saves: list[tuple[str, Tree]],
+           pattern: str) -> tuple[list[Match], list[str]]:
+    """ Search files of given (short hash, tree) saves, oldest first, for lines
+    matching pattern. Return matches in order of their first appearance and
+    hashes of blobs which were read without being indexed. """
+    regex = re.compile(pattern)
+    occurrences: dict[tuple[str, str], Match] = {}
+    for short_hash, tree in saves:
+        for entry in tree.entries.values():
+            key = (entry.path, entry.hash)
+            if key not in occurrences:
+                occurrences[key] = Match(entry.path, entry.hash)
+            occurrences[key].saves.append(short_hash)
+
+    unique = {full_hash for _, full_hash in occurrences}
+    indexed = store.indexed_blobs()
+    candidate_ids = _candidates(store, required_query(pattern), {})
+
+    searched: dict[str, list[tuple[int, str]]] = {}
+    unindexed = []
+    for full_hash in sorted(unique):
+        if full_hash in indexed:
+            blob_id, is_text = indexed[full_hash]
+            if not is_text or (candidate_ids is not None and blob_id not in candidate_ids):
+                continue
+        else:
+            unindexed.append(full_hash)
+
+        Trace.count("blobs_searched")
+        try:
+            searched[full_hash] = _search_blob(objects, full_hash, regex) or []
+        except FileNotFoundError:
+            continue
+
+    matches = []
+    for match in occurrences.values():
+        match.lines = searched.get(match.hash, [])
+        if match.lines:
+            matches.append(match)
+    return matches, unindexed
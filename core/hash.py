@@ -4,14 +4,17 @@ from dataclasses import dataclass
 import hashlib
 
 SHORT_LENGTH = 5
+READ_BLOCK_SIZE = 1024 * 1024
 
 
 @dataclass
 class Hash:
     """ Represents hashed data using SHA256 algorithm.
-    It contains two object generator functions:
+    It contains four object generator functions:
     >>> generate(data: str) -> Hash
     >>> generate_from_full(full_hash: str) -> Hash
+    >>> generate_from_bytes(data: bytes) -> Hash
+    >>> generate_from_file(path: str) -> Hash
     and two magic methods:
     >>> __eq__: Check if a string is equal to short or full form.
     >>> __str__: return this Hash's data in "(short) full" form.
@@ -38,6 +41,21 @@ class Hash:
         short_hash = full_hash[:SHORT_LENGTH]
         return Hash(full_hash, short_hash)
 
+    @staticmethod
+    def generate_from_bytes(data: bytes) -> "Hash":
+        """ Generate new Hash object describing raw content. """
+        return Hash.generate_from_full(hashlib.sha256(data).hexdigest())
+
+    @staticmethod
+    def generate_from_file(path: str) -> "Hash":
+        """ Generate new Hash object describing file's content.
+        File is read in READ_BLOCK_SIZE blocks, so memory usage is constant. """
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            while block := file.read(READ_BLOCK_SIZE):
+                hasher.update(block)
+        return Hash.generate_from_full(hasher.hexdigest())
+
     def __eq__(self, value: object) -> bool:
         """ Check if given value is equal to either full or short hash representation. """
         if not isinstance(value, str):
@@ -0,0 +1,146 @@
+""" Ignore rules with gitignore semantics, compiled once into regular
+expressions and cached on ignore file's mtime.
+
+Supported syntax (one pattern per line, # starts a comment):
+    name        matches file or directory called `name` at any depth
+    *.pyc       * and ? do not match /, [abc] matches one of characters
+    dir/        trailing / matches directories only
+    /build      leading / (or / inside pattern) anchors pattern to project's root
+    docs/**     ** matches any number of directories
+    !keep.pyc   ! re-includes paths excluded by earlier patterns
+Last matching pattern decides. Content of ignored directory is never walked,
+so it's files cannot be re-included.
+"""
+
+from dataclasses import dataclass
+import hashlib
+import re
+import os
+
+
+@dataclass
+class _Group:
+    """ Consecutive patterns of the same kind merged into one expression. """
+    negated: bool
+    any_path: re.Pattern | None
+    directory_only: re.Pattern | None
+
+
+def translate(pattern: str) -> str:
+    """ Turn single gitignore glob (without !, and trailing /) into regex source. """
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.lstrip("/")
+
+    result = ""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            result += "(?:.*/)?"
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            result += ".*"
+            index += 2
+            continue
+
+        if char == "*":
+            result += "[^/]*"
+        elif char == "?":
+            result += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", index + 2)
+            if end == -1:
+                result += re.escape(char)
+            else:
+                body = pattern[index+1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                result += f"[{body.replace(chr(92), chr(92)*2)}]"
+                index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            result += re.escape(pattern[index])
+        else:
+            result += re.escape(char)
+        index += 1
+
+    if not anchored:
+        result = "(?:.*/)?" + result
+    return result
+
+
+class IgnoreMatcher:
+    """ Decide whether relative, /-separated path should be ignored.
+    >>> matcher.is_ignored("src/__pycache__", is_dir=True) -> bool
+    `key` identifies the rules, it changes whenever rules change.
+    """
+
+    def __init__(self, lines: list[str]) -> None:
+        patterns = [
+            line.rstrip("\n").rstrip("\r")
+            for line in lines
+        ]
+        patterns = [
+            pattern.rstrip() if not pattern.endswith("\\ ") else pattern
+            for pattern in patterns
+            if pattern.strip() and not pattern.startswith("#")
+        ]
+        self.patterns = patterns
+        self.key = hashlib.sha256("\n".join(patterns).encode()).hexdigest()
+        self._groups = self._compile(patterns)
+
+    @staticmethod
+    def _compile(patterns: list[str]) -> list[_Group]:
+        """ Split patterns into runs of negated/not negated rules and merge
+        each run into two expressions: for any path and for directories only. """
+        runs: list[tuple[bool, list[str], list[str]]] = []
+        for pattern in patterns:
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+                pattern = pattern[1:]
+
+            directory_only = pattern.endswith("/")
+            source = translate(pattern.rstrip("/"))
+
+            if not runs or runs[-1][0] != negated:
+                runs.append((negated, [], []))
+            runs[-1][2 if directory_only else 1].append(source)
+
+        def join(sources: list[str]) -> re.Pattern | None:
+            if not sources:
+                return None
+            return re.compile("(?:" + "|".join(sources) + r")\Z", re.DOTALL)
+
+        return [_Group(negated, join(any_path), join(directory_only)) for negated, any_path, directory_only in runs]
+
+    def is_ignored(self, relative_path: str, is_dir: bool) -> bool:
+        for group in reversed(self._groups):
+            if group.any_path is not None and group.any_path.match(relative_path):
+                return not group.negated
+            if is_dir and group.directory_only is not None and group.directory_only.match(relative_path):
+                return not group.negated
+        return False
+
+
+_cache: dict[str, tuple[int, int, IgnoreMatcher]] = {}
+
+
+def load(path: str) -> IgnoreMatcher:
+    """ Return matcher compiled from ignore file. Matcher is reused
+    as long as file's mtime and size did not change. """
+    try:
+        file_stat = os.stat(path)
+    except FileNotFoundError:
+        return IgnoreMatcher([])
+
+    cached = _cache.get(path)
+    if cached is not None and cached[:2] == (file_stat.st_mtime_ns, file_stat.st_size):
+        return cached[2]
+
+    with open(path, "r", encoding="utf8") as file:
+        matcher = IgnoreMatcher(file.readlines())
+    _cache[path] = (file_stat.st_mtime_ns, file_stat.st_size, matcher)
+    return matcher
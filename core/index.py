@@ -0,0 +1,319 @@
+""" Working tree index. Remembers stat information and content hash of every
+project's file, so a save has to read only files which changed since the
+previous scan. Directories which mtime did not change are not listed again.
+Stat information and hashes of a directory's files are packed into two bytes
+objects, so index is loaded without creating an object per file and files of
+an unchanged directory are checked with a single comparison. Root hash of the
+indexed state is kept as well, so unchanged working tree is recognized
+without building it's tree. """
+
+from dataclasses import dataclass
+from typing import Iterator
+import marshal
+import struct
+import time
+import os
+
+import core.walker as Walker
+import core.trace as Trace
+
+INDEX_FILE: str = "notty.index"
+INDEX_VERSION: int = 2
+RACY_WINDOW_NS: int = 2_000_000_000
+# Stored instead of mtime of directory listed within racy window, matches no mtime.
+RACY_MTIME_NS: int = -1
+# size, mtime_ns, inode, mode
+SIGNATURE = struct.Struct("<qqQI")
+HASH_SIZE: int = 32
+# Stored for files which have to be read again, matches no real file (mode is never 0).
+UNKNOWN_SIGNATURE: bytes = bytes(SIGNATURE.size)
+UNKNOWN_HASH: bytes = bytes(HASH_SIZE)
+
+
+def signature(file_stat: os.stat_result) -> bytes:
+    """ Return packed stat information of a file, which changes whenever it's content may have. """
+    return SIGNATURE.pack(file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_mode)
+
+
+@dataclass(slots=True)
+class DirectoryEntry:
+    """ Cached listing of a directory, valid as long as it's mtime is the same.
+    Signature and hash of every file are stored at it's position in files. """
+    mtime_ns: int
+    files: tuple[str, ...]
+    directories: tuple[str, ...]
+    signatures: bytes = b""
+    hashes: bytes = b""
+
+    def file_data(self) -> dict[str, tuple[bytes, bytes]]:
+        """ Return {name: (signature, hash)} of indexed files. """
+        size = SIGNATURE.size
+        return {
+            name: (self.signatures[position * size:(position + 1) * size],
+                   self.hashes[position * HASH_SIZE:(position + 1) * HASH_SIZE])
+            for position, name in enumerate(self.files)
+        }
+
+
+class WorkingIndex:
+    """ Persistent stat cache of the working tree stored in .notty/notty.index.
+
+    >>> scan(root, ignore_key, is_ignored) -> Iterator[(relative_path, absolute_path, stat, hash | None)]
+        Walk working tree and yield every file. Hash is None if file changed
+        and has to be read again, caller should then pass new hash to update().
+    >>> is_unchanged(root, ignore_key) -> bool
+    >>> update(relative_path, stat, hash, trusted=False)
+    >>> forget(relative_path)
+    >>> remember_root_hash(root_hash)
+    >>> dump()
+
+    root_hash is the hash of tree made from indexed state (see remember_root_hash),
+    None once anything changed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.directories: dict[str, DirectoryEntry] = {}
+        self.ignore_key = ""
+        self.root_hash: str | None = None
+        self.is_dirty = False
+        self._scan_started_ns = 0
+        # Files updated since last scan, None when they have to be read again.
+        self._pending: dict[str, tuple[bytes, bytes] | None] = {}
+        # Files outside of any listing (e.g. restored into new directory), used by next scan.
+        self._loose: dict[str, tuple[bytes, bytes]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        """ Read index file. Missing, corrupted or outdated index is treated as empty. """
+        try:
+            with open(self.path, "rb") as file:
+                content = marshal.load(file)
+            version, ignore_key, root_hash, directories, loose = content
+        except (FileNotFoundError, EOFError, ValueError, TypeError):
+            return
+
+        if version != INDEX_VERSION:
+            return
+
+        self.ignore_key = ignore_key
+        self.root_hash = root_hash
+        self.directories = {path: DirectoryEntry(*fields) for path, fields in directories.items()}
+        self._loose = loose
+
+    def dump(self) -> None:
+        """ Atomically write index to it's file if anything changed. """
+        self._apply_pending()
+        if not self.is_dirty:
+            return
+
+        content = (
+            INDEX_VERSION,
+            self.ignore_key,
+            self.root_hash,
+            {
+                path: (entry.mtime_ns, entry.files, entry.directories, entry.signatures, entry.hashes)
+                for path, entry in self.directories.items()
+            },
+            self._loose,
+        )
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            marshal.dump(content, file)
+        os.replace(temp_path, self.path)
+        self.is_dirty = False
+
+    def _changed(self) -> None:
+        self.is_dirty = True
+        self.root_hash = None
+
+    def update(self, relative_path: str, file_stat: os.stat_result, full_hash: str, trusted: bool = False) -> None:
+        """ Remember hash of freshly read file. Files modified just before the
+        scan are not cached, as another write within the same mtime tick
+        would not be noticed. Files written by notty itself are trusted. """
+        self._changed()
+        if not trusted and file_stat.st_mtime_ns >= self._scan_started_ns - RACY_WINDOW_NS:
+            self._pending[relative_path] = None
+            return
+        self._pending[relative_path] = (signature(file_stat), bytes.fromhex(full_hash))
+
+    def forget(self, relative_path: str) -> None:
+        """ Drop entry of removed file. """
+        self._changed()
+        self._pending[relative_path] = None
+
+    def remember_root_hash(self, root_hash: str) -> None:
+        """ Remember root hash of tree made from the current indexed state. """
+        self._apply_pending()
+        if root_hash != self.root_hash:
+            self.root_hash = root_hash
+            self.is_dirty = True
+
+    def _apply_pending(self) -> None:
+        """ Write updated files into their directories' listings. """
+        by_directory: dict[str, list[tuple[str, tuple[bytes, bytes] | None]]] = {}
+        for relative_path, data in self._pending.items():
+            directory, _, name = relative_path.rpartition("/")
+            by_directory.setdefault(directory + "/" if directory else "", []).append((name, data))
+        self._pending = {}
+
+        for directory, updates in by_directory.items():
+            listing = self.directories.get(directory)
+            positions = {name: position for position, name in enumerate(listing.files)} if listing is not None else {}
+            signatures = bytearray(listing.signatures) if listing is not None else None
+            hashes = bytearray(listing.hashes) if listing is not None else None
+
+            for name, data in updates:
+                position = positions.get(name)
+                if position is None:
+                    if data is None:
+                        self._loose.pop(directory + name, None)
+                    else:
+                        self._loose[directory + name] = data
+                    continue
+                file_signature, file_hash = data if data is not None else (UNKNOWN_SIGNATURE, UNKNOWN_HASH)
+                signatures[position * SIGNATURE.size:(position + 1) * SIGNATURE.size] = file_signature
+                hashes[position * HASH_SIZE:(position + 1) * HASH_SIZE] = file_hash
+
+            if listing is not None:
+                listing.signatures = bytes(signatures)
+                listing.hashes = bytes(hashes)
+
+    def is_unchanged(self, root: str, ignore_key: str) -> bool:
+        """ Check that working tree is exactly the indexed state, so root_hash
+        describes it. Only stat of every file and directory is read and check
+        stops at the first difference. Racy or updated files and directories
+        make it fail, scan() has to look at them. """
+        if self._pending or ignore_key != self.ignore_key or "" not in self.directories:
+            return False
+
+        root = root.rstrip("/")
+        pack = SIGNATURE.pack
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            listing = self.directories.get(relative_dir)
+            if listing is None:
+                return False
+            prefix = f"{root}/{relative_dir}"
+            try:
+                if os.stat(prefix).st_mtime_ns != listing.mtime_ns:
+                    return False
+                signatures = b"".join([
+                    pack(file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_mode)
+                    for file_stat in map(os.stat, [prefix + name for name in listing.files])
+                ])
+            except OSError:
+                return False
+            if signatures != listing.signatures:
+                return False
+            Trace.count("files_scanned", len(listing.files))
+            pending.extend(relative_dir + name + "/" for name in listing.directories)
+        return True
+
+    def scan(self, root: str, ignore_key: str, is_ignored) -> Iterator[tuple[str, str, os.stat_result, str | None]]:
+        """ Walk working tree starting at root. is_ignored(relative_path, is_dir)
+        decides which paths are skipped. Cached listings are dropped when ignore_key (content of ignore
+        rules) differs from the one used to build them. Entries of files which were
+        not found are removed from the index once scan is exhausted. """
+        self._scan_started_ns = time.time_ns()
+        self._apply_pending()
+        is_listing_valid = ignore_key == self.ignore_key
+        if not is_listing_valid:
+            self.ignore_key = ignore_key
+            self._changed()
+
+        old_directories = self.directories
+        old_loose = self._loose
+        self.directories = {}
+        self._loose = {}
+
+        root = root.rstrip("/")
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            cached = old_directories.get(relative_dir)
+            listing, fresh_entries = self._list_directory(
+                root, relative_dir, cached if is_listing_valid else None, is_ignored
+            )
+            if listing is None:
+                self._changed()
+                continue
+
+            Trace.count("files_scanned", len(listing.files))
+            pending.extend(relative_dir + name + "/" for name in reversed(listing.directories))
+
+            prefix = f"{root}/{relative_dir}"
+            found = []
+            for name in listing.files:
+                try:
+                    if fresh_entries is not None:
+                        file_stat = fresh_entries[name].stat()
+                    else:
+                        file_stat = os.stat(prefix + name)
+                except FileNotFoundError:
+                    continue
+                found.append((name, file_stat, signature(file_stat)))
+
+            signatures = b"".join(file_signature for _, _, file_signature in found)
+            if fresh_entries is None and len(found) == len(listing.files) and signatures == listing.signatures:
+                # Nothing in directory changed, listing is kept as it is.
+                self.directories[relative_dir] = listing
+                for position, (name, file_stat, _) in enumerate(found):
+                    full_hash = listing.hashes[position * HASH_SIZE:(position + 1) * HASH_SIZE]
+                    yield relative_dir + name, prefix + name, file_stat, (None if full_hash == UNKNOWN_HASH else full_hash.hex())
+                continue
+
+            self._changed()
+            known = cached.file_data() if cached is not None else {}
+            hashes = []
+            for name, file_stat, file_signature in found:
+                relative_path = relative_dir + name
+                cached_signature, full_hash = known.get(name) or old_loose.get(relative_path, (None, UNKNOWN_HASH))
+                if cached_signature != file_signature:
+                    full_hash = UNKNOWN_HASH
+                hashes.append(full_hash)
+                yield relative_path, prefix + name, file_stat, (None if full_hash == UNKNOWN_HASH else full_hash.hex())
+
+            self.directories[relative_dir] = DirectoryEntry(
+                listing.mtime_ns,
+                tuple(name for name, _, _ in found),
+                listing.directories,
+                b"".join(
+                    UNKNOWN_SIGNATURE if full_hash == UNKNOWN_HASH else file_signature
+                    for (_, _, file_signature), full_hash in zip(found, hashes)
+                ),
+                b"".join(hashes),
+            )
+
+    def _list_directory(self, root: str, relative_dir: str, cached: DirectoryEntry | None, is_ignored
+                        ) -> tuple[DirectoryEntry | None, dict[str, os.DirEntry] | None]:
+        """ Return listing of directory and, if it was read now, DirEntry of every
+        file, so their stat can be reused. Cached listing is reused without reading
+        directory when directory's mtime did not change. Directories modified just
+        before the scan get listing which is never reused, for the same reason as
+        racy files in update(). Ignored directories are left out, so they are never entered. """
+        try:
+            dir_stat = os.stat(f"{root}/{relative_dir}")
+        except FileNotFoundError:
+            return None, None
+
+        if cached is not None and cached.mtime_ns == dir_stat.st_mtime_ns:
+            return cached, None
+
+        try:
+            files, directories = Walker.list_directory(root, relative_dir, is_ignored)
+        except (FileNotFoundError, NotADirectoryError):
+            return None, None
+
+        mtime_ns = dir_stat.st_mtime_ns
+        if mtime_ns >= self._scan_started_ns - RACY_WINDOW_NS:
+            mtime_ns = RACY_MTIME_NS
+
+        listing = DirectoryEntry(
+            mtime_ns,
+            tuple(entry.name for entry in files),
+            tuple(entry.name for entry in directories)
+        )
+        return listing, {entry.name: entry for entry in files}
@@ -0,0 +1,19 @@
+""" Importing modules on first use, so commands pay only for what they use. """
+from types import ModuleType
+import importlib.util
+import sys
+
+
+def lazy_import(name: str) -> ModuleType:
+    """ Return module which is executed on first attribute access, so every
+    command pays only for modules it actually uses (--help uses none). """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,399 @@
+""" Content addressed storage for saved files. Every unique file content
+is written once to .notty/objects/ and shared by all saves referencing it. """
+
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator
+import threading
+import hashlib
+import zlib
+import stat
+import os
+
+from core.transfer import Method, copy_file
+from core.pack import PackIndex, PackWriter, INDEX_SUFFIX, FLAG_COMPRESSED, FLAG_CHUNKED
+from core.chunking import iter_chunks, CHUNKING_THRESHOLD
+import core.chunking as Chunking
+from core.hash import Hash, READ_BLOCK_SIZE
+from core.path import Path
+
+FANOUT_LENGTH = 2
+COMPRESSED_SUFFIX = ".z"
+CHUNKED_SUFFIX = ".c"
+COMPRESSION_LEVEL = 1
+MIN_COMPRESSION_RATIO = 0.9
+PACK_DIRECTORY = "pack"
+PACK_OBJECT_LIMIT = 256 * 1024
+OBJECT_MODE = 0o444
+PACK_GROWTH_FACTOR = 2
+
+_LOOSE_SUFFIXES: dict[int, str] = {
+    0: "",
+    FLAG_COMPRESSED: COMPRESSED_SUFFIX,
+    FLAG_CHUNKED: CHUNKED_SUFFIX,
+}
+_HASH_SIZE = 32
+
+
+def _split_hashes(data: bytes) -> list[str]:
+    """ Decode chunk list into hex hashes of chunks. """
+    return [data[start:start+_HASH_SIZE].hex() for start in range(0, len(data), _HASH_SIZE)]
+
+
+def compress(data: bytes) -> bytes | None:
+    """ Return zlib compressed data or None if compression does not
+    save enough space to be worth decompressing it later. """
+    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+    if len(compressed) > len(data) * MIN_COMPRESSION_RATIO:
+        return None
+    return compressed
+
+
+class ObjectStore:
+    """ Directory of blobs keyed by SHA256 of their content.
+    Blob with hash `abcdef...` is located at `objects/ab/cdef...` or, if it was
+    worth compressing, at `objects/ab/cdef....z` in zlib format.
+    Inside packing() context, blobs smaller than PACK_OBJECT_LIMIT are appended
+    to a single pack in `objects/pack/` instead of being written as loose files.
+    Big files are stored as content defined chunks and their hash points to a
+    chunk list (`.c` suffix or FLAG_CHUNKED in packs) instead of the content.
+    Blobs are immutable and read-only, so writing an already known content is
+    a no-op. Loose blobs are copied with zero-copy transfer methods and the
+    number of files moved by each method is counted in `transfers`.
+    All methods are safe to call from many threads.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = str(path).rstrip("/")
+        self.pack_path = f"{self.path}/{PACK_DIRECTORY}"
+        self.transfers: dict[Method, int] = {method: 0 for method in Method}
+        self._packs: list[PackIndex] | None = None
+        self._pack_writer: PackWriter | None = None
+        self._lock = threading.Lock()
+
+    def _record(self, method: Method) -> None:
+        with self._lock:
+            self.transfers[method] += 1
+
+    @property
+    def packs(self) -> list[PackIndex]:
+        """ Readers of all finished packs, loaded on first use. Pipeline threads
+        read it at once, so only one of them loads packs. """
+        if self._packs is None:
+            with self._lock:
+                if self._packs is None:
+                    self._packs = self._load_packs()
+        return self._packs
+
+    def _load_packs(self) -> list[PackIndex]:
+        """ Open every pack. Packs merged by another process can disappear
+        while they are listed, directory is then listed again. Merged
+        objects are already in the new pack by then. """
+        while True:
+            packs = []
+            try:
+                if os.path.isdir(self.pack_path):
+                    for name in sorted(os.listdir(self.pack_path)):
+                        if name.endswith(INDEX_SUFFIX):
+                            packs.append(PackIndex(f"{self.pack_path}/{name}"))
+                return packs
+            except FileNotFoundError:
+                for pack in packs:
+                    pack.close()
+
+    @contextmanager
+    def packing(self) -> Iterator[PackWriter]:
+        """ Append small blobs written within this context to a new pack. """
+        writer = PackWriter(self.pack_path)
+        self._pack_writer = writer
+        try:
+            yield writer
+        except BaseException:
+            self._pack_writer = None
+            writer.abort()
+            raise
+
+        self._pack_writer = None
+        pack = writer.finish()
+        if pack is not None:
+            self.packs.append(pack)
+            self.consolidate_packs()
+
+    def consolidate_packs(self) -> None:
+        """ Merge the smallest packs into one, so every pack is at least
+        PACK_GROWTH_FACTOR times bigger than all smaller packs together. Number
+        of packs then grows only logarithmically with stored data, so lookup is
+        a few binary searches, and every object is copied only a few times. """
+        packs = sorted(self.packs, key=lambda pack: pack.size)
+        merged_count = 0
+        smaller_size = 0
+        for position, pack in enumerate(packs):
+            if pack.size < PACK_GROWTH_FACTOR * smaller_size:
+                merged_count = position + 1
+            smaller_size += pack.size
+        if merged_count < 2:
+            return
+
+        merged = packs[:merged_count]
+        writer = PackWriter(self.pack_path)
+        try:
+            for pack in merged:
+                for full_hash, offset, length, flags in pack.entries():
+                    writer.add(full_hash, pack.read(offset, length), flags)
+        except BaseException:
+            writer.abort()
+            raise
+        new_pack = writer.finish()
+
+        # Objects are readable from the new pack, so merged packs can go. Index
+        # goes first, so no reader finds index without it's pack.
+        self._packs = [pack for pack in self.packs if pack not in merged] + [new_pack]
+        for pack in merged:
+            pack.close()
+            if pack.index_path == new_pack.index_path:
+                continue
+            for path in (pack.index_path, pack.pack_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Another process merged the same pack.
+                    pass
+
+    def object_path(self, full_hash: str) -> str:
+        """ Return location of raw loose blob with given hash. """
+        return f"{self.path}/{full_hash[:FANOUT_LENGTH]}/{full_hash[FANOUT_LENGTH:]}"
+
+    def _find_packed(self, full_hash: str) -> tuple[PackIndex, int, int, int] | None:
+        """ Return pack holding the object with it's offset, length and flags. """
+        for pack in self.packs:
+            location = pack.find(full_hash)
+            if location is not None:
+                return pack, *location
+        return None
+
+    def _locate(self, full_hash: str) -> tuple[str, int] | None:
+        """ Return existing loose blob's location and it's flags. """
+        object_path = self.object_path(full_hash)
+        for flags, suffix in _LOOSE_SUFFIXES.items():
+            if os.path.exists(object_path + suffix):
+                return object_path + suffix, flags
+        return None
+
+    def has(self, full_hash: str) -> bool:
+        """ Check if blob with given hash is stored loose or in any pack. """
+        writer = self._pack_writer
+        if writer is not None and full_hash in writer:
+            return True
+        return self._find_packed(full_hash) is not None or self._locate(full_hash) is not None
+
+    def store_file(self, source: str) -> Hash:
+        """ Hash file's content and copy it into store if it is not known yet. """
+        source_stat = os.stat(source)
+        hash_obj = Hash.generate_from_file(source)
+        if not self.has(hash_obj.full):
+            return Hash.generate_from_full(self.write_file(source, hash_obj.full, source_stat))
+        return hash_obj
+
+    def store_bytes(self, data: bytes, always_pack: bool = False) -> Hash:
+        """ Store raw data as a blob, compressed if it is worth it. """
+        hash_obj = Hash.generate_from_bytes(data)
+        if not self.has(hash_obj.full):
+            compressed = compress(data)
+            if compressed is None:
+                self.write_blob(hash_obj.full, data, 0, always_pack)
+            else:
+                self.write_blob(hash_obj.full, compressed, FLAG_COMPRESSED, always_pack)
+        return hash_obj
+
+    def store_chunked(self, source: str) -> str:
+        """ Split file into content defined chunks, store chunks which are not
+        known yet and return hash of whole file's content, which points to the
+        list of chunk hashes. Chunks are always packed. """
+        with open(source, "rb") as file:
+            return self._store_chunks(file)
+
+    def store_stream(self, file: BinaryIO, size: int) -> str:
+        """ Store content of size bytes read from file object, which does not
+        need to be seekable, and return it's hash. Content smaller than
+        CHUNKING_THRESHOLD is read into memory, bigger is chunked as it is read
+        or, when chunking is not available, written whole as it is read. """
+        if size < CHUNKING_THRESHOLD:
+            return self.store_bytes(file.read()).full
+        if Chunking.is_available():
+            return self._store_chunks(file)
+
+        hasher = hashlib.sha256()
+
+        def writer(temp_path: str) -> None:
+            with open(temp_path, "wb") as target:
+                while block := file.read(READ_BLOCK_SIZE):
+                    hasher.update(block)
+                    target.write(block)
+
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self.path}/{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            writer(temp_path)
+            full_hash = hasher.hexdigest()
+            if not self.has(full_hash):
+                object_path = self.object_path(full_hash)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.chmod(temp_path, OBJECT_MODE)
+                os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return full_hash
+
+    def _store_chunks(self, file: BinaryIO) -> str:
+        hasher = hashlib.sha256()
+        chunk_hashes = bytearray()
+        for chunk in iter_chunks(file):
+            hasher.update(chunk)
+            chunk_hashes += bytes.fromhex(self.store_bytes(chunk, always_pack=True).full)
+
+        full_hash = hasher.hexdigest()
+        if not self.has(full_hash):
+            self.write_blob(full_hash, bytes(chunk_hashes), FLAG_CHUNKED)
+        return full_hash
+
+    def write_blob(self, full_hash: str, data: bytes, flags: int, always_pack: bool = False) -> None:
+        """ Write already hashed (and possibly compressed) data as a blob. """
+        pack_writer = self._pack_writer
+        if pack_writer is not None and (always_pack or len(data) <= PACK_OBJECT_LIMIT):
+            pack_writer.add(full_hash, data, flags)
+            return
+
+        def writer(temp_path: str) -> None:
+            with open(temp_path, "wb") as file:
+                file.write(data)
+        self._write(self.object_path(full_hash) + _LOOSE_SUFFIXES[flags], writer)
+
+    def write_file(self, source: str, full_hash: str | None = None,
+                   source_stat: os.stat_result | None = None) -> str:
+        """ Copy file into store without compressing it and return it's hash.
+        full_hash computed earlier by the caller is trusted only if file's stat
+        is still the same as source_stat after copying, otherwise the copy is
+        hashed, so blob always matches it's name. """
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = f"{self.path}/{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            self._record(copy_file(source, temp_path))
+
+            current_stat = os.stat(source)
+            is_unchanged = source_stat is not None and (
+                current_stat.st_size == source_stat.st_size
+                and current_stat.st_mtime_ns == source_stat.st_mtime_ns
+            )
+            if full_hash is None or not is_unchanged:
+                full_hash = Hash.generate_from_file(temp_path).full
+
+            object_path = self.object_path(full_hash)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.chmod(temp_path, OBJECT_MODE)
+            os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return full_hash
+
+    def reload(self) -> None:
+        """ Close pack readers, so packs are listed again on next use. """
+        if self._packs is not None:
+            for pack in self._packs:
+                pack.close()
+        self._packs = None
+
+    def chunk_hashes(self, full_hash: str) -> list[str]:
+        """ Return hashes of chunks stored object is made of or
+        an empty list if object is not chunked. """
+        packed = self._find_packed(full_hash)
+        if packed is not None:
+            pack, offset, length, flags = packed
+            return _split_hashes(pack.read(offset, length)) if flags & FLAG_CHUNKED else []
+
+        location = self._locate(full_hash)
+        if location is None or not location[1] & FLAG_CHUNKED:
+            return []
+        with open(location[0], "rb") as file:
+            return _split_hashes(file.read())
+
+    def iter_blocks(self, full_hash: str) -> Iterator[bytes]:
+        """ Yield content of stored blob in blocks, joining chunks
+        and decompressing on the fly. Memory usage is constant. """
+        packed = self._find_packed(full_hash)
+        if packed is not None:
+            pack, offset, length, flags = packed
+            data = pack.read(offset, length)
+            if flags & FLAG_CHUNKED:
+                for chunk_hash in _split_hashes(data):
+                    yield from self.iter_blocks(chunk_hash)
+            elif flags & FLAG_COMPRESSED:
+                yield zlib.decompress(data)
+            else:
+                yield data
+            return
+
+        location = self._locate(full_hash)
+        if location is None:
+            # Another process could have merged the pack holding it since packs
+            # were loaded. Old readers are not closed, other threads can use them.
+            if self._packs is not None:
+                self._packs = None
+                if self._find_packed(full_hash) is not None:
+                    yield from self.iter_blocks(full_hash)
+                    return
+            raise FileNotFoundError(f"Object not found: {full_hash}")
+
+        object_path, flags = location
+        with open(object_path, "rb") as file:
+            if flags & FLAG_CHUNKED:
+                for chunk_hash in _split_hashes(file.read()):
+                    yield from self.iter_blocks(chunk_hash)
+                return
+
+            decompressor = zlib.decompressobj() if flags & FLAG_COMPRESSED else None
+            while block := file.read(READ_BLOCK_SIZE):
+                yield block if decompressor is None else decompressor.decompress(block)
+            if decompressor is not None:
+                yield decompressor.flush()
+
+    def read_bytes(self, full_hash: str) -> bytes:
+        """ Return content of stored blob. """
+        return b"".join(self.iter_blocks(full_hash))
+
+    def restore_file(self, full_hash: str, destination: str) -> Method:
+        """ Write blob's content to destination path and return transfer method used.
+        Destination is always a separate copy (or reflink), never the stored blob. """
+        if self._find_packed(full_hash) is None:
+            location = self._locate(full_hash)
+            if location is not None and location[1] == 0:
+                method = copy_file(location[0], destination)
+                self._record(method)
+                return method
+
+        with open(destination, "wb") as file:
+            for block in self.iter_blocks(full_hash):
+                file.write(block)
+        self._record(Method.BUFFERED)
+        return Method.BUFFERED
+
+    def remove(self, full_hash: str) -> None:
+        """ Delete loose blob from store. Packed blobs are dropped only by repacking. """
+        location = self._locate(full_hash)
+        if location is not None:
+            os.chmod(location[0], stat.S_IWRITE | OBJECT_MODE)
+            os.remove(location[0])
+
+    def _write(self, object_path: str, writer: Callable[[str], None]) -> None:
+        """ Let writer fill temporary file and atomically move it to blob's
+        location, so interrupted save never leaves partially written blob. """
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+        temp_path = f"{object_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            writer(temp_path)
+            os.chmod(temp_path, OBJECT_MODE)
+            os.replace(temp_path, object_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,181 @@
+""" Pack files. Many small blobs are appended to a single .pack file and
+located through a sorted .idx file which is memory mapped, so looking up
+an object is a binary search and a single read, never a directory scan.
+
+Index layout (big endian):
+    b"NIDX" | version: u32 | fanout: 256 * u32 | entries: count * (hash: 32B, offset: u64, length: u64, flags: u8)
+fanout[b] holds number of entries which hash's first byte is <= b.
+"""
+
+from typing import Iterator
+import threading
+import hashlib
+import struct
+import mmap
+import os
+
+PACK_MAGIC = b"NPCK"
+INDEX_MAGIC = b"NIDX"
+PACK_VERSION = 1
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+
+FLAG_COMPRESSED = 1
+FLAG_CHUNKED = 2
+
+_HEADER = struct.Struct(">4sI")
+_FANOUT = struct.Struct(">256I")
+_ENTRY = struct.Struct(">32sQQB")
+_ENTRIES_START = _HEADER.size + _FANOUT.size
+
+
+class PackIndex:
+    """ Read-only view of a pack and it's memory mapped index. """
+
+    def __init__(self, index_path: str) -> None:
+        self.index_path = index_path
+        self.pack_path = index_path.removesuffix(INDEX_SUFFIX) + PACK_SUFFIX
+
+        with open(index_path, "rb") as file:
+            self._index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with open(self.pack_path, "rb") as file:
+                self._pack = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            self._index.close()
+            raise
+
+        magic, version = _HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise ValueError(f"Invalid pack index: {index_path}")
+
+        self._fanout = _FANOUT.unpack_from(self._index, _HEADER.size)
+        self.count = self._fanout[255]
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def size(self) -> int:
+        """ Size of pack's data in bytes. """
+        return len(self._pack)
+
+    @property
+    def index_size(self) -> int:
+        """ Size of pack's index in bytes. """
+        return len(self._index)
+
+    def _hash_at(self, position: int) -> bytes:
+        start = _ENTRIES_START + position * _ENTRY.size
+        return self._index[start:start+32]
+
+    def find(self, full_hash: str) -> tuple[int, int, int] | None:
+        """ Return (offset, length, flags) of object or None if it is not packed. """
+        key = bytes.fromhex(full_hash)
+        low = self._fanout[key[0]-1] if key[0] else 0
+        high = self._fanout[key[0]]
+
+        while low < high:
+            middle = (low + high) // 2
+            if self._hash_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self._fanout[key[0]] or self._hash_at(low) != key:
+            return None
+
+        _, offset, length, flags = _ENTRY.unpack_from(self._index, _ENTRIES_START + low * _ENTRY.size)
+        return offset, length, flags
+
+    def read(self, offset: int, length: int) -> bytes:
+        """ Return stored (possibly compressed) data of an object. """
+        return self._pack[offset:offset+length]
+
+    def hashes(self) -> Iterator[str]:
+        """ Yield hashes of all packed objects in sorted order. """
+        for position in range(self.count):
+            yield self._hash_at(position).hex()
+
+    def entries(self) -> Iterator[tuple[str, int, int, int]]:
+        """ Yield (hash, offset, length, flags) of all packed objects in sorted order. """
+        for position in range(self.count):
+            key, offset, length, flags = _ENTRY.unpack_from(self._index, _ENTRIES_START + position * _ENTRY.size)
+            yield key.hex(), offset, length, flags
+
+    def close(self) -> None:
+        self._index.close()
+        self._pack.close()
+
+
+class PackWriter:
+    """ Append objects to a new pack. Pack becomes visible to readers only
+    when it is finished, as it's index is renamed into place last.
+    Safe to use from many threads. """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._temp_path = f"{directory}/{os.getpid()}-{threading.get_ident()}{PACK_SUFFIX}.tmp"
+        self._file = open(self._temp_path, "wb")
+        self._file.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION))
+        self._entries: dict[bytes, tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, full_hash: str) -> bool:
+        return bytes.fromhex(full_hash) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, full_hash: str, data: bytes, flags: int) -> None:
+        """ Append object's data to the pack. Already added objects are skipped. """
+        key = bytes.fromhex(full_hash)
+        with self._lock:
+            if key in self._entries:
+                return
+            offset = self._file.tell()
+            self._file.write(data)
+            self._entries[key] = (offset, len(data), flags)
+
+    def finish(self) -> PackIndex | None:
+        """ Flush pack, write it's index and return reader of new pack.
+        Empty packs are discarded. """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        if not self._entries:
+            os.remove(self._temp_path)
+            return None
+
+        fanout = [0] * 256
+        for key in self._entries:
+            fanout[key[0]] += 1
+        for byte in range(1, 256):
+            fanout[byte] += fanout[byte-1]
+
+        index_content = bytearray(_HEADER.pack(INDEX_MAGIC, PACK_VERSION))
+        index_content += _FANOUT.pack(*fanout)
+        for key in sorted(self._entries):
+            index_content += _ENTRY.pack(key, *self._entries[key])
+
+        name = "pack-" + hashlib.sha256(index_content).hexdigest()
+        pack_path = f"{self.directory}/{name}{PACK_SUFFIX}"
+        index_path = f"{self.directory}/{name}{INDEX_SUFFIX}"
+
+        os.replace(self._temp_path, pack_path)
+        with open(index_path + ".tmp", "wb") as file:
+            file.write(index_content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(index_path + ".tmp", index_path)
+        return PackIndex(index_path)
+
+    def abort(self) -> None:
+        """ Discard pack which is being written. """
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
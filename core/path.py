@@ -5,23 +5,26 @@ import os
 
 
 class Path:
-    """ Abstract path representation.
+    """ Abstract path representation. Trailing / marks a directory. Creating
+    and joining paths never touches filesystem, stat result is read on first
+    use and cached, refresh() forgets it.
     __str__, __repr__: return path
-    __add__: Add string to path without /. 
-        >>> Path("C:/foo") + "bar" -> Path("C:/foobar") 
-    __truediv__: Add string to path separated by /. 
+    __add__: Add string to path without /.
+        >>> Path("C:/foo") + "bar" -> Path("C:/foobar")
+    __truediv__: Add string to path separated by /.
         >>> Path("C:/foo") / "bar" -> Path("C:/foo/bar")
     __floordiv__: Add string to path separated by / and add next / at the end.
         >>> Path("C:/foo") // "bar" -> Path("C:/foo/bar/")
     """
+    __slots__ = ("path", "_stat")
 
     def __init__(self, src: str) -> None:
-        src = src.replace("\\", "/")
-        src = src.replace("//", "/")
+        if "\\" in src:
+            src = src.replace("\\", "/")
+        while "//" in src:
+            src = src.replace("//", "/")
         self.path = src
-
-        if self.exists() and self.is_dir() and not self.path.endswith("/"):
-            self.path += "/"
+        self._stat: os.stat_result | None = None
 
     def __str__(self) -> str:
         return self.path
@@ -31,6 +34,14 @@ class Path:
             return self.path.removesuffix("/")
         return self.path
 
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Path):
+            return NotImplemented
+        return self.path.rstrip("/") == other.path.rstrip("/")
+
+    def __hash__(self) -> int:
+        return hash(self.path.rstrip("/"))
+
     def __add__(self, sub_path: object) -> "Path":
         if not isinstance(sub_path, (str, Path)):
             raise TypeError("Path.__add__ requires str or Path object.")
@@ -49,13 +60,28 @@ class Path:
 
         return Path(self.path + "/" + str(sub_path) + "/")
 
+    def stat(self) -> os.stat_result | None:
+        """ Return cached stat result of this path, None if it does not exist. """
+        if self._stat is None:
+            try:
+                self._stat = os.stat(self.path)
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        return self._stat
+
+    def refresh(self) -> Self:
+        """ Forget cached stat result, after this path was changed. """
+        self._stat = None
+        return self
+
     def exists(self) -> bool:
         """ Check if this Path exists. """
-        return os.path.exists(self.path)
+        return self.stat() is not None
 
     def is_dir(self) -> bool:
         """ Check if path is a directory. """
-        return stat.S_ISDIR(os.stat(str(self.path)).st_mode)
+        result = self.stat()
+        return result is not None and stat.S_ISDIR(result.st_mode)
 
     def touch(self) -> Self:
         """ Create directory using os.mkdir or file with open. """
@@ -64,36 +90,37 @@ class Path:
         else:
             open(self.path, "a+").close()
 
-        return self
+        return self.refresh()
 
     def parent(self) -> "Path":
         """ Return this path's parent of self if None. """
-        parts = self.path.split("/")
-        if len(parts) < 3:
+        parent, separator, _ = self.path.rstrip("/").rpartition("/")
+        if not separator:
             return self
 
-        return Path("/".join(parts[:-2])+"/")
-    
+        return Path(parent + "/")
+
     def all_parents(self) -> set["Path"]:
         """ Get all parents of this path. """
-        parents = []
+        parents = set()
         new_path = self
 
-        for _ in range(len(self.path.split("/"))):
-            new_path = new_path.parent()
-            parents.append(new_path)
+        while (parent := new_path.parent()) != new_path:
+            parents.add(parent)
+            new_path = parent
+
+        return parents
 
-        return set(parents)
-    
-    def list_dir(self, as_str: bool = False) -> list["Path"]:
-        """ Turn os.listdir items into Path objects. """
+    def list_dir(self, as_str: bool = False) -> list["Path"] | list[str]:
+        """ Turn directory items into Path objects, directories end with /.
+        Kind of item is given by directory listing, no item is stat-ed. """
         if as_str:
             return os.listdir(self.path)
-        return [self/Path(p) for p in os.listdir(self.path)]
-    
+
+        base = self.path if self.path.endswith("/") else self.path + "/"
+        with os.scandir(self.path) as entries:
+            return [Path(base + entry.name + ("/" if entry.is_dir() else "")) for entry in entries]
+
     def get_name(self) -> str:
         """ Return name of final item of this path. """
-        if self.path.endswith("/"):
-            return self.path.split("/")[-2]
-        return self.path.split("/")[-1]
-
+        return self.path.rstrip("/").rpartition("/")[2]
@@ -0,0 +1,229 @@
+""" Multi-threaded save engine. Working tree walk feeds a chain of stages
+(read/hash -> compress -> write) connected with bounded queues, so disks and
+cores are kept busy. Contents of files read into memory count against
+MEMORY_BUDGET until they are written, so at most that many bytes of them
+(plus their compressed copies being made) are held, however many jobs run. """
+
+from dataclasses import dataclass
+from typing import Callable, Any
+import threading
+import queue
+import os
+
+from core.objects import ObjectStore, compress
+from core.chunking import CHUNKING_THRESHOLD
+import core.chunking as Chunking
+from core.pack import FLAG_COMPRESSED
+from core.visuals import Progress
+from core.hash import Hash
+import core.trace as Trace
+
+DEFAULT_JOBS: int = min(32, os.cpu_count() or 1)
+IN_MEMORY_LIMIT: int = 8 * 1024 * 1024
+MEMORY_BUDGET: int = 64 * 1024 * 1024
+QUEUE_SIZE_PER_WORKER: int = 2
+
+_DONE = object()
+
+
+@dataclass
+class SaveJob:
+    """ Single changed file travelling through the pipeline. Files bigger than
+    IN_MEMORY_LIMIT are never loaded, they are hashed and copied as streams.
+    Files bigger than CHUNKING_THRESHOLD are split into chunks by hash stage,
+    when chunking is available (see Chunking.is_available). """
+    relative_path: str
+    absolute_path: str
+    stat: os.stat_result
+    hash: str | None = None
+    data: bytes | None = None
+    flags: int = 0
+    reserved: int = 0
+
+
+class MemoryBudget:
+    """ Number of bytes which jobs may hold in memory at once. Single job bigger
+    than the whole budget gets all of it, so it does not wait forever. """
+
+    def __init__(self, limit: int, errors: list[BaseException]) -> None:
+        self.limit = limit
+        self.used = 0
+        self.errors = errors
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int) -> int | None:
+        """ Wait until size bytes are free and take them. Return taken
+        amount or None if pipeline failed meanwhile. """
+        size = min(size, self.limit)
+        with self._condition:
+            while self.used + size > self.limit:
+                # Failed pipeline drops it's jobs without releasing them.
+                if self.errors:
+                    return None
+                self._condition.wait(0.1)
+            self.used += size
+        return size
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class Stage:
+    """ Group of worker threads consuming one bounded queue and passing
+    results of function to the next stage. When function returns None,
+    job is considered finished and is not passed any further. """
+
+    def __init__(self, name: str, function: Callable[[Any], Any], workers: int,
+                 next_stage: "Stage | None", errors: list[BaseException]) -> None:
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.next_stage = next_stage
+        self.errors = errors
+        self.queue: queue.Queue = queue.Queue(maxsize=self.workers * QUEUE_SIZE_PER_WORKER)
+        self._alive = self.workers
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"notty-{name}-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item: Any) -> None:
+        self.queue.put(item)
+
+    def close(self) -> None:
+        """ Tell every worker there will be no more jobs. """
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self) -> None:
+        start = Trace.sample() if Trace.is_enabled() else None
+        jobs = 0
+        while (item := self.queue.get()) is not _DONE:
+            # After a failure remaining jobs are drained, so no producer blocks forever.
+            if self.errors:
+                continue
+            jobs += 1
+            try:
+                result = self.function(item)
+                if result is not None and self.next_stage is not None:
+                    self.next_stage.put(result)
+            except BaseException as error:
+                self.errors.append(error)
+
+        if start is not None:
+            Trace.record(f"{self.name} worker", "pipeline", start, Trace.sample(), {"jobs": jobs})
+        with self._lock:
+            self._alive -= 1
+            is_last = self._alive == 0
+        if is_last and self.next_stage is not None:
+            self.next_stage.close()
+
+
+class SavePipeline:
+    """ Store changed files in object store using jobs threads per stage.
+    Small blobs written by one pipeline are collected in a single pack.
+    Submitted and finished files are reported to progress, if given.
+    >>> with SavePipeline(objects, jobs) as pipeline:
+    >>>     pipeline.submit(SaveJob(...))
+    >>> pipeline.finished  # all jobs with their hashes
+    """
+
+    def __init__(self, objects: ObjectStore, jobs: int = DEFAULT_JOBS, progress: Progress | None = None) -> None:
+        self.objects = objects
+        self.progress = progress
+        self.finished: list[SaveJob] = []
+        self.errors: list[BaseException] = []
+        self.memory = MemoryBudget(MEMORY_BUDGET, self.errors)
+
+        self._write = Stage("write", self._write_job, jobs, None, self.errors)
+        self._compress = Stage("compress", self._compress_job, jobs, self._write, self.errors)
+        self._hash = Stage("hash", self._hash_job, jobs, self._compress, self.errors)
+        self._stages = (self._hash, self._compress, self._write)
+
+    def __enter__(self) -> "SavePipeline":
+        self._packing = self.objects.packing()
+        self._packing.__enter__()
+        for stage in self._stages:
+            stage.start()
+        return self
+
+    def __exit__(self, ex_type: type, ex_value: Exception, ex_tb: Any) -> None:
+        self._hash.close()
+        for stage in self._stages:
+            stage.join()
+
+        error = ex_value if ex_value is not None else next(iter(self.errors), None)
+        if error is None:
+            self._packing.__exit__(None, None, None)
+            return
+
+        self._packing.__exit__(type(error), error, error.__traceback__)
+        if ex_value is None:
+            raise error
+
+    def submit(self, job: SaveJob) -> None:
+        """ Queue changed file. Blocks when pipeline is full. """
+        if self.errors:
+            raise self.errors[0]
+        if self.progress is not None:
+            self.progress.add_total(1, job.stat.st_size)
+        self._hash.put(job)
+
+    def _hash_job(self, job: SaveJob) -> SaveJob | None:
+        Trace.count("files_hashed")
+        Trace.count("bytes_hashed", job.stat.st_size)
+        if job.stat.st_size >= CHUNKING_THRESHOLD and Chunking.is_available():
+            job.hash = self.objects.store_chunked(job.absolute_path)
+            return self._finish(job)
+
+        if job.stat.st_size <= IN_MEMORY_LIMIT:
+            reserved = self.memory.acquire(job.stat.st_size)
+            if reserved is None:
+                return None
+            job.reserved = reserved
+            with open(job.absolute_path, "rb") as file:
+                job.data = file.read()
+            job.hash = Hash.generate_from_bytes(job.data).full
+        else:
+            job.hash = Hash.generate_from_file(job.absolute_path).full
+
+        if self.objects.has(job.hash):
+            return self._finish(job)
+        return job
+
+    def _compress_job(self, job: SaveJob) -> SaveJob:
+        if job.data is not None:
+            compressed = compress(job.data)
+            if compressed is not None:
+                job.data = compressed
+                job.flags = FLAG_COMPRESSED
+        return job
+
+    def _write_job(self, job: SaveJob) -> None:
+        Trace.count("objects_written")
+        Trace.count("bytes_stored", job.stat.st_size if job.data is None else len(job.data))
+        if job.data is None:
+            job.hash = self.objects.write_file(job.absolute_path, job.hash, job.stat)
+        else:
+            self.objects.write_blob(job.hash, job.data, job.flags)
+        self._finish(job)
+
+    def _finish(self, job: SaveJob) -> None:
+        job.data = None
+        if job.reserved:
+            self.memory.release(job.reserved)
+            job.reserved = 0
+        self.finished.append(job)
+        if self.progress is not None:
+            self.progress.advance(1, job.stat.st_size)
@@ -0,0 +1,29 @@
+""" Running notty's own code in detached background processes, so commands
+do not wait for work nobody is waiting for (trash purging, indexing). """
+import subprocess
+import sys
+import os
+
+PACKAGE_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_detached(code: str, *args: str, cwd: str) -> None:
+    """ Start isolated Python process running code with notty importable and
+    args in sys.argv[1:]. It outlives the caller and never touches it's terminal.
+    >>> run_detached("from core.trash import purge; import sys; purge(sys.argv[1])", bin_path, cwd=bin_path)
+    """
+    if os.name == "nt":
+        detach = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {"start_new_session": True}
+
+    bootstrap = "import sys; sys.path.insert(0, sys.argv.pop(1)); " + code
+    subprocess.Popen(
+        [sys.executable, "-I", "-c", bootstrap, PACKAGE_ROOT, *args],
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        **detach
+    )
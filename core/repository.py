@@ -1,36 +1,75 @@
 """ This module makes it easy to manage repositories. """
 
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
 from enum import Enum
 import shutil
-import random
 import json
 import stat
+import time
 import os
 
-from core.todo import __BLANK_CONTENT__ as BLANK_TODO
+from core.catalog import SaveCatalog, CatalogEntry, CATALOG_FILE
+from core.tree import Tree, TreeEntry, TREE_FILE
 from core.hash import Hash, SHORT_LENGTH
+from core.index import WorkingIndex, INDEX_FILE
+from core.pipeline import SavePipeline, SaveJob, DEFAULT_JOBS
+from core.objects import ObjectStore
+from core.store import MetadataStore
+from core.lazy import lazy_import
+import core.transfer as Transfer
 import core.visuals as Visuals
 import core.errors as Errors
 import core.moment as Moment
 from core.path import Path
-import core.files as Files
+import core.walker as Walker
+import core.ignore as Ignore
+import core.trace as Trace
+
+# Used by few commands only, loaded on first use to keep startup fast.
+Archive = lazy_import("core.archive")
+Grep = lazy_import("core.grep")
+Gc = lazy_import("core.gc")
+Diff = lazy_import("core.diff")
+Files = lazy_import("core.files")
+Trash = lazy_import("core.trash")
 
 
 SAVE_DATA_FILE: str = "notty.save"
+SAVE_TEMP_SUFFIX: str = ".tmp"
 REPO_STRUCTURE: dict[str, None | dict[str, Any]] = {
     "saves/": None,
     "bin/": None,
-    "notes.txt": "All your project's notes.",
-    "todo.json": BLANK_TODO,
-    "notty.meta": {},
-    "notty.ignore": "# Files with names matching patterns below\n# will not be saved. Use # for comments, * for any.\n# *.pyc = no files ending with .pyc will be saved.\n.notty\n__pycache__",
+    "notty.ignore": "# Paths matching patterns below will not be saved (gitignore syntax).\n# Use # for comments, * for any, ** for any directories, dir/ for directories only,\n# /path for paths relative to project's root and ! to include path again.\n# *.pyc = no files ending with .pyc will be saved.\n.notty\n__pycache__",
 }
 
 
+def _state_root_hash(state: "Diff.State", directories: Iterable[str]) -> str:
+    """ Return root hash of tree holding files of state and given directories. """
+    tree = Tree(
+        {path: TreeEntry(path, full_hash, mode, 0) for path, (full_hash, mode) in state.items()},
+        sorted(directory for directory in directories if directory)
+    )
+    return tree.root_hash
+
+
+def _is_legacy_meta(relative_path: str, _) -> bool:
+    """ Check if path inside save created before manifests is notty's own file. """
+    return "notty" in relative_path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _tree_state(tree: Tree, skipped_directories: set[str] | frozenset[str] = frozenset()) -> "Diff.State":
+    """ Return {relative_path: (hash, mode)} of tree's files outside skipped directories. """
+    state = {}
+    for entry in tree.entries.values():
+        parent = entry.path[:entry.path.rfind("/") + 1]
+        if parent not in skipped_directories:
+            state[entry.path] = (entry.hash, entry.mode)
+    return state
+
+
 class MetaKeys(Enum):
-    """ These keys are used in notty.meta file. """
+    """ These keys are used in meta table of repository's metadata store. """
     DATE_CREATED = "date_created"
     DATE_EDITED = "date_edited"
 
@@ -42,23 +81,13 @@ class Save:
     path: Path
     comment: str
     date_created: int
+    size: int = 0
+    parent: str | None = None
 
 
 class Repository:
     """ Main Repository representation. """
 
-    @staticmethod
-    def _build_meta(meta_file_path: Path) -> None:
-        """ Remove current content and write default to meta file. """
-        now_timestamp = Moment.generate_timestamp()
-        meta_content = {
-            "date_created": now_timestamp,
-            "date_edited": now_timestamp,
-        }
-
-        with open(str(meta_file_path), "w+", encoding="utf8") as file:
-            json.dump(meta_content, file)
-
     @staticmethod
     def create(path: Path | str) -> "Repository":
         """ Create new repository in current location. """
@@ -73,7 +102,7 @@ class Repository:
                 raise Errors.RepositoryError("Already exists.")
 
             for parent_path in path.all_parents():
-                if ".notty" in parent_path.list_dir() and (parent_path//".notty").is_dir():
+                if ".notty" in parent_path.list_dir(True) and (parent_path // ".notty").is_dir():
                     raise Errors.RepositoryError(
                         f"There is repository in higher level directory: {parent_path}"
                     )
@@ -102,9 +131,12 @@ class Repository:
 
                 callback.info(f"filled file : {item}")
 
-            meta_path = path / "notty.meta"
-            Repository._build_meta(meta_path)
-            callback.success("filled meta")
+            now_timestamp = Moment.generate_timestamp()
+            store = MetadataStore(str(path))
+            store.set_meta(MetaKeys.DATE_CREATED.value, now_timestamp)
+            store.set_meta(MetaKeys.DATE_EDITED.value, now_timestamp)
+            store.close()
+            callback.success("created metadata store")
 
             if os.name == "nt":
                 os.system(f"attrib +H /D {repr(path)}")
@@ -121,6 +153,9 @@ class Repository:
         self.repo_path: Path = path // ".notty"
         self.saves_path: Path = self.repo_path // "saves"
         self.bin_path: Path = self.repo_path // "bin"
+        self.objects = ObjectStore(self.repo_path / "objects")
+        self.store = MetadataStore(str(self.repo_path))
+        self._catalog: SaveCatalog | None = None
 
         try:
             self.is_initialized = self.check_initialized()
@@ -129,22 +164,59 @@ class Repository:
             Visuals.display_error(f"Cannot load repository: {error}")
 
     def _edit_meta(self, key: MetaKeys, value: Any) -> None:
-        """ Edit notty.meta file's key. """
-
-        meta_file = self.repo_path / "notty.meta"
-        with open(str(meta_file), "r", encoding="utf8") as file:
+        """ Set meta key in metadata store. """
+        self.store.set_meta(key.value, value)
+
+    @property
+    def catalog(self) -> SaveCatalog:
+        """ Index of all saves, loaded on first use. Repositories created
+        before catalog existed get it built from their saves directory. """
+        if self._catalog is None:
+            self._catalog = SaveCatalog(str(self.repo_path / CATALOG_FILE))
+            if not self._catalog.exists():
+                self._rebuild_catalog()
+        return self._catalog
+
+    def _rebuild_catalog(self) -> None:
+        """ Recreate catalog by reading every save's directory. Directories
+        without a tree are skipped (left by interrupted saves), unless they
+        hold a full copy of the project made before object store existed. """
+        entries = []
+        for save_hash in self.saves_path.list_dir(True):
+            if save_hash.endswith(SAVE_TEMP_SUFFIX):
+                continue
             try:
-                content = json.load(file)
-            except json.decoder.JSONDecodeError:
-                Visuals.display_warning("Meta file corrupted, rebuilt.")
-                Repository._build_meta(meta_file)
-                content = json.load(file)
-
-        with open(str(meta_file), "w+", encoding="utf8") as file:
-            if key not in MetaKeys:
-                Visuals.display_warning(f"Modifying unknown meta key: {key}")
-            content[key.value] = value
-            json.dump(content, file)
+                save_content = (self.saves_path // save_hash).list_dir(True)
+            except NotADirectoryError:
+                continue
+            if TREE_FILE not in save_content and not set(save_content) - {SAVE_DATA_FILE}:
+                Visuals.display_warning(f"Skipping save {save_hash}: it was not finished.")
+                continue
+            try:
+                save_obj = self.load_save(Hash.generate_from_full(save_hash))
+            except (Errors.SaveError, Errors.HashError, NotADirectoryError) as error:
+                Visuals.display_warning(f"Skipping save {save_hash}: {error}")
+                continue
+
+            tree_path = save_obj.path / TREE_FILE
+            size = 0
+            if tree_path.exists():
+                size = sum(entry.size for entry in Tree.load(str(tree_path)).entries.values())
+            entries.append(CatalogEntry(save_obj.hash.full, save_obj.date_created or None, save_obj.comment, size, None))
+
+        entries.sort(key=lambda entry: entry.date_created or 0)
+        self._catalog.rewrite(entries)
+
+    def _save_from_entry(self, entry: CatalogEntry) -> Save:
+        """ Turn catalog entry into Save object. """
+        return Save(
+            Hash.generate_from_full(entry.hash),
+            self.saves_path // entry.hash,
+            entry.comment,
+            entry.date_created,
+            entry.size,
+            entry.parent
+        )
 
     def _update_edited_date(self) -> None:
         """ Update repository's date_edited key to current timestamp. """
@@ -165,21 +237,55 @@ class Repository:
                 return False
         return True
 
-    def create_save(self, comment: str) -> None:
-        """ Create new save with current code state. """
-
-        with Visuals.ProcessCallback("Save current project's state.") as callback:
+    def create_save(self, comment: str, jobs: int = DEFAULT_JOBS) -> Tree | None:
+        """ Create new save with current code state using
+        jobs worker threads per each stage of save pipeline.
+        Return tree of created save or None if save failed. """
+        return self._create_save(comment, lambda: self._build_tree(jobs))
+
+    def create_incremental_save(self, comment: str, base: Tree, changed_paths: set[str],
+                                jobs: int = DEFAULT_JOBS) -> Tree | None:
+        """ Create new save from tree of the previous save (base) by reading again
+        only changed_paths, without scanning the rest of working tree. Changed
+        directory is read as a whole. Return tree of created save or None if save failed. """
+        return self._create_save(comment, lambda: self._update_tree(base, changed_paths, jobs))
+
+    def _create_save(self, comment: str, build_tree: Callable[[], Tree],
+                     process_name: str = "Save current project's state.", is_working_tree: bool = True) -> Tree | None:
+        """ Store save's metadata and tree returned by build_tree. Save is identified
+        by root hash of it's tree, so when working tree is identical to the head
+        save nothing is stored, and when it is identical to another save, that
+        save becomes the head instead of being stored again. Tree which does not
+        come from working tree (is_working_tree=False) has no parent and never
+        becomes the head. """
+        tree = None
+        with Visuals.ProcessCallback(process_name) as callback:
             date_created = Moment.generate_timestamp()
+            parent = self.catalog.head if is_working_tree else None
             callback.info("gathered meta data")
 
-            hash_obj = Hash.generate(f"{date_created}--{comment}--{random.randint(0, 9999)}")
-            callback.info(f"generated hash ({hash_obj.short})")
+            built_tree = build_tree()
+            hash_obj = Hash.generate_from_full(built_tree.root_hash)
+            callback.info(f"hashed {len(built_tree.subtrees)} directories ({hash_obj.short})")
+
+            if hash_obj.full == parent:
+                callback.success_message = f"Nothing changed since: {str(hash_obj)}"
+                return built_tree
 
+            if hash_obj.full in self.catalog.entries:
+                if is_working_tree:
+                    self.catalog.set_head(hash_obj.full)
+                callback.success_message = f"Same state as earlier save: {str(hash_obj)}"
+                return built_tree
+
+            # Save is written aside and renamed into place, so an interrupted
+            # save never leaves a half written save directory behind.
             save_path = self.saves_path // hash_obj.full
-            save_path.touch()
+            temp_path = self.saves_path // f"{hash_obj.full}.{os.getpid()}{SAVE_TEMP_SUFFIX}"
+            temp_path.touch()
             callback.success("created directory")
 
-            meta_file = save_path / SAVE_DATA_FILE
+            meta_file = temp_path / SAVE_DATA_FILE
             meta_file.touch()
             callback.success("created meta file")
 
@@ -191,29 +297,261 @@ class Repository:
                 json.dump(metadata, file)
             callback.info("written metadata")
 
-            def ignore_function(directory, contents):
-                """ Create ignore_list that contains all ignored names.
-                    Used in shutil.copytree as ignore parameter. """
-
-                ignore_list = []
-                for name in contents:
-                    path = os.path.join(directory, name)
-                    if os.path.isdir(path) and ".notty" in name:
-                        ignore_list.append(name)
-                    elif Files.name_in_patterns(name, self.get_ignore_patterns()):
-                        ignore_list.append(name)
-                return ignore_list
-
-            shutil.copytree(
-                str(self.path),
-                str(save_path/""),
-                ignore=ignore_function,
-                dirs_exist_ok=True
-            )
+            built_tree.dump(str(temp_path / TREE_FILE))
+            callback.success(f"stored {len(built_tree.entries)} files")
+
+            # Directory of the same state left by a save interrupted before it
+            # reached the catalog is replaced.
+            if save_path.exists():
+                shutil.rmtree(str(save_path))
+            os.rename(str(temp_path), str(save_path))
+            callback.info("moved save into place")
+            callback.info(f"transfer methods: {Transfer.summarize(self.objects.transfers)}")
+
+            self.catalog.add(CatalogEntry(
+                hash_obj.full,
+                date_created,
+                comment,
+                sum(entry.size for entry in built_tree.entries.values()),
+                parent
+            ), is_head=is_working_tree)
+            callback.info("added to catalog")
+
+            Grep.index_in_background(str(self.repo_path), [hash_obj.full])
+            callback.info("indexing content in background")
 
-            callback.success("copied all")
             callback.success_message = f"Saved to: {str(hash_obj)}"
+            tree = built_tree
         self._update_edited_date()
+        return tree
+
+    def import_save(self, comment: str, archive_input: BinaryIO) -> tuple[Tree | None, list[str]]:
+        """ Create new save from tar archive read as a stream from archive_input.
+        Working tree is not touched and head does not change. Return tree of
+        created save (None if import failed) and names of skipped members. """
+        skipped: list[str] = []
+
+        def build_tree() -> Tree:
+            with Visuals.Progress("importing", is_total_known=False) as progress:
+                tree, skipped_members = Archive.import_tree(self.objects, archive_input, progress)
+            skipped.extend(skipped_members)
+            return tree
+
+        tree = self._create_save(comment, build_tree, "Import save from archive.", is_working_tree=False)
+        return tree, skipped
+
+    def export_save(self, save_object: Save, output: BinaryIO, compression: str) -> None:
+        """ Stream files of given save as tar archive (compressed with one of
+        Archive.COMPRESSIONS) into output. """
+        tree = self.load_tree(save_object)
+        total_bytes = sum(entry.size for entry in tree.entries.values())
+        with Visuals.Progress("exporting", len(tree.entries), total_bytes) as progress:
+            Archive.export_tree(self.objects, tree, output, compression, save_object.date_created or 0, progress)
+
+    def _build_tree(self, jobs: int) -> Tree:
+        """ Store every changed, not ignored project's file in object store and
+        return tree describing where each blob belongs. Files which stat did not
+        change since last save are taken from working index without reading,
+        changed files are passed to the save pipeline. Indexed hashes are also
+        passed if their blob is not stored (file was only hashed by status or
+        it's blob was removed by gc). Blobs of the head save are known to be
+        stored (gc keeps them), so only other hashes are looked up in store. """
+        tree = Tree()
+        index = WorkingIndex(str(self.repo_path / INDEX_FILE))
+        scanner = self._scan_working_tree(index)
+        stored = self._head_hashes()
+
+        progress = Visuals.Progress("storing", is_total_known=False)
+        with progress, SavePipeline(self.objects, jobs, progress) as pipeline:
+            for relative_path, absolute_path, file_stat, full_hash in scanner:
+                if full_hash is None or (full_hash not in stored and not self.objects.has(full_hash)):
+                    pipeline.submit(SaveJob(relative_path, absolute_path, file_stat))
+                    continue
+                tree.add(TreeEntry(relative_path, full_hash, file_stat.st_mode, file_stat.st_size))
+            progress.finish_total()
+
+        for job in pipeline.finished:
+            index.update(job.relative_path, job.stat, job.hash)
+            tree.add(TreeEntry(job.relative_path, job.hash, job.stat.st_mode, job.stat.st_size))
+
+        tree.directories = sorted(directory for directory in index.directories if directory)
+        index.remember_root_hash(tree.root_hash)
+        index.dump()
+        return tree
+
+    def _head_hashes(self) -> set[str]:
+        """ Return hashes of blobs referenced by the head save's tree. """
+        head = self.catalog.head
+        tree_path = self.saves_path / str(head) / TREE_FILE
+        if head is None or not tree_path.exists():
+            return set()
+        return Tree.load_hashes(str(tree_path))
+
+    def _update_tree(self, base: Tree, changed_paths: set[str], jobs: int) -> Tree:
+        """ Return copy of base tree with changed paths read again from working tree.
+        Entries of changed paths (and everything under them) are dropped and
+        whatever currently exists there is passed to the save pipeline. """
+        root = str(self.path).rstrip("/")
+        matcher = self.get_ignore_matcher()
+        tree = Tree(dict(base.entries))
+        directories = set(base.directories)
+
+        progress = Visuals.Progress("storing", is_total_known=False)
+        with progress, SavePipeline(self.objects, jobs, progress) as pipeline:
+            for relative_path in sorted(changed_paths):
+                tree.entries.pop(relative_path, None)
+                prefix = relative_path + "/"
+                if prefix in directories:
+                    for path in [path for path in tree.entries if path.startswith(prefix)]:
+                        del tree.entries[path]
+                    directories = {path for path in directories if not path.startswith(prefix)}
+
+                absolute_path = f"{root}/{relative_path}"
+                try:
+                    file_stat = os.stat(absolute_path)
+                    is_dir = os.path.isdir(absolute_path) and not os.path.islink(absolute_path)
+                except FileNotFoundError:
+                    continue
+                if matcher.is_ignored(relative_path, is_dir):
+                    continue
+
+                if not is_dir:
+                    if stat.S_ISREG(file_stat.st_mode):
+                        pipeline.submit(SaveJob(relative_path, absolute_path, file_stat))
+                    continue
+
+                directories.add(prefix)
+                is_ignored = lambda path, is_dir, prefix=prefix: matcher.is_ignored(prefix + path, is_dir)
+                for walked_path, entry in Walker.walk(absolute_path, is_ignored):
+                    walked_path = prefix + walked_path
+                    if walked_path.endswith("/"):
+                        directories.add(walked_path)
+                        continue
+                    try:
+                        pipeline.submit(SaveJob(walked_path, entry.path, entry.stat()))
+                    except FileNotFoundError:
+                        continue
+            progress.finish_total()
+
+        for job in pipeline.finished:
+            tree.add(TreeEntry(job.relative_path, job.hash, job.stat.st_mode, job.stat.st_size))
+        tree.directories = sorted(directories)
+        return tree
+
+    def _scan_working_tree(self, index: WorkingIndex) -> Iterator[tuple[str, str, os.stat_result, str | None]]:
+        """ Start index scan of project's directory skipping ignored paths. """
+        matcher = self.get_ignore_matcher()
+        return index.scan(str(self.path), matcher.key, matcher.is_ignored)
+
+    def _hash_working_tree(self, index: WorkingIndex) -> dict[str, tuple[str, int]]:
+        """ Return {relative_path: (hash, mode)} of all files in working tree.
+        Only files which stat changed since they were indexed are read. """
+        files = {}
+        for relative_path, absolute_path, file_stat, full_hash in self._scan_working_tree(index):
+            if full_hash is None:
+                full_hash = Hash.generate_from_file(absolute_path).full
+                index.update(relative_path, file_stat, full_hash)
+            files[relative_path] = (full_hash, file_stat.st_mode)
+        return files
+
+    def get_head_save(self) -> Save | None:
+        """ Return save which working tree was last saved as or rolled back to.
+        If it is unknown, the newest save is returned. None if there are no saves. """
+        catalog = self.catalog
+        if catalog.head is not None:
+            return self._save_from_entry(catalog.entries[catalog.head])
+
+        newest = max(catalog, key=lambda entry: entry.date_created or 0, default=None)
+        return self._save_from_entry(newest) if newest is not None else None
+
+    def status(self) -> tuple[Save | None, list["Diff.Change"]]:
+        """ Compare working tree with head save. Only files which stat changed since
+        they were last indexed are read. Without any save every file is added. """
+        head = self.get_head_save()
+        if head is not None:
+            index = WorkingIndex(str(self.repo_path / INDEX_FILE))
+            # Working tree unchanged since it's root hash was computed needs no tree.
+            if index.root_hash == head.hash.full and index.is_unchanged(str(self.path), self.get_ignore_matcher().key):
+                return head, []
+            changes, _, _ = self.diff(head, index=index)
+            return head, changes
+
+        index = WorkingIndex(str(self.repo_path / INDEX_FILE))
+        changes = Diff.compare({}, self._hash_working_tree(index))
+        index.dump()
+        return None, changes
+
+    def load_tree(self, save_object: Save) -> Tree:
+        """ Return manifest of given save. Save created before manifests gets
+        it's manifest first (see _store_legacy_save). """
+        tree_path = save_object.path / TREE_FILE
+        if not tree_path.exists():
+            if not save_object.path.exists():
+                raise Errors.SaveError(f"Save {save_object.hash.short} does not exist.")
+            self._store_legacy_save(save_object)
+        return Tree.load(str(tree_path))
+
+    def _store_legacy_save(self, save_object: Save, jobs: int = DEFAULT_JOBS) -> None:
+        """ Store files of save created before object store was introduced, which
+        holds full copy of the project, and write it's manifest. Save can then be
+        compared, exported and searched like any other. It's hash stays the same,
+        although it is not the root hash of the manifest. """
+        tree = Tree()
+        progress = Visuals.Progress("storing", is_total_known=False)
+        with progress, SavePipeline(self.objects, jobs, progress) as pipeline:
+            for relative_path, entry in Walker.walk(str(save_object.path), _is_legacy_meta):
+                if relative_path.endswith("/"):
+                    tree.directories.append(relative_path)
+                    continue
+                try:
+                    pipeline.submit(SaveJob(relative_path, entry.path, entry.stat()))
+                except FileNotFoundError:
+                    continue
+            progress.finish_total()
+
+        for job in pipeline.finished:
+            tree.add(TreeEntry(job.relative_path, job.hash, job.stat.st_mode, job.stat.st_size))
+        tree.directories.sort()
+
+        tree_path = str(save_object.path / TREE_FILE)
+        temp_path = f"{tree_path}.{os.getpid()}{SAVE_TEMP_SUFFIX}"
+        tree.dump(temp_path)
+        os.replace(temp_path, tree_path)
+
+    def diff(self, old_save: Save, new_save: Save | None = None, index: WorkingIndex | None = None
+             ) -> tuple[list["Diff.Change"], Callable[[str, str], bytes], Callable[[str, str], bytes]]:
+        """ Compare two saves or, if new_save is None, a save with working tree
+        (scanned with given index, if it is already loaded). Return changes and
+        functions reading content of old and new files. Working tree which root
+        hash equals save's hash is not compared with save's tree at all. """
+        read_saved = lambda _, full_hash: Diff.read_limited(self.objects.iter_blocks(full_hash))
+
+        if new_save is not None:
+            old_tree = self.load_tree(old_save)
+            new_tree = self.load_tree(new_save)
+            if old_tree.root_hash == new_tree.root_hash:
+                return [], read_saved, read_saved
+
+            # Files of directories with equal subtree hashes are equal too.
+            unchanged = old_tree.unchanged_directories(new_tree)
+            old_state = _tree_state(old_tree, unchanged)
+            new_state = _tree_state(new_tree, unchanged)
+            return Diff.compare(old_state, new_state), read_saved, read_saved
+
+        if index is None:
+            index = WorkingIndex(str(self.repo_path / INDEX_FILE))
+        new_state = self._hash_working_tree(index)
+        if index.root_hash is None:
+            index.remember_root_hash(_state_root_hash(new_state, index.directories))
+        index.dump()
+
+        def read_working(relative_path: str, _) -> bytes:
+            with open(os.path.join(str(self.path), relative_path), "rb") as file:
+                return file.read(Diff.DIFF_SIZE_LIMIT + 1)
+
+        if index.root_hash == old_save.hash.full:
+            return [], read_saved, read_working
+        return Diff.compare(_tree_state(self.load_tree(old_save)), new_state), read_saved, read_working
 
     def load_save(self, hash_object: Hash) -> Save:
         """ Load all save's information and return it in new Save object. """
@@ -250,50 +588,217 @@ class Repository:
         save_path = self.saves_path // save.hash.full 
         os.chmod(str(save_path), stat.S_IWRITE)
         shutil.rmtree(str(save_path))
+        self.catalog.remove(save.hash.full)
         self._update_edited_date()
 
+    def collect_garbage(self, budget: float | None = None, grace_period: float | None = None) -> "Gc.GcReport":
+        """ Remove objects which no save refers to and repack the rest. Every save
+        with a tree in saves directory is kept alive. With budget (in seconds) work
+        stops early and next call continues where this one stopped. Files younger
+        than grace_period (Gc.GRACE_PERIOD_S by default) are left alone. """
+        if grace_period is None:
+            grace_period = Gc.GRACE_PERIOD_S
+
+        def trees() -> Iterator[Tree]:
+            for save_hash in self.saves_path.list_dir(True):
+                tree_path = self.saves_path / save_hash / TREE_FILE
+                if tree_path.exists():
+                    yield Tree.load(str(tree_path))
+
+        # Saves interrupted before they were moved into place.
+        for name in self.saves_path.list_dir(True):
+            temp_path = str(self.saves_path / name)
+            if name.endswith(SAVE_TEMP_SUFFIX) and os.stat(temp_path).st_ctime < time.time() - grace_period:
+                shutil.rmtree(temp_path)
+
+        reachable = Gc.mark(self.objects, trees())
+        collector = Gc.GarbageCollector(self.objects, reachable, str(self.repo_path / Gc.GC_STATE_FILE),
+                                         budget, grace_period)
+        report = collector.run()
+        self._update_edited_date()
+        return report
+
     def get_all_saves(self) -> list[Save]:
-        """ Return list of all saved code states in Save objects put together into one list. """
-        return [self.load_save(Hash.generate_from_full(save_hash))
-                for save_hash in self.saves_path.list_dir(True)]
+        """ Return list of all saved code states in Save objects put together
+        into one list, oldest first. Only the catalog is read. """
+        return [self._save_from_entry(entry) for entry in self.catalog]
 
     def find_save(self, save_hash: str) -> Save | None:
-        """ Find save from hash in either short or full form and return Save
-        object representing found save or None if save was not found. """
+        """ Find save from hash abbreviated to any length and return Save object
+        representing found save or None if save was not found or is ambiguous. """
 
-        if len(save_hash) not in (5, 64):
+        if not 0 < len(save_hash.strip()) <= 64:
             Visuals.display_error(
-                f"Invalid save_hash's length: (got {len(save_hash)}) expected: short=5 or full=64"
+                f"Invalid save_hash's length: (got {len(save_hash)}) expected: 1-64"
             )
             return None
 
-        all_saves = self.get_all_saves()
-        for save_obj in all_saves:
-            if save_obj.hash == save_hash:
-                return save_obj
+        found = self.catalog.find(save_hash)
+        if len(found) == 1:
+            return self._save_from_entry(found[0])
 
-        Visuals.display_error("Save with given hash not found.")
+        if found:
+            Visuals.display_error(f"Hash {save_hash} is ambiguous, it matches {len(found)} saves.")
+        else:
+            Visuals.display_error("Save with given hash not found.")
         return None
 
-    def rollback_save(self, save_object: Save) -> None:
-        """ Copy code state from given save_object to main directory. """
-
-        if not (save_object.path/"").exists():
+    def find_saves(self, saves_range: str) -> list[Save] | None:
+        """ Find saves in range "OLD..NEW" (both included, oldest first), where
+        any side can be omitted to reach the first or the last save. Single
+        hash selects one save. Return None if any hash is not found. """
+        if ".." not in saves_range:
+            save = self.find_save(saves_range)
+            return None if save is None else [save]
+
+        old_hash, new_hash = saves_range.split("..", 1)
+        saves = self.get_all_saves()
+        if not saves:
+            return []
+
+        bounds = []
+        for save_hash, default in ((old_hash, saves[0]), (new_hash, saves[-1])):
+            save = self.find_save(save_hash) if save_hash else default
+            if save is None:
+                return None
+            bounds.append(next(index for index, entry in enumerate(saves) if entry.hash.full == save.hash.full))
+
+        first, last = sorted(bounds)
+        return saves[first:last + 1]
+
+    def grep(self, pattern: str, saves: list[Save]) -> list["Grep.Match"]:
+        """ Search files of given saves for lines matching regular expression
+        pattern. Content not indexed yet is searched directly and indexed in
+        background afterwards. Saves created before manifests are skipped
+        until status, diff or export stores their files. """
+        trees = []
+        for save in saves:
+            if (save.path / TREE_FILE).exists():
+                trees.append((save.hash.short, self.load_tree(save)))
+
+        with Trace.span("grep", "grep"):
+            matches, unindexed = Grep.search(self.objects, self.store, trees, pattern)
+        Trace.count("blobs_unindexed", len(unindexed))
+
+        if unindexed:
+            Grep.index_in_background(str(self.repo_path), [save.hash.full for save in saves])
+        return matches
+
+    def rollback_save(self, save_object: Save) -> dict[Transfer.Method, int]:
+        """ Bring working tree to the state of given save_object. Working tree is
+        compared with save's tree and only differing files are written, moved to
+        trash or have their mode changed. Ignored files are left untouched.
+        Everything replaced is kept in a trash generation, so rollback can be
+        undone. Return how many files were restored with each transfer method. """
+        methods = {method: 0 for method in Transfer.Method}
+
+        if not save_object.path.exists():
             raise FileNotFoundError("This save does not exists.")
 
-        shutil.copytree(
-            str(save_object.path/""),
-            str(self.path/""),
-            ignore=lambda _, contents: [
-                name for name in contents
-                if "notty" in name
-            ],
-            dirs_exist_ok=True
-        )
+        generation = Trash.Generation.create(str(self.bin_path), str(self.path))
+        generation.head = self.catalog.head
+
+        tree_path = save_object.path / TREE_FILE
+        if not tree_path.exists():
+            Files.remove_current(self.path, generation)
+            self._rollback_legacy_save(save_object, generation)
+            self._finish_rollback(save_object.hash.full, generation)
+            return methods
+
+        root = str(self.path).rstrip("/")
+        tree = Tree.load(str(tree_path))
+        index = WorkingIndex(str(self.repo_path / INDEX_FILE))
+        with Trace.span("hash working tree", "rollback"):
+            current = self._hash_working_tree(index)
+
+        for relative_path in current.keys() - tree.entries.keys():
+            generation.move_aside(relative_path)
+            index.forget(relative_path)
+
+        wanted_directories = set(tree.directories)
+        for directory in sorted(index.directories, key=len, reverse=True):
+            if directory and directory not in wanted_directories:
+                absolute_path = os.path.join(root, directory)
+                # Directory still holding ignored files is left in place.
+                if os.path.isdir(absolute_path) and not os.listdir(absolute_path):
+                    generation.move_aside(directory)
+
+        for directory in tree.directories:
+            absolute_path = os.path.join(root, directory)
+            if not os.path.isdir(absolute_path):
+                if os.path.lexists(absolute_path):
+                    generation.move_aside(directory)
+                os.makedirs(absolute_path)
+                generation.mark_created(directory)
+
+        restored = [entry for entry in tree.entries.values() if current.get(entry.path, (None,))[0] != entry.hash]
+        with Visuals.Progress("restoring", len(restored), sum(entry.size for entry in restored)) as progress:
+            for entry in tree.entries.values():
+                destination = os.path.join(root, entry.path)
+                current_hash, current_mode = current.get(entry.path, (None, None))
+
+                if current_hash != entry.hash:
+                    temp_path = f"{destination}.notty-{os.getpid()}.tmp"
+                    methods[self.objects.restore_file(entry.hash, temp_path)] += 1
+                    Trace.count("files_restored")
+                    Trace.count("bytes_restored", entry.size)
+                    progress.advance(1, entry.size)
+                    os.chmod(temp_path, stat.S_IMODE(entry.mode))
+                    if os.path.lexists(destination):
+                        generation.move_aside(entry.path)
+                    os.replace(temp_path, destination)
+                    generation.mark_created(entry.path)
+                elif stat.S_IMODE(current_mode) != stat.S_IMODE(entry.mode):
+                    generation.mark_mode(entry.path, current_mode)
+                    os.chmod(destination, stat.S_IMODE(entry.mode))
+                else:
+                    continue
+
+                index.update(entry.path, os.stat(destination), entry.hash, trusted=True)
+
+        index.dump()
+        self._finish_rollback(save_object.hash.full, generation)
+        return methods
+
+    def _finish_rollback(self, head: str | None, generation: "Trash.Generation") -> None:
+        """ Make generation available for undo, move head and purge old trash.
+        Head removed since generation was made is forgotten. """
+        generation.close()
+        self.catalog.set_head(head if head in self.catalog.entries else None)
         self._update_edited_date()
+        Trash.purge_in_background(str(self.bin_path))
+
+    def undo(self) -> "Trash.Generation":
+        """ Revert the last rollback (or undo) by moving files from it's trash
+        generation back. Return generation describing the revert itself. """
+        generation = Trash.latest(str(self.bin_path), str(self.path))
+        if generation is None:
+            raise Errors.RepositoryError("Nothing to undo.")
+
+        redo = generation.revert(str(self.bin_path))
+        redo.head = self.catalog.head
+        self._finish_rollback(generation.head, redo)
+        return redo
+
+    def _rollback_legacy_save(self, save_object: Save, generation: "Trash.Generation") -> None:
+        """ Copy back save created before object store was introduced,
+        which holds full copy of the project. """
+        source_root = str(save_object.path).rstrip("/")
+        target_root = str(self.path).rstrip("/")
+
+        for relative_path, entry in Walker.walk(source_root, _is_legacy_meta):
+            if "/" not in relative_path.rstrip("/"):
+                generation.mark_created(relative_path)
+            destination = f"{target_root}/{relative_path}"
+            if relative_path.endswith("/"):
+                os.makedirs(destination, exist_ok=True)
+            else:
+                Transfer.copy_function(entry.path, destination)
 
     def get_ignore_patterns(self) -> list[str]:
         """ Get all ignored patterns from notty.ignore. One line = one pattern. """
+        return self.get_ignore_matcher().patterns
 
-        with open(str(self.repo_path / "notty.ignore"), encoding="utf8") as file:
-            return [line.strip() for line in file.readlines() if line.strip() and not line.startswith("#")]
+    def get_ignore_matcher(self) -> Ignore.IgnoreMatcher:
+        """ Get compiled rules from notty.ignore, cached on file's mtime. """
+        return Ignore.load(str(self.repo_path / "notty.ignore"))
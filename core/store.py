@@ -0,0 +1,292 @@
+""" Repository's metadata (todo tasks, notes, meta keys) kept in a single
+SQLite database .notty/notty.db in WAL mode. Every edit is a single-row
+statement in it's own transaction and reading never writes. Repositories
+created before the database have their todo.json, notes.txt and notty.meta
+imported on first use, the old files are then renamed with MIGRATED_SUFFIX. """
+
+from typing import Any, Iterable, Iterator
+from array import array
+import json
+import re
+import os
+
+STORE_FILE: str = "notty.db"
+SCHEMA_VERSION: int = 3
+MIGRATED_SUFFIX: str = ".migrated"
+LEGACY_TODO_FILE: str = "todo.json"
+LEGACY_NOTES_FILE: str = "notes.txt"
+LEGACY_META_FILE: str = "notty.meta"
+DEFAULT_NOTES: str = "All your project's notes."
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    content TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content TEXT NOT NULL,
+    state INTEGER NOT NULL,
+    importance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+CREATE INDEX IF NOT EXISTS tasks_importance ON tasks (importance);
+CREATE INDEX IF NOT EXISTS tasks_content ON tasks (content);
+CREATE TABLE IF NOT EXISTS grep_blobs (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    is_text INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS grep_postings (
+    trigram INTEGER NOT NULL,
+    batch INTEGER NOT NULL,
+    blobs BLOB NOT NULL,
+    PRIMARY KEY (trigram, batch)
+) WITHOUT ROWID;
+"""
+
+TaskRow = tuple[int, str, int, int]
+
+# Orders are served by indexes, which end with the implicit id (rowid) column.
+TASK_ORDERS: dict[str, str] = {
+    "id": "id",
+    "state": "state, id",
+    "importance": "importance DESC, id DESC",
+    "content": "content, id",
+}
+
+
+class MetadataStore:
+    """ Connection to repository's database, opened on first query.
+    >>> store = MetadataStore(repo_path)
+    >>> store.add_task("content", state, importance) -> id
+    >>> store.query_tasks(states, importances, pattern, sort, limit, offset) -> Iterator[(id, content, state, importance)]
+    >>> store.get_notes() / store.set_notes(content)
+    >>> store.get_meta(key) / store.set_meta(key, value)
+    >>> store.indexed_blobs() / store.add_trigram_batch(blobs, postings) / store.trigram_postings(trigram)
+    """
+
+    def __init__(self, repo_path: str) -> None:
+        self.repo_path = str(repo_path).rstrip("/")
+        self.path = f"{self.repo_path}/{STORE_FILE}"
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # Imported here, as it takes as long as a tenth of CLI startup.
+            import sqlite3
+
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._setup(connection)
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection = connection
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _setup(self, connection) -> None:
+        """ Create or upgrade schema and import legacy files into new database. """
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process could finish setup while this one waited for the lock.
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                connection.execute("COMMIT")
+                return
+            # Schema only adds what is missing, so it also upgrades older databases.
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    connection.execute(statement)
+            migrated = self._import_legacy(connection) if version == 0 else []
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        for name in migrated:
+            path = f"{self.repo_path}/{name}"
+            os.replace(path, path + MIGRATED_SUFFIX)
+
+    def _import_legacy(self, connection) -> list[str]:
+        """ Copy content of todo.json, notes.txt and notty.meta into database.
+        Return names of imported files. """
+        imported = []
+
+        todo_path = f"{self.repo_path}/{LEGACY_TODO_FILE}"
+        if os.path.exists(todo_path):
+            try:
+                with open(todo_path, "r", encoding="utf8") as file:
+                    tasks = json.load(file).get("todo", {})
+            except (json.decoder.JSONDecodeError, AttributeError):
+                tasks = {}
+            connection.executemany(
+                "INSERT INTO tasks (content, state, importance) VALUES (?, ?, ?)",
+                [(content, state, importance) for content, (state, importance) in tasks.items()]
+            )
+            imported.append(LEGACY_TODO_FILE)
+
+        notes_path = f"{self.repo_path}/{LEGACY_NOTES_FILE}"
+        notes = DEFAULT_NOTES
+        if os.path.exists(notes_path):
+            with open(notes_path, "r", encoding="utf8") as file:
+                notes = file.read()
+            imported.append(LEGACY_NOTES_FILE)
+        connection.execute("INSERT OR REPLACE INTO notes (id, content) VALUES (1, ?)", (notes,))
+
+        meta_path = f"{self.repo_path}/{LEGACY_META_FILE}"
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, "r", encoding="utf8") as file:
+                    meta = json.load(file)
+            except json.decoder.JSONDecodeError:
+                meta = {}
+            connection.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in meta.items()]
+            )
+            imported.append(LEGACY_META_FILE)
+
+        return imported
+
+    # -- META --
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_meta(self, key: str, value: Any) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    # -- NOTES --
+
+    def get_notes(self) -> str:
+        row = self.connection.execute("SELECT content FROM notes WHERE id = 1").fetchone()
+        return "" if row is None else row[0]
+
+    def set_notes(self, content: str) -> None:
+        self.connection.execute("INSERT OR REPLACE INTO notes (id, content) VALUES (1, ?)", (content,))
+
+    # -- TASKS --
+
+    def get_task(self, task_id: int) -> TaskRow | None:
+        return self.connection.execute(
+            "SELECT id, content, state, importance FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+
+    def query_tasks(self, states: Iterable[int] = (), importances: Iterable[int] = (), pattern: str | None = None,
+                    sort: str = "id", limit: int | None = None, offset: int = 0) -> Iterator[TaskRow]:
+        """ Yield tasks with any of given states and importances (all if empty),
+        which content matches regular expression pattern, ordered by one of
+        TASK_ORDERS. Rows are read from the database as they are consumed. """
+        conditions = []
+        parameters: list[Any] = []
+        for column, values in (("state", list(states)), ("importance", list(importances))):
+            if values:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                parameters.extend(values)
+        if pattern is not None:
+            self._register_regexp()
+            conditions.append("content REGEXP ?")
+            parameters.append(pattern)
+
+        query = "SELECT id, content, state, importance FROM tasks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {TASK_ORDERS[sort]} LIMIT ? OFFSET ?"
+        parameters.extend((-1 if limit is None else limit, offset))
+        return iter(self.connection.execute(query, parameters))
+
+    def _register_regexp(self) -> None:
+        """ SQLite has REGEXP operator but no implementation of it. """
+        cache: dict[str, re.Pattern] = {}
+
+        def regexp(pattern: str, value: str) -> bool:
+            if pattern not in cache:
+                cache[pattern] = re.compile(pattern)
+            return cache[pattern].search(value) is not None
+
+        self.connection.create_function("REGEXP", 2, regexp, deterministic=True)
+
+    def add_task(self, content: str, state: int, importance: int) -> int:
+        cursor = self.connection.execute(
+            "INSERT INTO tasks (content, state, importance) VALUES (?, ?, ?)", (content, state, importance)
+        )
+        return cursor.lastrowid
+
+    def update_task(self, task_id: int, state: int, importance: int) -> bool:
+        """ Change state and importance of a task. Return whether the task exists. """
+        cursor = self.connection.execute(
+            "UPDATE tasks SET state = ?, importance = ? WHERE id = ?", (state, importance, task_id)
+        )
+        return cursor.rowcount > 0
+
+    def remove_task(self, task_id: int) -> bool:
+        """ Remove a task. Return whether it existed. """
+        return self.connection.execute("DELETE FROM tasks WHERE id = ?", (task_id,)).rowcount > 0
+
+    def clear_tasks(self) -> None:
+        self.connection.execute("DELETE FROM tasks")
+
+    # -- TRIGRAM INDEX --
+
+    def indexed_blobs(self) -> dict[str, tuple[int, bool]]:
+        """ Return {hash: (id, is_text)} of every blob in trigram index. """
+        return {
+            full_hash: (blob_id, bool(is_text))
+            for blob_id, full_hash, is_text in self.connection.execute("SELECT id, hash, is_text FROM grep_blobs")
+        }
+
+    def add_trigram_batch(self, blobs: dict[str, bool], postings: dict[str, set[int]]) -> int:
+        """ Add blobs ({hash: is_text}) with their trigrams ({hash: trigrams}) in
+        one transaction. Blobs indexed meanwhile by another process are skipped.
+        Every batch stores one row per trigram, holding ids of it's blobs. """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            known = {
+                row[0] for row in connection.execute(
+                    f"SELECT hash FROM grep_blobs WHERE hash IN ({', '.join('?' * len(blobs))})", list(blobs)
+                )
+            } if blobs else set()
+
+            by_trigram: dict[int, array] = {}
+            batch = None
+            for full_hash, is_text in blobs.items():
+                if full_hash in known:
+                    continue
+                blob_id = connection.execute(
+                    "INSERT INTO grep_blobs (hash, is_text) VALUES (?, ?)", (full_hash, int(is_text))
+                ).lastrowid
+                batch = blob_id if batch is None else batch
+                for trigram in postings.get(full_hash, ()):
+                    by_trigram.setdefault(trigram, array("I")).append(blob_id)
+
+            connection.executemany(
+                "INSERT INTO grep_postings (trigram, batch, blobs) VALUES (?, ?, ?)",
+                ((trigram, batch, ids.tobytes()) for trigram, ids in by_trigram.items())
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return len(blobs) - len(known)
+
+    def trigram_postings(self, trigram: int) -> set[int]:
+        """ Return ids of indexed blobs containing trigram. """
+        found = set()
+        for (blobs,) in self.connection.execute("SELECT blobs FROM grep_postings WHERE trigram = ?", (trigram,)):
+            ids = array("I")
+            ids.frombytes(blobs)
+            found.update(ids)
+        return found
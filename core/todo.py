@@ -1,118 +1,184 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from colorama import Fore, Back
-from tabulate import tabulate
 from enum import Enum
-from typing import List
-import json
+from typing import Iterator
 
-from core.path import Path
+from core.store import MetadataStore, TaskRow
 from core import visuals
 
 
-__BLANK_CONTENT__: dict[str, dict[str, List[int]]] = {
-    "todo": {
-        # TASK_CONTENT: [STATE, IMPORTANCE]
-    }
-}
-
-
 class State(Enum):
     PENDING = 0
     IN_PROGRESS = 1
     FINISHED = 2
 
+STATE_NAMES: dict[int, str] = {
+    State.PENDING.value: "pending",
+    State.IN_PROGRESS.value: "in progress",
+    State.FINISHED.value: "finished",
+}
+
 STATE_TRANSLATION: dict[int, str] = {
     State.PENDING.value: f"{Fore.RED}pending{Fore.RESET}",
     State.IN_PROGRESS.value: f"{Fore.YELLOW}in progress{Fore.RESET}",
     State.FINISHED.value: f"{Fore.LIGHTBLACK_EX}finished{Fore.RESET}"
 }
 
+STATE_ALIASES: dict[tuple[str, ...], State] = {
+    ("pending", "p", "1"): State.PENDING,
+    ("in_progress", "i", "2"): State.IN_PROGRESS,
+    ("done", "finished", "d", "f", "3"): State.FINISHED,
+}
+
 class Importance(Enum):
     LOW = 0
     MEDIUM = 1
     HIGH = 2
 
+IMPORTANCE_NAMES: dict[int, str] = {
+    Importance.LOW.value: "low",
+    Importance.MEDIUM.value: "medium",
+    Importance.HIGH.value: "high",
+}
+
 IMPORTANCE_TRANSLATION: dict[int, str] = {
     Importance.LOW.value: f"{Fore.GREEN}low{Fore.RESET}",
     Importance.MEDIUM.value: f"{Fore.YELLOW}medium{Fore.RESET}",
     Importance.HIGH.value: f"{Back.RED}high{Back.RESET}"
 }
 
+IMPORTANCE_ALIASES: dict[tuple[str, ...], Importance] = {
+    ("l", "low", "1"): Importance.LOW,
+    ("m", "mid", "medium", "2"): Importance.MEDIUM,
+    ("h", "high", "!", "3"): Importance.HIGH,
+}
+
+ID_WIDTH: int = 6
+STATE_WIDTH: int = 13
+IMPORTANCE_WIDTH: int = 12
+
+
+def parse_state(value: str) -> State | None:
+    """ Return state named by any of it's aliases or None. """
+    value = value.strip().lower()
+    return next((state for aliases, state in STATE_ALIASES.items() if value in aliases), None)
+
+
+def parse_importance(value: str) -> Importance | None:
+    """ Return importance named by any of it's aliases or None. """
+    value = value.strip().lower()
+    return next((importance for aliases, importance in IMPORTANCE_ALIASES.items() if value in aliases), None)
+
 
 @dataclass
 class Task:
-    """ Represents each task. """
+    """ Represents each task. id is assigned when task is stored. """
     content: str
     state: State
     importance: Importance
+    id: int | None = None
 
     @staticmethod
-    def load_tasks_from_file(path: Path) -> List["Task"]:
-        tasks = []
-        with open(str(path), encoding="utf8") as file:
-            content: dict[str, List[int]] = json.load(file)["todo"]
-
-        for content, data in content.items():
-            state_int, importance_int = data
-            try:
-                state = State(state_int)
-            except ValueError:
-                visuals.display_warning(f"todo: invalid state value found for: {content}")
-                state = State.PENDING
-
-            try:
-                importance = Importance(importance_int)
-            except ValueError:
-                visuals.display_warning(f"todo: invalid importance value found for: {content}")
-                importance = Importance.LOW
-
-            task = Task(content, state, importance)
-            tasks.append(task)
-
-        return tasks
+    def from_row(row: TaskRow) -> "Task":
+        task_id, content, state_int, importance_int = row
+        try:
+            state = State(state_int)
+        except ValueError:
+            visuals.display_warning(f"todo: invalid state value found for: {content}")
+            state = State.PENDING
 
+        try:
+            importance = Importance(importance_int)
+        except ValueError:
+            visuals.display_warning(f"todo: invalid importance value found for: {content}")
+            importance = Importance.LOW
 
-class TodoList:
+        return Task(content, state, importance, task_id)
 
-    def __init__(self, path: Path) -> None:
-        self.path = path
-        self.tasks = Task.load_tasks_from_file(path)
-        self.save()
 
-    def display_tasks(self) -> None:
-        header = ["CONTENT", "STATE", "IMPORTANCE"]
-        table = []
-        
-        for task in self.tasks:
-            state = State(task.state)
-            state_name = STATE_TRANSLATION[state.value]
+@dataclass
+class TaskQuery:
+    """ Which tasks and in what order are shown. Empty states or importances
+    match every task, pattern is a regular expression searched in content. """
+    states: list[State] = field(default_factory=list)
+    importances: list[Importance] = field(default_factory=list)
+    pattern: str | None = None
+    sort: str = "id"
+    limit: int | None = None
+    offset: int = 0
 
-            content = task.content
-            if state == State.FINISHED:
-                content = f"{Fore.LIGHTBLACK_EX}{task.content}{Fore.RESET}"
 
-            importance = IMPORTANCE_TRANSLATION[Importance(task.importance).value]
-            table.append([content, state_name, importance])
+def _pad(colored: str, plain: str, width: int) -> str:
+    """ Pad colored text to width of it's plain version. """
+    return colored + " " * max(1, width - len(plain))
 
-        print(tabulate(table, headers=header, tablefmt="pretty", stralign="left", showindex=True))
 
-    def remove_task(self, index: int) -> None:
-        try:
-            self.tasks.pop(index)
-            self.save()
-        except IndexError:
-            visuals.display_error(f"todo: Invalid index: {index}")
+class TodoList:
+    """ Tasks kept in repository's metadata store. Tasks are identified by ids
+    which never change. Queries are answered by the store's indexes and shown
+    row by row while they are read, so no list of tasks is held in memory. """
+
+    def __init__(self, store: MetadataStore) -> None:
+        self.store = store
+
+    def iter_tasks(self, query: TaskQuery | None = None) -> Iterator[Task]:
+        query = query or TaskQuery()
+        rows = self.store.query_tasks(
+            [state.value for state in query.states],
+            [importance.value for importance in query.importances],
+            query.pattern,
+            query.sort,
+            query.limit,
+            query.offset
+        )
+        for row in rows:
+            yield Task.from_row(row)
+
+    def display_tasks(self, query: TaskQuery | None = None) -> int:
+        """ Print tasks matching query, return how many were printed. """
+        mode = visuals.output_mode
+        if mode == visuals.OutputMode.TERMINAL:
+            print(f"{Fore.LIGHTBLACK_EX}{'ID'.rjust(ID_WIDTH)}  {'STATE'.ljust(STATE_WIDTH)}{'IMPORTANCE'.ljust(IMPORTANCE_WIDTH)}CONTENT")
+
+        shown = 0
+        for task in self.iter_tasks(query):
+            shown += 1
+            state = task.state.value
+            importance = task.importance.value
+
+            if mode == visuals.OutputMode.JSON:
+                visuals.emit_json(
+                    "task", id=task.id, content=task.content,
+                    state=STATE_NAMES[state], importance=IMPORTANCE_NAMES[importance]
+                )
+            elif mode == visuals.OutputMode.QUIET:
+                print(f"{task.id}\t{STATE_NAMES[state]}\t{IMPORTANCE_NAMES[importance]}\t{task.content}")
+            else:
+                content = task.content
+                if task.state == State.FINISHED:
+                    content = f"{Fore.LIGHTBLACK_EX}{task.content}{Fore.RESET}"
+                print(
+                    f"{Fore.CYAN}{str(task.id).rjust(ID_WIDTH)}{Fore.RESET}  "
+                    f"{_pad(STATE_TRANSLATION[state], STATE_NAMES[state], STATE_WIDTH)}"
+                    f"{_pad(IMPORTANCE_TRANSLATION[importance], IMPORTANCE_NAMES[importance], IMPORTANCE_WIDTH)}"
+                    f"{content}"
+                )
+
+        if shown == 0 and mode == visuals.OutputMode.TERMINAL:
+            print(f"{' ' * ID_WIDTH}  {Fore.RED}(no tasks)")
+        return shown
+
+    def get_task(self, task_id: int) -> Task | None:
+        row = self.store.get_task(task_id)
+        return None if row is None else Task.from_row(row)
+
+    def remove_task(self, task_id: int) -> None:
+        if not self.store.remove_task(task_id):
+            visuals.display_error(f"todo: Invalid task id: {task_id}")
 
     def append_task(self, task: Task) -> None:
-        self.tasks.append(task)
-        self.save()
-
-    def as_dict(self) -> dict:
-        data = {"todo": {}}
-        for task in self.tasks:
-            data["todo"].update({task.content: [task.state.value, task.importance.value]})
-        return data
-
-    def save(self) -> None:
-        with open(str(self.path), "w+", encoding="utf8") as file:
-            json.dump(self.as_dict(), file)
+        task.id = self.store.add_task(task.content, task.state.value, task.importance.value)
+
+    def update_task(self, task: Task) -> None:
+        """ Store changed state and importance of a task. """
+        self.store.update_task(task.id, task.state.value, task.importance.value)
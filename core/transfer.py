@@ -0,0 +1,131 @@
+""" Zero-copy file transfer. Files are copied with the fastest method the
+filesystem supports, so on copy-on-write filesystems (btrfs, xfs) saving and
+restoring big files costs almost nothing and on others data at least never
+passes through Python's memory.
+
+Methods are tried in order:
+    reflink -> copy_file_range -> sendfile -> buffered copy
+Method which failed because filesystem does not support it is not tried
+again for the same pair of devices. Destination never shares data with
+source which could be changed through it (no hardlinks), so restored files
+can be edited without touching stored blobs.
+"""
+
+from enum import Enum
+import threading
+import shutil
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE: int = 0x40049409
+SENDFILE_BLOCK_SIZE: int = 64 * 1024 * 1024
+
+_UNSUPPORTED_ERRORS = {
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+    errno.ENOTTY, errno.EPERM, errno.EBADF, errno.ETXTBSY,
+}
+
+
+class Method(Enum):
+    """ Ways of transferring a file, fastest first. """
+    REFLINK = "reflink"
+    COPY_FILE_RANGE = "copy_file_range"
+    SENDFILE = "sendfile"
+    BUFFERED = "buffered"
+
+
+class _ShortCopy(OSError):
+    """ Kernel transferred less than size of the file, buffered copy is used instead. """
+
+
+_unsupported: set[tuple[Method, int, int]] = set()
+_lock = threading.Lock()
+
+
+def _is_supported(method: Method, devices: tuple[int, int]) -> bool:
+    return (method, *devices) not in _unsupported
+
+def _mark_unsupported(method: Method, devices: tuple[int, int]) -> None:
+    with _lock:
+        _unsupported.add((method, *devices))
+
+
+def _reflink(source_fd: int, target_fd: int, size: int) -> None:
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "ioctl is not available")
+    fcntl.ioctl(target_fd, FICLONE, source_fd)
+
+def _copy_file_range(source_fd: int, target_fd: int, size: int) -> None:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(source_fd, target_fd, size - copied)
+        if sent == 0:
+            raise _ShortCopy(f"copied only {copied} of {size} bytes")
+        copied += sent
+
+def _sendfile(source_fd: int, target_fd: int, size: int) -> None:
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(target_fd, source_fd, copied, min(SENDFILE_BLOCK_SIZE, size - copied))
+        if sent == 0:
+            raise _ShortCopy(f"copied only {copied} of {size} bytes")
+        copied += sent
+
+
+_KERNEL_METHODS = (
+    (Method.REFLINK, _reflink),
+    (Method.COPY_FILE_RANGE, _copy_file_range),
+    (Method.SENDFILE, _sendfile),
+)
+
+
+def copy_file(source: str, destination: str) -> Method:
+    """ Copy content of source to destination (which is replaced) and return
+    method which was used. """
+    source_stat = os.stat(source)
+    target_dir = os.path.dirname(os.path.abspath(destination))
+    devices = (source_stat.st_dev, os.stat(target_dir).st_dev)
+
+    with open(source, "rb") as source_file, open(destination, "wb") as target_file:
+        for method, function in _KERNEL_METHODS:
+            if not _is_supported(method, devices):
+                continue
+            try:
+                function(source_file.fileno(), target_file.fileno(), source_stat.st_size)
+                return method
+            except OSError as error:
+                # Short copy (e.g. file shrunk meanwhile) is finished by buffered copy.
+                if not isinstance(error, _ShortCopy):
+                    if error.errno not in _UNSUPPORTED_ERRORS:
+                        raise
+                    _mark_unsupported(method, devices)
+                # Partially transferred data is discarded before next attempt.
+                target_file.seek(0)
+                target_file.truncate()
+                source_file.seek(0)
+                if isinstance(error, _ShortCopy):
+                    break
+
+        shutil.copyfileobj(source_file, target_file)
+        return Method.BUFFERED
+
+
+def copy_function(source: str, destination: str) -> str:
+    """ copy_file with shutil.copy2 signature, usable as copytree's copy_function. """
+    copy_file(source, destination)
+    shutil.copystat(source, destination)
+    return destination
+
+
+def summarize(methods: dict[Method, int]) -> str:
+    """ Return readable summary of used methods, e.g. "reflink: 10, buffered: 2". """
+    return ", ".join(f"{method.value}: {count}" for method, count in methods.items() if count) or "nothing"
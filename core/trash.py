@@ -0,0 +1,235 @@
+""" Rename based trash kept in .notty/bin/. Files replaced or removed by an
+operation (like rollback) are moved aside into a generation directory with
+renames, which cost the same for a file and for a whole directory, so nothing
+is deleted while user waits. Old generations are purged in a detached
+background process, the newest one can be undone.
+
+Generation layout:
+    bin/<time_ns>-<pid>/files/...     moved aside paths, relative to project's root
+    bin/<time_ns>-<pid>/notty.trash   manifest, written when generation is complete
+"""
+
+from typing import Any
+import shutil
+import errno
+import json
+import stat
+import time
+import os
+
+import core.process as Process
+
+TRASH_MANIFEST: str = "notty.trash"
+FILES_DIRECTORY: str = "files"
+PURGING_SUFFIX: str = ".purging"
+MAX_GENERATIONS: int = 10
+MAX_AGE_S: int = 7 * 24 * 60 * 60
+MAX_SIZE: int = 1024 * 1024 * 1024
+
+
+class Generation:
+    """ Paths moved aside by a single operation and what is needed to revert it:
+    paths the operation created and previous modes of files it only chmod-ed.
+    >>> generation = Generation.create(bin_path, root)
+    >>> generation.move_aside(relative_path)
+    >>> generation.close()
+    """
+
+    def __init__(self, path: str, root: str) -> None:
+        self.path = path
+        self.root = root.rstrip("/")
+        self.date_created = 0
+        self.head: str | None = None
+        self.moved: list[str] = []
+        self.created: list[str] = []
+        self.modes: dict[str, int] = {}
+
+    @staticmethod
+    def create(bin_path: str, root: str) -> "Generation":
+        """ Start new, empty generation. """
+        generation = Generation(f"{bin_path.rstrip('/')}/{time.time_ns():020d}-{os.getpid()}", root)
+        generation.date_created = time.time_ns()
+        os.makedirs(f"{generation.path}/{FILES_DIRECTORY}")
+        return generation
+
+    @staticmethod
+    def load(path: str, root: str) -> "Generation":
+        """ Read complete generation from it's manifest. """
+        with open(f"{path}/{TRASH_MANIFEST}", "r", encoding="utf8") as file:
+            content: dict[str, Any] = json.load(file)
+
+        generation = Generation(path, root)
+        generation.date_created = content.get("date_created", 0)
+        generation.head = content.get("head")
+        generation.moved = content.get("moved", [])
+        generation.created = content.get("created", [])
+        generation.modes = content.get("modes", {})
+        return generation
+
+    def move_aside(self, relative_path: str) -> None:
+        """ Move file or directory from working tree into this generation. """
+        relative_path = relative_path.rstrip("/")
+        destination = f"{self.path}/{FILES_DIRECTORY}/{relative_path}"
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        _merge(f"{self.root}/{relative_path}", destination)
+        self.moved.append(relative_path)
+
+    def mark_created(self, relative_path: str) -> None:
+        """ Remember path which did not exist before the operation. """
+        self.created.append(relative_path.rstrip("/"))
+
+    def mark_mode(self, relative_path: str, mode: int) -> None:
+        """ Remember mode file had before the operation. """
+        self.modes[relative_path] = stat.S_IMODE(mode)
+
+    def close(self) -> None:
+        """ Write manifest, which makes generation visible for undo and purge. """
+        content = {
+            "date_created": self.date_created,
+            "head": self.head,
+            "moved": self.moved,
+            "created": self.created,
+            "modes": self.modes,
+        }
+        temp_path = f"{self.path}/{TRASH_MANIFEST}.tmp"
+        with open(temp_path, "w", encoding="utf8") as file:
+            json.dump(content, file)
+        os.replace(temp_path, f"{self.path}/{TRASH_MANIFEST}")
+
+    def revert(self, bin_path: str) -> "Generation":
+        """ Bring moved aside paths back to working tree and move away paths
+        which were created. Return new generation describing this revert,
+        so it can be reverted as well. This generation is discarded. """
+        redo = Generation.create(bin_path, self.root)
+        for relative_path in self.created:
+            if os.path.lexists(f"{self.root}/{relative_path}"):
+                redo.move_aside(relative_path)
+
+        for relative_path, mode in self.modes.items():
+            absolute_path = f"{self.root}/{relative_path}"
+            if os.path.exists(absolute_path):
+                redo.mark_mode(relative_path, os.stat(absolute_path).st_mode)
+                os.chmod(absolute_path, mode)
+
+        for relative_path in self.moved:
+            source = f"{self.path}/{FILES_DIRECTORY}/{relative_path}"
+            destination = f"{self.root}/{relative_path}"
+            if not os.path.lexists(source):
+                continue
+            # Path created after the operation is not overwritten, it is moved aside as well.
+            if os.path.lexists(destination) and not (_is_directory(source) and _is_directory(destination)):
+                redo.move_aside(relative_path)
+
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            _merge(source, destination)
+            redo.mark_created(relative_path)
+
+        discard(self.path)
+        return redo
+
+
+def _move(source: str, destination: str) -> None:
+    """ Rename path, copying it only when it is on a different device. """
+    try:
+        os.rename(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        shutil.move(source, destination)
+
+
+def _is_directory(path: str) -> bool:
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def _merge(source: str, destination: str) -> None:
+    """ Move source to destination. When both are directories, content of source
+    is moved into destination one by one, as path moved earlier within the same
+    generation could have already created the directory. """
+    if not (_is_directory(source) and _is_directory(destination)):
+        _move(source, destination)
+        return
+    for name in os.listdir(source):
+        _merge(f"{source}/{name}", f"{destination}/{name}")
+    os.rmdir(source)
+
+
+def _force_remove(function, path: str, _) -> None:
+    """ Make read-only parent directory writable and retry removal. """
+    os.chmod(os.path.dirname(path), stat.S_IRWXU)
+    function(path)
+
+
+def discard(path: str) -> None:
+    """ Delete generation. It is renamed first, so it is claimed by a single
+    caller and never seen as complete while being deleted. """
+    claimed = path + PURGING_SUFFIX
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(claimed, onerror=_force_remove)
+
+
+def generations(bin_path: str) -> list[str]:
+    """ Return paths of complete generations, newest first. """
+    if not os.path.isdir(bin_path):
+        return []
+    names = [
+        name for name in os.listdir(bin_path)
+        if os.path.exists(f"{bin_path}/{name}/{TRASH_MANIFEST}")
+    ]
+    return [f"{bin_path}/{name}" for name in sorted(names, reverse=True)]
+
+
+def latest(bin_path: str, root: str) -> Generation | None:
+    """ Return newest complete generation. """
+    paths = generations(bin_path)
+    return Generation.load(paths[0], root) if paths else None
+
+
+def _size(path: str) -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_blocks * 512
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def purge(bin_path: str, max_generations: int = MAX_GENERATIONS,
+          max_age: float = MAX_AGE_S, max_size: int = MAX_SIZE) -> None:
+    """ Delete generations beyond the newest max_generations, older than max_age
+    seconds or not fitting in max_size bytes counting from the newest. The newest
+    generation is kept unless it is too old. Leftovers of interrupted operations
+    and purges are deleted as well. """
+    if not os.path.isdir(bin_path):
+        return
+
+    now = time.time()
+    complete = generations(bin_path)
+    for name in os.listdir(bin_path):
+        path = f"{bin_path}/{name}"
+        if path in complete or not os.path.isdir(path):
+            continue
+        if name.endswith(PURGING_SUFFIX):
+            shutil.rmtree(path, onerror=_force_remove)
+        elif now - os.stat(path).st_mtime > max_age:
+            discard(path)
+
+    total_size = 0
+    for position, path in enumerate(complete):
+        with open(f"{path}/{TRASH_MANIFEST}", "r", encoding="utf8") as file:
+            age = now - json.load(file).get("date_created", 0) / 1e9
+        total_size += _size(path)
+
+        is_newest = position == 0
+        if age > max_age or (not is_newest and (position >= max_generations or total_size > max_size)):
+            discard(path)
+
+
+def purge_in_background(bin_path: str) -> None:
+    """ Start detached process purging trash, so caller does not wait for deletes. """
+    Process.run_detached("from core.trash import purge; purge(sys.argv[1])", bin_path, cwd=bin_path)
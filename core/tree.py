@@ -0,0 +1,130 @@
+""" Save's manifest. Describes which blob from object store is located
+under which path of the project, so save does not need to hold a copy.
+Every directory has a subtree hash (Merkle tree) derived from names, modes
+and hashes of everything inside it. Hash of the root directory identifies
+the whole state, so equal states and equal subtrees are found by a single
+comparison. """
+
+from dataclasses import dataclass, field
+import hashlib
+import json
+import stat
+
+TREE_FILE: str = "notty.tree"
+
+
+@dataclass(slots=True)
+class TreeEntry:
+    """ Single file stored in a save. Path is relative to project's root
+    and always uses / as separator. """
+    path: str
+    hash: str
+    mode: int
+    size: int
+
+
+def _parent(path: str) -> tuple[str, str]:
+    """ Return (parent directory, name) of a file or directory (ending with /) path. """
+    parent, _, name = path.rstrip("/").rpartition("/")
+    return (parent + "/" if parent else ""), name
+
+
+@dataclass
+class Tree:
+    """ All files and directories stored in a save. Directories end with /,
+    subtrees maps them ("" is the root) to their hashes once they are computed. """
+    entries: dict[str, TreeEntry] = field(default_factory=dict)
+    directories: list[str] = field(default_factory=list)
+    subtrees: dict[str, str] = field(default_factory=dict)
+
+    def add(self, entry: TreeEntry) -> None:
+        """ Add or replace entry under it's path. """
+        self.entries[entry.path] = entry
+        if self.subtrees:
+            self.subtrees = {}
+
+    def compute_subtrees(self) -> dict[str, str]:
+        """ Hash every directory, deepest first. Directory's hash covers sorted
+        records of its files ("f <mode> <name>\\0<hash>") and subdirectories
+        ("d <name>\\0<subtree hash>"). Names cannot contain NUL and hashes have
+        fixed length, so different directories never produce the same records. """
+        records: dict[str, list[str]] = {"": []}
+        for directory in self.directories:
+            while directory not in records:
+                records[directory] = []
+                directory, _ = _parent(directory)
+
+        for entry in self.entries.values():
+            parent, name = _parent(entry.path)
+            while parent not in records:
+                records[parent] = []
+                parent, _ = _parent(parent)
+            records[parent].append(f"f {stat.S_IMODE(entry.mode):o} {name}\0{entry.hash}")
+
+        subtrees = {}
+        for directory in sorted(records, key=lambda directory: directory.count("/"), reverse=True):
+            directory_records = records[directory]
+            directory_records.sort()
+            subtrees[directory] = hashlib.sha256("".join(directory_records).encode("utf8", "surrogateescape")).hexdigest()
+            if directory:
+                parent, name = _parent(directory)
+                records[parent].append(f"d {name}\0{subtrees[directory]}")
+
+        self.subtrees = subtrees
+        return subtrees
+
+    @property
+    def root_hash(self) -> str:
+        """ Hash identifying content of the whole tree. """
+        if not self.subtrees:
+            self.compute_subtrees()
+        return self.subtrees[""]
+
+    def unchanged_directories(self, other: "Tree") -> set[str]:
+        """ Return directories which content is identical in both trees. """
+        if not self.subtrees:
+            self.compute_subtrees()
+        if not other.subtrees:
+            other.compute_subtrees()
+        return {
+            directory for directory, subtree_hash in self.subtrees.items()
+            if other.subtrees.get(directory) == subtree_hash
+        }
+
+    def hashes(self) -> set[str]:
+        """ Return set of all blob hashes referenced by this tree. """
+        return {entry.hash for entry in self.entries.values()}
+
+    def dump(self, path: str) -> None:
+        """ Write tree into given manifest file. """
+        content = {
+            "directories": self.directories,
+            "subtrees": self.subtrees or self.compute_subtrees(),
+            "entries": {
+                entry.path: [entry.hash, entry.mode, entry.size]
+                for entry in self.entries.values()
+            },
+        }
+        with open(path, "w", encoding="utf8") as file:
+            # json.dumps uses C encoder, json.dump writes piece by piece in Python.
+            file.write(json.dumps(content))
+
+    @staticmethod
+    def load_hashes(path: str) -> set[str]:
+        """ Read only blob hashes of tree from given manifest file. """
+        with open(path, "r", encoding="utf8") as file:
+            content = json.load(file)
+        return {full_hash for full_hash, _, _ in content.get("entries", {}).values()}
+
+    @staticmethod
+    def load(path: str) -> "Tree":
+        """ Read tree from given manifest file. """
+        with open(path, "r", encoding="utf8") as file:
+            content = json.load(file)
+
+        tree = Tree(directories=content.get("directories", []))
+        for entry_path, (full_hash, mode, size) in content.get("entries", {}).items():
+            tree.entries[entry_path] = TreeEntry(entry_path, full_hash, mode, size)
+        # Trees written before subtree hashes get them computed on first use.
+        tree.subtrees = content.get("subtrees", {})
+        return tree
@@ -1,12 +1,53 @@
-from typing import Callable, Self, Any, Literal
+from typing import Callable, Iterable, Self, Any, Literal
 from colorama import init, Back, Fore
+from enum import Enum
+import threading
+import json
+import time
+import sys
 
 from core.path import Path
+import core.trace as Trace
 
 init(autoreset=True)
 
+REDRAW_INTERVAL_S: float = 0.1
+JSON_PROGRESS_INTERVAL_S: float = 1.0
+
+
+class OutputMode(Enum):
+    """ TERMINAL output is colored and decorated. QUIET prints only requested
+    data (lists, descriptions, diffs) as plain text and errors and warnings
+    to stderr. JSON prints every message as a single line JSON object. """
+    TERMINAL = "terminal"
+    QUIET = "quiet"
+    JSON = "json"
+
+
+output_mode = OutputMode.TERMINAL
+
+
+def set_output_mode(mode: OutputMode) -> None:
+    global output_mode
+    output_mode = mode
+
+
+def emit_json(kind: str, **fields: Any) -> None:
+    print(json.dumps({"type": kind, **fields}), flush=True)
+
+
+def _display_message(level: str, message: str, terminal_line: str) -> None:
+    if output_mode == OutputMode.TERMINAL:
+        print(terminal_line)
+    elif output_mode == OutputMode.JSON:
+        emit_json("message", level=level, message=message)
+    elif level in ("error", "warning"):
+        print(f"{level}: {message}", file=sys.stderr)
+
 
 class ProcessCallback:
+    """ Print progress of a process. Every message ends a step of the process,
+    which is measured (wall and CPU time, syscall I/O, counters) and kept in steps. """
     processes = 0
 
     @staticmethod
@@ -27,8 +68,35 @@ class ProcessCallback:
         self._warn = 0
         self._info = 0
         self._success = 0
+        self.steps: list[tuple[str, dict[str, float | int]]] = []
+
+    def _end_step(self, name: str) -> dict[str, float | int]:
+        end = Trace.sample()
+        measurement = Trace.record(name, "step", self._step_start, end)
+        self.steps.append((name, measurement))
+        self._step_start = end
+        return measurement
+
+    def _message(self, level: str, value: str, terminal_line: str) -> None:
+        if output_mode == OutputMode.TERMINAL:
+            print(terminal_line)
+            self._end_step(value)
+            return
+
+        measurement = self._end_step(value)
+        if output_mode == OutputMode.JSON:
+            emit_json("step", process=self.name.strip(), level=level, message=value, wall_s=measurement["wall_s"])
+        elif level in ("error", "warning"):
+            print(f"{level}: {value}", file=sys.stderr)
 
     def __enter__(self) -> Self:
+        self._start = self._step_start = Trace.sample()
+        if output_mode != OutputMode.TERMINAL:
+            ProcessCallback.processes += 1
+            if output_mode == OutputMode.JSON:
+                emit_json("process", name=self.name.strip(), status="started")
+            return self
+
         if ProcessCallback.processes == 0:
             print("\n")
 
@@ -38,6 +106,11 @@ class ProcessCallback:
         return self
 
     def __exit__(self, ex_type: type, ex_value: Exception, ex_tb: Any) -> Literal[True]:
+        if ex_type is not None:
+            self._end_step(f"failed: {ex_value}")
+        if output_mode != OutputMode.TERMINAL:
+            return self._exit_plain(ex_type, ex_value)
+
         print(f"{ProcessCallback._indent()}{Fore.LIGHTBLACK_EX}:")
         print(f"{ProcessCallback._indent()}├─> {Fore.RED}{self._error} {Fore.YELLOW}{self._warn} {Fore.GREEN}{self._success} {Fore.RESET}{self._info}")
 
@@ -51,38 +124,178 @@ class ProcessCallback:
         
         print(ProcessCallback._exit_indent())
         ProcessCallback.processes -= 1
+        Trace.record(self.name.strip(), "process", self._start, Trace.sample())
+        return True
+
+    def _exit_plain(self, ex_type: type, ex_value: Exception) -> Literal[True]:
+        ProcessCallback.processes -= 1
+        measurement = Trace.record(self.name.strip(), "process", self._start, Trace.sample())
+        if output_mode == OutputMode.JSON:
+            emit_json(
+                "process",
+                name=self.name.strip(),
+                status="ok" if ex_type is None else "failed",
+                message=self.success_message if ex_type is None else f"({ex_type.__name__}) {ex_value}",
+                counts={"error": self._error, "warning": self._warn, "success": self._success, "info": self._info},
+                wall_s=measurement["wall_s"],
+            )
+        elif ex_type is not None:
+            print(f"error: {self.name.strip()} failed: ({ex_type.__name__}) {ex_value}", file=sys.stderr)
         return True
 
     def error(self, value: str) -> None:
-        print(f"{ProcessCallback._indent()}{Fore.RED}• {value}")
         self._error += 1
+        self._message("error", value, f"{ProcessCallback._indent()}{Fore.RED}• {value}")
 
     def warn(self, value: str) -> None:
-        print(f"{ProcessCallback._indent()}{Fore.YELLOW}• {value}")
         self._warn += 1
+        self._message("warning", value, f"{ProcessCallback._indent()}{Fore.YELLOW}• {value}")
 
     def info(self, value: str) -> None:
-        print(f"{ProcessCallback._indent()}• {value}")
         self._info += 1
+        self._message("info", value, f"{ProcessCallback._indent()}• {value}")
 
     def success(self, value: str) -> None:
-        print(f"{ProcessCallback._indent()}{Fore.GREEN}• {value}")
         self._success += 1
+        self._message("success", value, f"{ProcessCallback._indent()}{Fore.GREEN}• {value}")
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02}m"
+    return f"{seconds // 60}:{seconds % 60:02}"
+
+
+class Progress:
+    """ Progress of a long operation on many files. advance() is cheap and
+    thread-safe, the state is redrawn on a single terminal line every
+    REDRAW_INTERVAL_S (only when stdout is a terminal), emitted every
+    JSON_PROGRESS_INTERVAL_S in JSON mode and never shown in quiet mode.
+    Drawing is done by a timer thread, so the line keeps moving (rates, ETA)
+    while a single big file is being processed.
+    When work is discovered while it is done, add_total() grows the total
+    and ETA is shown once finish_total() is called.
+    >>> with Progress("restoring", files, size) as progress:
+    >>>     progress.advance(1, file_size)
+    """
+
+    def __init__(self, label: str, total_files: int = 0, total_bytes: int = 0, is_total_known: bool = True) -> None:
+        self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.is_total_known = is_total_known
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._is_shown = False
+        self._interval = JSON_PROGRESS_INTERVAL_S if output_mode == OutputMode.JSON else REDRAW_INTERVAL_S
+        self._enabled = output_mode == OutputMode.JSON or (output_mode == OutputMode.TERMINAL and sys.stdout.isatty())
+        self._stopped = threading.Event()
+        self._timer: threading.Thread | None = None
+
+    def __enter__(self) -> Self:
+        self._start = time.monotonic()
+        if self._enabled:
+            self._timer = threading.Thread(target=self._redraw, name="notty-progress", daemon=True)
+            self._timer.start()
+        return self
+
+    def __exit__(self, ex_type: type, ex_value: Exception, ex_tb: Any) -> None:
+        if self._timer is not None:
+            self._stopped.set()
+            self._timer.join()
+        if output_mode == OutputMode.JSON and self.files:
+            emit_json("progress", **self.state(), finished=ex_type is None)
+        elif self._is_shown:
+            print("\r\033[K", end="", flush=True)
+
+    def add_total(self, files: int = 1, size: int = 0) -> None:
+        with self._lock:
+            self.total_files += files
+            self.total_bytes += size
+
+    def finish_total(self) -> None:
+        self.is_total_known = True
+
+    def advance(self, files: int = 1, size: int = 0) -> None:
+        with self._lock:
+            self.files += files
+            self.bytes += size
+
+    def _redraw(self) -> None:
+        """ Draw state every interval until progress is finished. """
+        while not self._stopped.wait(self._interval):
+            with self._lock:
+                self._draw()
+
+    def state(self) -> dict[str, Any]:
+        """ Return done and total work, rates and ETA in seconds (None while unknown). """
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        files_per_s = self.files / elapsed
+        bytes_per_s = self.bytes / elapsed
+        eta = None
+        if self.is_total_known:
+            if self.total_bytes and bytes_per_s:
+                eta = (self.total_bytes - self.bytes) / bytes_per_s
+            elif files_per_s:
+                eta = (self.total_files - self.files) / files_per_s
+        return {
+            "label": self.label,
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "files_per_s": round(files_per_s, 1),
+            "bytes_per_s": round(bytes_per_s),
+            "eta_s": None if eta is None else round(max(eta, 0.0), 1),
+        }
+
+    def _draw(self) -> None:
+        state = self.state()
+        if output_mode == OutputMode.JSON:
+            emit_json("progress", **state, finished=False)
+            return
+
+        eta = "?" if state["eta_s"] is None else _format_duration(state["eta_s"])
+        line = (
+            f"{ProcessCallback._indent()}{Fore.LIGHTBLACK_EX}• {Fore.RESET}{self.label}: "
+            f"{self.files}/{self.total_files} files, {self.bytes / 1e6:.1f}/{self.total_bytes / 1e6:.1f} MB "
+            f"{Fore.LIGHTBLACK_EX}({state['files_per_s']:.0f} files/s, {state['bytes_per_s'] / 1e6:.1f} MB/s, ETA {eta})"
+        )
+        print(f"\r\033[K{line}", end="", flush=True)
+        self._is_shown = True
 
 
 # -- OUTPUT --
 
-display_error: Callable[[str], None] = lambda message: print(f"[{Fore.WHITE}{Back.RED} ERROR {Fore.RESET}{Back.RESET}] {Fore.RED}{message}")
-display_warning: Callable[[str], None] = lambda message: print(f"[{Fore.BLACK}{Back.YELLOW} WARNING {Fore.RESET}{Back.RESET}] {Fore.YELLOW}{message}")
-display_info: Callable[[str], None] = lambda message: print(f"[{Fore.BLACK}{Back.BLUE} INFO {Fore.RESET}{Back.RESET}] {message}")
-display_success: Callable[[str], None] = lambda message: print(f"[{Fore.BLACK}{Back.GREEN} SUCCESS {Fore.RESET}{Back.RESET}] {message}")
+display_error: Callable[[str], None] = lambda message: _display_message("error", message, f"[{Fore.WHITE}{Back.RED} ERROR {Fore.RESET}{Back.RESET}] {Fore.RED}{message}")
+display_warning: Callable[[str], None] = lambda message: _display_message("warning", message, f"[{Fore.BLACK}{Back.YELLOW} WARNING {Fore.RESET}{Back.RESET}] {Fore.YELLOW}{message}")
+display_info: Callable[[str], None] = lambda message: _display_message("info", message, f"[{Fore.BLACK}{Back.BLUE} INFO {Fore.RESET}{Back.RESET}] {message}")
+display_success: Callable[[str], None] = lambda message: _display_message("success", message, f"[{Fore.BLACK}{Back.GREEN} SUCCESS {Fore.RESET}{Back.RESET}] {message}")
 
 def display_key_value(title: str, dictionary: dict[str, str]) -> None:
+    if output_mode == OutputMode.JSON:
+        emit_json("key_value", title=title, values={key: str(value).strip() for key, value in dictionary.items()})
+        return
+    if output_mode == OutputMode.QUIET:
+        for key, value in dictionary.items():
+            print(f"{key}: {str(value).strip()}")
+        return
+
     print(f"\n{Fore.CYAN}{{ {Fore.RESET}{title} {Fore.CYAN}}} ")
     for key, value in dictionary.items():
         print(f"  • {Fore.CYAN}{key}{Fore.BLUE}:{Fore.RESET} {value}")
 
 def display_bullet_list(title: str, points: list[str]) -> None:
+    if output_mode == OutputMode.JSON:
+        emit_json("list", title=title, items=[point.strip() for point in points])
+        return
+    if output_mode == OutputMode.QUIET:
+        for point in points:
+            print(point.strip())
+        return
+
     print(f"\n{Fore.CYAN}< {Fore.RESET}{title} {Fore.CYAN}> ")
     for point in points:
         print(f"  {Fore.YELLOW}•{Fore.RESET} {point.strip()}")
@@ -90,10 +303,59 @@ def display_bullet_list(title: str, points: list[str]) -> None:
     if len(points) == 0:
         print(f"  {Fore.RED}• (blank)")
 
+def display_diff(lines: Iterable[str]) -> None:
+    """ Display unified diff of a single file, separated from previous output. """
+    if output_mode == OutputMode.JSON:
+        emit_json("diff", lines=list(lines))
+        return
+    if output_mode == OutputMode.QUIET:
+        for line in lines:
+            print(line)
+        return
+
+    print()
+    for line in lines:
+        if line.startswith(("+++", "---")):
+            print(f"{Fore.WHITE}{line}")
+        elif line.startswith("+"):
+            print(f"{Fore.GREEN}{line}")
+        elif line.startswith("-"):
+            print(f"{Fore.RED}{line}")
+        elif line.startswith("@@"):
+            print(f"{Fore.CYAN}{line}")
+        else:
+            print(line)
+
+def display_grep_match(path: str, saves: list[str], lines: list[tuple[int, str]]) -> None:
+    """ Display lines of a file matching pattern. saves contain it, oldest first. """
+    if output_mode == OutputMode.JSON:
+        emit_json("match", path=path, saves=saves, lines=[{"lineno": lineno, "line": line} for lineno, line in lines])
+        return
+    if output_mode == OutputMode.QUIET:
+        for lineno, line in lines:
+            print(f"{saves[0]}:{path}:{lineno}:{line}")
+        return
+
+    later = f" {Fore.LIGHTBLACK_EX}(+{len(saves) - 1} later saves)" if len(saves) > 1 else ""
+    print(f"\n{Fore.MAGENTA}{path} {Fore.CYAN}@ {saves[0]}{later}")
+    lineno_space = 2 + len(str(lines[-1][0]))
+    for lineno, line in lines:
+        print(f"{Fore.CYAN}{str(lineno).rjust(lineno_space)}{Fore.LIGHTBLACK_EX} | {Fore.RESET}{line}")
+
 def display_file_content(path: Path) -> None:
     with open(str(path)) as file:
-        lines = file.readlines()
-    
+        display_text(file.read(), str(path))
+
+def display_text(content: str, name: str) -> None:
+    """ Display numbered lines of text, name tells where it comes from. """
+    if output_mode == OutputMode.JSON:
+        emit_json("text", name=name, content=content)
+        return
+    if output_mode == OutputMode.QUIET:
+        print(content, end="")
+        return
+
+    lines = content.splitlines()
     lineno_space = 2 + len(str(len(lines)))
 
     for index, line_content in enumerate(lines):
@@ -0,0 +1,81 @@
+""" Streaming directory walker built on os.scandir. File types come from
+DirEntry (filled by the directory read itself), so walking costs about one
+syscall per directory plus one per stat that caller actually needs. Ignored
+directories are pruned before they are entered. """
+
+from typing import Callable, Iterator
+import os
+
+IgnoreCheck = Callable[[str, bool], bool]
+
+
+def _never_ignored(relative_path: str, is_dir: bool) -> bool:
+    return False
+
+
+def _classify(entry: os.DirEntry) -> bool | None:
+    """ Return True for directory, False for regular file (or symlink to it)
+    and None for anything else, including symlinks to directories. """
+    try:
+        if entry.is_dir(follow_symlinks=False):
+            return True
+        if entry.is_file():
+            return False
+    except OSError:
+        pass
+    return None
+
+
+def list_directory(root: str, relative_dir: str, is_ignored: IgnoreCheck = _never_ignored
+                   ) -> tuple[list[os.DirEntry], list[os.DirEntry]]:
+    """ Return not ignored (files, directories) of root/relative_dir sorted by name.
+    relative_dir is either empty or ends with /. """
+    files = []
+    directories = []
+    with os.scandir(f"{root}/{relative_dir}") as entries:
+        for entry in entries:
+            is_dir = _classify(entry)
+            if is_dir is None:
+                continue
+            if is_dir and ".notty" in entry.name:
+                continue
+            if is_ignored(relative_dir + entry.name, is_dir):
+                continue
+            (directories if is_dir else files).append(entry)
+
+    files.sort(key=lambda entry: entry.name)
+    directories.sort(key=lambda entry: entry.name)
+    return files, directories
+
+
+def walk(root: str, is_ignored: IgnoreCheck = _never_ignored) -> Iterator[tuple[str, os.DirEntry]]:
+    """ Yield (relative_path, DirEntry) of every not ignored file and directory
+    under root, depth first. Directories are yielded before their content and
+    their relative paths end with /. Only names of directories waiting to be
+    visited are held in memory, files are streamed as they are read. """
+    root = root.rstrip("/")
+    pending: list[str] = [""]
+
+    while pending:
+        relative_dir = pending.pop()
+        subdirectories = []
+        try:
+            with os.scandir(f"{root}/{relative_dir}") as entries:
+                for entry in entries:
+                    is_dir = _classify(entry)
+                    if is_dir is None or (is_dir and ".notty" in entry.name):
+                        continue
+
+                    relative_path = relative_dir + entry.name
+                    if is_ignored(relative_path, is_dir):
+                        continue
+
+                    if is_dir:
+                        yield relative_path + "/", entry
+                        subdirectories.append(relative_path + "/")
+                    else:
+                        yield relative_path, entry
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+        pending.extend(reversed(subdirectories))
@@ -0,0 +1,202 @@
+""" Linux inotify based watcher of the working tree. Every not ignored
+directory gets a watch, events are collected into a set of changed paths
+and bursts of writes are debounced, so the tree is never rescanned
+between snapshots. """
+
+from typing import Self, Any
+import ctypes.util
+import ctypes
+import struct
+import select
+import errno
+import time
+import os
+
+import core.walker as Walker
+import core.errors as Errors
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+DIRECTORY_CHANGES = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+READ_SIZE = 64 * 1024
+
+_EVENT = struct.Struct("iIII")
+
+
+def _load_libc() -> ctypes.CDLL:
+    """ Return libc with inotify functions or raise WatchError. """
+    libc_name = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError, TypeError):
+        raise Errors.WatchError("File system watching requires Linux inotify.")
+    return libc
+
+
+class Watcher:
+    """ Collect paths (relative to root, /-separated) changed in the working tree.
+    is_ignored(relative_path, is_dir) decides which paths are not watched.
+    >>> with Watcher(root, is_ignored) as watcher:
+    >>>     changed, is_complete = watcher.wait(delay, max_delay)
+    Changed directory means it was created, removed or moved, so all of it's
+    content has to be read again. is_complete is False if kernel's event queue
+    overflowed and some changes could have been lost.
+    """
+
+    def __init__(self, root: str, is_ignored: Walker.IgnoreCheck) -> None:
+        self.root = root.rstrip("/")
+        self.is_ignored = is_ignored
+        self.changed: set[str] = set()
+        self.is_complete = True
+        self._libc = _load_libc()
+        self._watches: dict[int, str] = {}
+        self._first_change_at = 0.0
+        self._last_change_at = 0.0
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise Errors.WatchError(f"Cannot start watching: {os.strerror(ctypes.get_errno())}")
+        self._watch_tree("")
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, ex_type: type, ex_value: Exception, ex_tb: Any) -> None:
+        self.close()
+
+    @property
+    def watched(self) -> int:
+        """ Number of watched directories. """
+        return len(self._watches)
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watch(self, relative_dir: str) -> None:
+        """ Watch single directory. relative_dir is either empty or ends with /. """
+        path = f"{self.root}/{relative_dir}".encode()
+        wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+        if wd >= 0:
+            self._watches[wd] = relative_dir
+            return
+
+        error = ctypes.get_errno()
+        if error == errno.ENOSPC:
+            raise Errors.WatchError("Too many directories to watch, raise fs.inotify.max_user_watches limit.")
+        if error not in (errno.ENOENT, errno.ENOTDIR):
+            raise Errors.WatchError(f"Cannot watch {relative_dir or './'}: {os.strerror(error)}")
+
+    def _watch_tree(self, relative_dir: str) -> None:
+        """ Watch directory and all not ignored directories inside it. """
+        self._add_watch(relative_dir)
+        is_ignored = lambda relative_path, is_dir: self.is_ignored(relative_dir + relative_path, is_dir)
+        for relative_path, _ in Walker.walk(f"{self.root}/{relative_dir}", is_ignored):
+            if relative_path.endswith("/"):
+                self._add_watch(relative_dir + relative_path)
+
+    def _unwatch_tree(self, relative_dir: str) -> None:
+        """ Forget watches of directory moved away from it's location. """
+        for wd, watched_dir in list(self._watches.items()):
+            if watched_dir.startswith(relative_dir):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _mark(self, relative_path: str) -> None:
+        now = time.monotonic()
+        if not self.changed and self.is_complete:
+            self._first_change_at = now
+        self._last_change_at = now
+        self.changed.add(relative_path)
+
+    def _read_events(self) -> None:
+        try:
+            buffer = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = buffer[offset:offset+name_length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                if not self.changed and self.is_complete:
+                    self._first_change_at = time.monotonic()
+                self.is_complete = False
+                self._last_change_at = time.monotonic()
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if not name:
+                continue
+
+            relative_path = directory + name
+            is_dir = bool(mask & IN_ISDIR)
+            if (is_dir and ".notty" in name) or self.is_ignored(relative_path, is_dir):
+                continue
+
+            if not is_dir:
+                self._mark(relative_path)
+                continue
+            if not mask & DIRECTORY_CHANGES:
+                continue
+
+            if mask & IN_MOVED_FROM:
+                self._unwatch_tree(relative_path + "/")
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(relative_path + "/")
+            self._mark(relative_path)
+
+    def wait(self, delay: float, max_delay: float) -> tuple[set[str], bool]:
+        """ Block until something changes and then until there are no events for
+        delay seconds, but no longer than max_delay seconds since the first change.
+        Return changed paths and whether they are complete. """
+        while True:
+            timeout = None
+            if self.changed or not self.is_complete:
+                deadline = min(self._last_change_at + delay, self._first_change_at + max_delay)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return self.take()
+
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if ready:
+                self._read_events()
+
+    def take(self) -> tuple[set[str], bool]:
+        """ Return changes collected so far and start collecting new ones. """
+        self._read_events()
+        changed, is_complete = self.changed, self.is_complete
+        self.changed = set()
+        self.is_complete = True
+        return changed, is_complete
@@ -1,15 +1,35 @@
 """ A main entry point for notty. """
+import sys
+import re
 import os
 import click
 
-from core.repository import Repository
-from core import todo as Todo
+from core.errors import SaveError, WatchError, RepositoryError
+from core.lazy import lazy_import
 from core.path import Path
-from core import visuals
-from core import moment
-from core import files
 
-repository = Repository(os.getcwd())
+
+core_repository = lazy_import("core.repository")
+pipeline = lazy_import("core.pipeline")
+Todo = lazy_import("core.todo")
+visuals = lazy_import("core.visuals")
+moment = lazy_import("core.moment")
+transfer = lazy_import("core.transfer")
+diff = lazy_import("core.diff")
+watcher_module = lazy_import("core.watcher")
+trace = lazy_import("core.trace")
+archive = lazy_import("core.archive")
+
+_repository = None
+
+
+def get_repository():
+    """ Return repository of current directory. It is discovered on first
+    use, so commands which do not need it never touch the disk. """
+    global _repository
+    if _repository is None:
+        _repository = core_repository.Repository(os.getcwd())
+    return _repository
 
 
 def repo_status_validator(status: bool):
@@ -18,7 +38,7 @@ def repo_status_validator(status: bool):
     display error message and prevent code from entering decorated function."""
     def decorator(func):
         def wrapper(*args, **kwargs):
-            if repository.is_initialized != status:
+            if get_repository().is_initialized != status:
                 message = "No repository is initialized here." if status else "Already exists."
                 visuals.display_error(message)
                 return False
@@ -33,27 +53,32 @@ def repo_status_validator(status: bool):
 @repo_status_validator(False)
 def init():
     """ Initialize repository in current directory. """
+    repository = get_repository()
     repository.create(Path(os.getcwd()))
 
 @click.command("save")
 @click.option("-c", "--comment", default="Not provided.", type=str, show_default=False,
               help="Comment changes made in this save.")
 @click.option("-m", "--multiline", is_flag=True, help="Create multiline comment.")
+@click.option("-j", "--jobs", default=lambda: pipeline.DEFAULT_JOBS, type=click.IntRange(min=1), show_default="CPU count, 32 at most",
+              help="Number of worker threads used by each save stage.")
 @repo_status_validator(True)
-def save_current_state(comment: str, multiline: bool):
+def save_current_state(comment: str, multiline: bool, jobs: int):
     """ Save current work state. """
+    repository = get_repository()
     if comment.lower() not in ("Not provided.", "-m", "--multiline") and multiline:
         raise click.UsageError("Only one comment option can be used. Choose -c or -m.")
 
     if multiline:
         comment = visuals.get_multiline_input("Save's comment")
 
-    repository.create_save(comment)
+    repository.create_save(comment, jobs)
 
 @click.command("list")
 @repo_status_validator(True)
 def list_saves():
     """ Display list of all saves located in ./.notty/saves/ directory. """
+    repository = get_repository()
     bullets = [str(save_obj.hash) for save_obj in repository.get_all_saves()]
     visuals.display_bullet_list(f"Local saves: {len(bullets)}", bullets)
 
@@ -61,7 +86,8 @@ def list_saves():
 @click.argument("save_hash", type=str)
 @repo_status_validator(True)
 def describe_save(save_hash):
-    """ Display all known data about an save according to notty.save file. """
+    """ Display all known data about an save according to saves catalog. """
+    repository = get_repository()
     save_obj = repository.find_save(save_hash)
     if save_obj is None:
         return
@@ -74,6 +100,8 @@ def describe_save(save_hash):
     data = {
         "Comment": "\n"+save_obj.comment.strip(),
         "Date created": date_created,
+        "Size": f"{save_obj.size} bytes",
+        "Parent": save_obj.parent or "None",
         "Short HASH": save_obj.hash.short,
         "Full HASH": save_obj.hash.full,
     }
@@ -85,8 +113,9 @@ def describe_save(save_hash):
 @click.option("-s", "--save", is_flag=True, help="Save current state before rolling back.")
 @repo_status_validator(True)
 def rollback_save(save_hash: str, save: bool):
-    """ Revert changes, save current state if save param is set to True and remove
-    all files located in working directory, copy back saved version. """
+    """ Revert changes, save current state if save param is set to True and
+    rewrite only files which differ from saved version. """
+    repository = get_repository()
 
     save_obj = repository.find_save(save_hash)
     if save_obj is None:
@@ -97,18 +126,31 @@ def rollback_save(save_hash: str, save: bool):
             repository.create_save("auto-generated: rollback")
             callback.success("saved current state")
 
-        callback.info("removing current state")
-        files.remove_current(Path(os.getcwd()))
-        callback.success("removed current state")
-
         callback.info(f"rolling back save: ({save_obj.hash.short})")
-        repository.rollback_save(save_obj)
+        methods = repository.rollback_save(save_obj)
+        callback.success("restored changed files")
+        callback.info(f"transfer methods: {transfer.summarize(methods)}")
+        callback.info("replaced files moved to trash, use `notty undo` to revert")
+
+@click.command("undo")
+@repo_status_validator(True)
+def undo():
+    """ Revert the last rollback, bringing back files it replaced. """
+    repository = get_repository()
+    try:
+        redo = repository.undo()
+    except RepositoryError as error:
+        visuals.display_error(str(error))
+        return
+
+    visuals.display_success(f"Reverted: {len(redo.created)} paths brought back, {len(redo.moved)} moved to trash.")
 
 @click.command("forget")
 @click.argument("save_hash", type=str)
 @repo_status_validator(True)
 def forget(save_hash):
     """ Remove save from saves directory. """
+    repository = get_repository()
 
     if save_hash.lower() == "all":
         visuals.display_warning("all saves will be removed!")
@@ -134,10 +176,207 @@ def forget(save_hash):
     repository.remove_save(save_obj)
     visuals.display_success(f"Forgot save: {str(save_obj.hash)}")
 
+@click.command("gc")
+@click.option("-b", "--budget", default=None, type=click.FloatRange(min=0),
+              help="Stop after this many seconds (reading saves is not counted), next run continues where this one stopped.")
+@repo_status_validator(True)
+def collect_garbage(budget: float | None):
+    """ Remove data no save refers to and repack stored objects. """
+    repository = get_repository()
+    with visuals.ProcessCallback("Collect garbage.", "Collected garbage.") as callback:
+        report = repository.collect_garbage(budget)
+        callback.info(f"reachable objects: {report.reachable}")
+        callback.success(f"removed objects: {report.removed_objects}")
+        callback.success(f"packed loose objects: {report.packed_objects}")
+        callback.success(f"rewritten packs: {report.rewritten_packs}")
+        callback.info(f"freed: {report.freed_bytes} bytes")
+        if not report.is_finished:
+            callback.warn("time budget used, run gc again to continue")
+
+@click.command("diff")
+@click.argument("old_hash", type=str)
+@click.argument("new_hash", type=str, required=False)
+@click.option("-n", "--name-only", is_flag=True, help="Show only list of changed files.")
+@repo_status_validator(True)
+def diff_saves(old_hash: str, new_hash: str | None, name_only: bool):
+    """ Show changes between two saves or between a save and working tree. """
+    repository = get_repository()
+    old_save = repository.find_save(old_hash)
+    if old_save is None:
+        return
+
+    new_save = None
+    if new_hash is not None:
+        new_save = repository.find_save(new_hash)
+        if new_save is None:
+            return
+
+    try:
+        changes, read_old, read_new = repository.diff(old_save, new_save)
+    except SaveError as error:
+        visuals.display_error(str(error))
+        return
+
+    target = new_save.hash.short if new_save is not None else "working tree"
+    visuals.display_bullet_list(f"Changes {old_save.hash.short} -> {target}: {len(changes)}",
+                                [change.describe() for change in changes])
+    if name_only:
+        return
+
+    for change in changes:
+        visuals.display_diff(diff.unified_diff(change, read_old, read_new))
+
+@click.command("grep")
+@click.argument("pattern", type=str)
+@click.option("-s", "--saves", "saves_range", default="..", show_default=True,
+              help="Saves to search: a hash or range OLD..NEW (either side can be omitted).")
+@repo_status_validator(True)
+def grep(pattern: str, saves_range: str):
+    """ Search content of saves for lines matching regular expression. """
+    repository = get_repository()
+    try:
+        re.compile(pattern)
+    except re.error as error:
+        visuals.display_error(f"Invalid pattern: {error}")
+        return
+
+    saves = repository.find_saves(saves_range)
+    if saves is None:
+        return
+
+    matches = repository.grep(pattern, saves)
+    for match in matches:
+        visuals.display_grep_match(match.path, match.saves, match.lines)
+    if not matches:
+        visuals.display_info(f"No matches in {len(saves)} saves.")
+
+@click.command("export")
+@click.argument("save_hash", type=str)
+@click.option("-o", "--output", default="-", show_default=True, type=str,
+              help="Archive file to write, - writes to standard output.")
+@click.option("-f", "--format", "compression", default=None, type=click.Choice(["tar", "gz", "xz"]),
+              show_default="from output's suffix, tar", help="Compression of the archive.")
+@repo_status_validator(True)
+def export_save(save_hash: str, output: str, compression: str | None):
+    """ Stream save's files as tar archive. """
+    if output == "-":
+        if sys.stdout.isatty():
+            visuals.display_error("Archive is not written to terminal, use --output or pipe it.")
+            return
+        # Standard output carries the archive, messages go to stderr only.
+        visuals.set_output_mode(visuals.OutputMode.QUIET)
+
+    repository = get_repository()
+    save = repository.find_save(save_hash)
+    if save is None:
+        return
+
+    compression = compression or archive.compression_for(output)
+    try:
+        if output == "-":
+            repository.export_save(save, sys.stdout.buffer, compression)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(output, "wb") as file:
+            repository.export_save(save, file, compression)
+    except (SaveError, OSError) as error:
+        if output != "-" and os.path.exists(output):
+            os.remove(output)
+        visuals.display_error(f"Cannot export save: {error}")
+        return
+
+    visuals.display_success(f"Exported {save.hash.short} to: {output}")
+
+@click.command("import")
+@click.argument("archive_path", default="-", type=str)
+@click.option("-c", "--comment", default="Imported from archive.", type=str, help="Comment of created save.")
+@repo_status_validator(True)
+def import_archive(archive_path: str, comment: str):
+    """ Create new save from tar archive (file or - for standard input). """
+    repository = get_repository()
+    try:
+        if archive_path == "-":
+            tree, skipped = repository.import_save(comment, sys.stdin.buffer)
+        else:
+            with open(archive_path, "rb") as file:
+                tree, skipped = repository.import_save(comment, file)
+    except OSError as error:
+        visuals.display_error(f"Cannot read archive: {error}")
+        return
+
+    if tree is not None and skipped:
+        visuals.display_bullet_list(f"Skipped members (not regular files or directories): {len(skipped)}", skipped)
+
+@click.command("status")
+@repo_status_validator(True)
+def status():
+    """ Show files added, modified and deleted since the last save. """
+    repository = get_repository()
+    try:
+        head, changes = repository.status()
+    except SaveError as error:
+        visuals.display_error(str(error))
+        return
+
+    since = f"({head.hash.short})" if head is not None else "nothing saved yet"
+    if not changes:
+        visuals.display_success(f"Working tree is clean {since}.")
+        return
+
+    visuals.display_bullet_list(f"Changes since {since}: {len(changes)}",
+                                [change.describe() for change in changes])
+
+@click.command("watch")
+@click.option("-d", "--delay", default=2.0, type=click.FloatRange(min=0), show_default=True,
+              help="Seconds without any change after which a snapshot is taken.")
+@click.option("--max-delay", default=60.0, type=click.FloatRange(min=0), show_default=True,
+              help="Snapshot is taken at most this many seconds after the first change.")
+@click.option("-j", "--jobs", default=lambda: pipeline.DEFAULT_JOBS, type=click.IntRange(min=1), show_default="CPU count, 32 at most",
+              help="Number of worker threads used by each save stage.")
+@repo_status_validator(True)
+def watch(delay: float, max_delay: float, jobs: int):
+    """ Watch project's files and save them automatically once they stop changing. """
+    repository = get_repository()
+    try:
+        watcher = watcher_module.Watcher(str(repository.path), repository.get_ignore_matcher().is_ignored)
+    except WatchError as error:
+        visuals.display_error(str(error))
+        return
+
+    with watcher:
+        try:
+            head, changes = repository.status()
+            tree = repository.load_tree(head) if head is not None and not changes else None
+        except SaveError:
+            tree = None
+        if tree is None:
+            tree = repository.create_save("auto-generated: watch started", jobs)
+
+        visuals.display_info(f"Watching {watcher.watched} directories, press Ctrl+C to stop.")
+        try:
+            while True:
+                changed, is_complete = watcher.wait(delay, max_delay)
+                tree = _save_changes(tree, changed, is_complete, jobs)
+        except KeyboardInterrupt:
+            changed, is_complete = watcher.take()
+            if changed or not is_complete:
+                _save_changes(tree, changed, is_complete, jobs)
+
+def _save_changes(tree, changed: set[str], is_complete: bool, jobs: int):
+    """ Take snapshot of changed paths, or of the whole tree when some changes
+    were lost or previous snapshot failed. """
+    repository = get_repository()
+    comment = f"auto-generated: watch ({len(changed)} changed paths)"
+    if tree is None or not is_complete:
+        return repository.create_save(comment, jobs)
+    return repository.create_incremental_save(comment, tree, changed, jobs)
+
 @click.command("ignore")
 @repo_status_validator(True)
 def ignore():
     """ Open an built in editor with ignore file content. """
+    repository = get_repository()
     with open(str(repository.repo_path / "notty.ignore"), "r") as file:
         content = file.read()
 
@@ -157,51 +396,78 @@ def ignore():
 @repo_status_validator(True)
 def clear_notes():
     """ Clear notes file. """
+    repository = get_repository()
     if not visuals.get_boolean_response("Are you sure"):
         return
-    open(str(repository.repo_path / "notes.txt"), "w+").close()
+    repository.store.set_notes("")
 
 @click.command("edit")
 @repo_status_validator(True)
 def edit_notes():
     """ Open an built in editor with notes file in it. """
-    with open(str(repository.repo_path / "notes.txt"), "r") as file:
-        content = file.read()
-
-    with open(str(repository.repo_path / "notes.txt"), "w+") as file:
-        new_content = click.edit(content)
-        if new_content is None:
-            file.write(content)
-            visuals.display_warning("No changes has been saved.")
-        else:
-            file.write(new_content)
-            visuals.display_success("Notes saved.")
+    repository = get_repository()
+    new_content = click.edit(repository.store.get_notes())
+    if new_content is None:
+        visuals.display_warning("No changes has been saved.")
+    else:
+        repository.store.set_notes(new_content)
+        visuals.display_success("Notes saved.")
 
 @click.command("show")
 @repo_status_validator(True)
 def show_notes():
     """ Print note's file content. """
-    visuals.display_file_content(str(repository.repo_path / "notes.txt"))
+    repository = get_repository()
+    visuals.display_text(repository.store.get_notes(), "notes")
 
 
 # -- TODO -- #
 
+def _parse_todo_values(parse):
+    """ Return click callback turning aliases into todo enum values. """
+    def callback(context, parameter, values):
+        parsed = []
+        for value in values:
+            result = parse(value)
+            if result is None:
+                raise click.BadParameter(f"unknown value: {value}")
+            parsed.append(result)
+        return parsed
+    return callback
+
 @click.command("show")
+@click.option("-s", "--state", "states", multiple=True, callback=_parse_todo_values(lambda value: Todo.parse_state(value)),
+              help="Show only tasks in this state (repeatable): [P]ending/[I]n_progress/[F]inished.")
+@click.option("-i", "--importance", "importances", multiple=True, callback=_parse_todo_values(lambda value: Todo.parse_importance(value)),
+              help="Show only tasks of this importance (repeatable): [L]ow/[M]edium/[H]igh.")
+@click.option("-g", "--grep", "pattern", default=None, type=str, help="Show only tasks which content matches regular expression.")
+@click.option("--sort", default="id", show_default=True, type=click.Choice(["id", "state", "importance", "content"]),
+              help="Order of tasks. Importance puts the most important first.")
+@click.option("-n", "--limit", default=None, type=click.IntRange(min=0), help="Show at most this many tasks.")
+@click.option("--offset", default=0, type=click.IntRange(min=0), help="Skip this many matching tasks.")
 @repo_status_validator(True)
-def show_todo():
-    """ Display all to do entries. """
-    
-    todo_list = Todo.TodoList(str(repository.repo_path / "todo.json"))
-    todo_list.display_tasks()
+def show_todo(states, importances, pattern, sort, limit, offset):
+    """ Display to do entries. """
+    repository = get_repository()
+    if pattern is not None:
+        try:
+            re.compile(pattern)
+        except re.error as error:
+            visuals.display_error(f"Invalid pattern: {error}")
+            return
+
+    todo_list = Todo.TodoList(repository.store)
+    todo_list.display_tasks(Todo.TaskQuery(states, importances, pattern, sort, limit, offset))
 
 @click.command("rm")
-@click.argument("index", type=int)
+@click.argument("task_id", type=int)
 @repo_status_validator(True)
-def remove_task(index):
-    """ Remove task from todo.json file. """
+def remove_task(task_id):
+    """ Remove task from todo list. """
+    repository = get_repository()
     
-    todo_list = Todo.TodoList(str(repository.repo_path / "todo.json"))
-    todo_list.remove_task(index)
+    todo_list = Todo.TodoList(repository.store)
+    todo_list.remove_task(task_id)
 
 @click.command("add")
 @click.argument("content", type=str)
@@ -209,47 +475,37 @@ def remove_task(index):
 @repo_status_validator(True)
 def add_task(content, importance):
     """ Add new task and save it. """
+    repository = get_repository()
     
-    todo_list = Todo.TodoList(str(repository.repo_path / "todo.json"))
-    importance = importance.lower()
-
-    if importance in ("l", "low", "1"):
-        importance = Todo.Importance.LOW
-    elif importance in ("m", "mid", "medium", "2"):
-        importance = Todo.Importance.MEDIUM
-    elif importance in ("h", "high", "!", "3"):
-        importance = Todo.Importance.HIGH
-    else:
+    todo_list = Todo.TodoList(repository.store)
+    parsed_importance = Todo.parse_importance(importance)
+    if parsed_importance is None:
         visuals.display_warning(f"Invalid importance level: {importance}. [L]ow/[M]edium/[H]igh")
-        importance = Todo.Importance.LOW
+        parsed_importance = Todo.Importance.LOW
 
-    task = Todo.Task(content, Todo.State.PENDING, importance)
+    task = Todo.Task(content, Todo.State.PENDING, parsed_importance)
     todo_list.append_task(task)
+    visuals.display_success(f"Added task: {task.id}")
 
 @click.command("imp")
-@click.argument("index", type=int)
+@click.argument("task_id", type=int)
 @click.argument("level", type=str)
-def update_importance(index, level):
+def update_importance(task_id, level):
     """ Change level of importance of a task. """
+    repository = get_repository()
     
-    todo_list = Todo.TodoList(str(repository.repo_path / "todo.json"))
-    try:
-        task: Todo.Task = todo_list.tasks[index]
-        current_int = task.importance.value
-    except IndexError:
-        visuals.display_error(f"Invalid task index: {index}")
+    todo_list = Todo.TodoList(repository.store)
+    task = todo_list.get_task(task_id)
+    if task is None:
+        visuals.display_error(f"Invalid task id: {task_id}")
+        return
+    current_int = task.importance.value
 
     level = level.lower()
-    level_table = {
-        ("l", "low", "1"): Todo.Importance.LOW,
-        ("m", "mid", "medium", "2"): Todo.Importance.MEDIUM,
-        ("h", "high", "!", "3"): Todo.Importance.HIGH,
-    }
-
     if level == "+":
         try:
             task.importance = Todo.Importance(current_int+1)
-            todo_list.save()
+            todo_list.update_task(task)
         except ValueError:
             visuals.display_error("Task's importance cannot go above HIGH level.")
         return
@@ -257,44 +513,39 @@ def update_importance(index, level):
     elif level == "-":
         try:
             task.importance = Todo.Importance(current_int-1)
-            todo_list.save()
+            todo_list.update_task(task)
         except ValueError:
             visuals.display_error("Task's importance cannot go below LOW level.")
         return
         
-    for patterns, value in level_table.items():
-        if level in patterns:
-            task.importance = value
-            todo_list.save()
-            return
+    value = Todo.parse_importance(level)
+    if value is not None:
+        task.importance = value
+        todo_list.update_task(task)
+        return
 
     visuals.display_error(f"Invalid importance level: {level}. [L]ow/[M]edium/[H]igh or +/-")
     return
     
 @click.command("state")
-@click.argument("index", type=int)
+@click.argument("task_id", type=int)
 @click.argument("level", type=str)
-def update_state(index, level):
+def update_state(task_id, level):
     """ Update task's state. """
+    repository = get_repository()
     
-    todo_list = Todo.TodoList(str(repository.repo_path / "todo.json"))
-    try:
-        task: Todo.Task = todo_list.tasks[index]
-        current_int = task.state.value
-    except IndexError:
-        visuals.display_error(f"Invalid task index: {index}")
+    todo_list = Todo.TodoList(repository.store)
+    task = todo_list.get_task(task_id)
+    if task is None:
+        visuals.display_error(f"Invalid task id: {task_id}")
+        return
+    current_int = task.state.value
 
     level = level.lower()
-    level_table = {
-        ("pending", "p", "1"): Todo.State.PENDING,
-        ("in_progress", "i", "2"): Todo.State.IN_PROGRESS,
-        ("done", "finished", "d", "f", "3"): Todo.State.FINISHED,
-    }
-
     if level == "+":
         try:
             task.state = Todo.State(current_int+1)
-            todo_list.save()
+            todo_list.update_task(task)
         except ValueError:
             visuals.display_error("Task's state cannot go above FINISHED level.")
         return
@@ -302,16 +553,16 @@ def update_state(index, level):
     elif level == "-":
         try:
             task.state = Todo.State(current_int-1)
-            todo_list.save()
+            todo_list.update_task(task)
         except ValueError:
             visuals.display_error("Task's state cannot go below PENDING level.")
         return
         
-    for patterns, value in level_table.items():
-        if level in patterns:
-            task.state = value
-            todo_list.save()
-            return
+    value = Todo.parse_state(level)
+    if value is not None:
+        task.state = value
+        todo_list.update_task(task)
+        return
 
     visuals.display_error(f"Invalid state: {level} [P]ending,1/[I]n_progress,2/[F]inished,3 or +/-")
     return
@@ -337,15 +588,38 @@ todo.add_command(update_importance)
 todo.add_command(update_state)
 
 @click.group()
-def notty():
+@click.option("--profile", default=None, type=click.Path(dir_okay=False, writable=True),
+              help="Measure every step and write Chrome trace (chrome://tracing, ui.perfetto.dev) to this file.")
+@click.option("-q", "--quiet", is_flag=True, help="Print only requested data, as plain text. Errors go to stderr.")
+@click.option("--json", "as_json", is_flag=True, help="Print every message as a single line JSON object.")
+@click.pass_context
+def notty(context: click.Context, profile: str | None, quiet: bool, as_json: bool):
     """ Main command functions group. """
+    if quiet and as_json:
+        raise click.UsageError("--quiet and --json cannot be used together.")
+    if quiet:
+        visuals.set_output_mode(visuals.OutputMode.QUIET)
+    elif as_json:
+        visuals.set_output_mode(visuals.OutputMode.JSON)
+
+    if profile is not None:
+        trace.enable()
+        context.call_on_close(lambda: trace.export(profile))
 notty.add_command(init)
 notty.add_command(save_current_state)
 notty.add_command(list_saves)
 notty.add_command(describe_save)
 notty.add_command(rollback_save)
+notty.add_command(undo)
 notty.add_command(forget)
 notty.add_command(ignore)
+notty.add_command(diff_saves)
+notty.add_command(grep)
+notty.add_command(export_save)
+notty.add_command(import_archive)
+notty.add_command(status)
+notty.add_command(watch)
+notty.add_command(collect_garbage)
 
 notty.add_command(notes)
 notty.add_command(todo)
@@ -10,8 +10,10 @@ setup(
     install_requires=[
         'click',
         'colorama',
-        'tabulate',
     ],
+    extras_require={
+        'chunking': ['numpy'],
+    },
     entry_points = {
         'console_scripts': [
             "notty = main:main"
@@ -0,0 +1,45 @@
+""" Shared fixtures of notty's tests. """
+import hashlib
+import sys
+import os
+
+import pytest
+
+PACKAGE_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_ROOT)
+
+from core.repository import Repository  # noqa: E402
+
+
+def write(path, data: bytes) -> None:
+    """ Write file of the project, creating it's parent directories. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def read(path) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def blob(repository: Repository, full_hash: str) -> bytes:
+    return b"".join(repository.objects.iter_blocks(full_hash))
+
+
+def check_tree(repository: Repository, save) -> None:
+    """ Every blob of save's tree is readable and matches it's hash. """
+    for entry in repository.load_tree(save).entries.values():
+        assert hashlib.sha256(blob(repository, entry.hash)).hexdigest() == entry.hash
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / "project"
+    root.mkdir()
+    return root
+
+
+@pytest.fixture
+def repository(project):
+    return Repository.create(str(project))
@@ -0,0 +1,67 @@
+""" Catalog of saves shared by processes. """
+from core.catalog import SaveCatalog, CatalogEntry, COMPACTION_RATIO
+
+
+def _entry(full_hash: str) -> CatalogEntry:
+    return CatalogEntry(full_hash, 0, "comment", 0, None)
+
+
+def test_reading_never_rewrites(tmp_path):
+    path = str(tmp_path / "notty.catalog")
+    writer = SaveCatalog(path)
+    for index in range(10):
+        writer.add(_entry(f"{index:064x}"), is_head=False)
+        writer.remove(f"{index:064x}")
+    with open(path, "rb") as file:
+        content = file.read()
+
+    SaveCatalog(path)
+    with open(path, "rb") as file:
+        assert file.read() == content
+
+
+def test_compaction_keeps_records_of_other_writer(tmp_path):
+    path = str(tmp_path / "notty.catalog")
+    first = SaveCatalog(path)
+    second = SaveCatalog(path)
+    second.add(_entry("b" * 64))
+
+    # Churn of first writer compacts catalog after second one appended.
+    for index in range(COMPACTION_RATIO * 4):
+        first.add(_entry(f"{index:064x}"), is_head=False)
+        first.remove(f"{index:064x}")
+
+    assert set(SaveCatalog(path).entries) == {"b" * 64}
+    assert SaveCatalog(path).head == "b" * 64
+    assert set(first.entries) == {"b" * 64}
+
+
+def test_record_after_cut_line_is_kept(tmp_path):
+    path = str(tmp_path / "notty.catalog")
+    SaveCatalog(path).add(_entry("a" * 64))
+    with open(path, "ab") as file:
+        file.write(b'{"op": "add", "hash": "cut')
+
+    SaveCatalog(path).add(_entry("b" * 64), is_head=False)
+    assert set(SaveCatalog(path).entries) == {"a" * 64, "b" * 64}
+
+
+
+def test_find_by_prefix(tmp_path):
+    catalog = SaveCatalog(str(tmp_path / "notty.catalog"))
+    for full_hash in ("ab" + "0" * 62, "ab" + "1" * 62, "cd" + "0" * 62):
+        catalog.add(_entry(full_hash))
+
+    assert len(catalog.find("ab")) == 2
+    assert [entry.hash for entry in catalog.find("AB1")] == ["ab" + "1" * 62]
+    assert catalog.find("ef") == []
+
+
+def test_ambiguous_prefix_finds_no_save(repository):
+    for full_hash in ("ab" + "0" * 62, "ab" + "1" * 62):
+        repository.catalog.add(_entry(full_hash), is_head=False)
+
+    assert repository.find_save("ab") is None
+    assert repository.find_save("ab1").hash.full == "ab" + "1" * 62
+    assert repository.find_saves("ab0..ab1") is not None
+    assert repository.find_saves("ab..ab1") is None
@@ -0,0 +1,43 @@
+""" Content defined chunking keeps boundaries where content did not change. """
+import hashlib
+import random
+import io
+
+import pytest
+
+import core.chunking as Chunking
+
+pytestmark = pytest.mark.skipif(not Chunking.is_available(), reason="chunking needs numpy")
+
+
+def _chunks(data: bytes) -> list[bytes]:
+    return list(Chunking.iter_chunks(io.BytesIO(data)))
+
+
+def _digests(chunks: list[bytes]) -> list[str]:
+    return [hashlib.sha256(chunk).hexdigest() for chunk in chunks]
+
+
+@pytest.fixture(scope="module")
+def data() -> bytes:
+    return random.Random(0).randbytes(12 * 1024 * 1024)
+
+
+def test_chunks_cover_file_within_size_limits(data):
+    chunks = _chunks(data)
+    assert b"".join(chunks) == data
+    assert len(chunks) > 1
+    assert all(Chunking.MIN_SIZE < len(chunk) <= Chunking.MAX_SIZE for chunk in chunks[:-1])
+    assert _chunks(data) == chunks
+
+
+def test_edit_changes_only_nearby_chunks(data):
+    chunks = _digests(_chunks(data))
+    middle = len(data) // 2
+    edited = _digests(_chunks(data[:middle] + b"inserted bytes" + data[middle + 100:]))
+
+    # Chunks before the edit stay, boundaries after it are found again.
+    unchanged = set(chunks) & set(edited)
+    assert len(unchanged) >= len(chunks) - 2
+    assert edited[0] == chunks[0]
+    assert edited[-1] == chunks[-1]
@@ -0,0 +1,127 @@
+""" Garbage collection must never remove an object which is still reachable. """
+import os
+
+import pytest
+
+from core.repository import Repository
+from conftest import write, blob, check_tree
+from core.chunking import CHUNKING_THRESHOLD
+import core.chunking as Chunking
+import core.gc as Gc
+
+
+def test_keeps_packed_objects(project, repository):
+    for index in range(50):
+        write(project / "src" / f"file{index}.txt", f"first {index}\n".encode())
+    repository.create_save("first")
+    write(project / "src" / "file0.txt", b"second\n")
+    repository.create_save("second")
+
+    first, second = repository.get_all_saves()
+    removed_hash = repository.load_tree(first).entries["src/file0.txt"].hash
+    repository.remove_save(first)
+    report = repository.collect_garbage(grace_period=0)
+
+    assert report.is_finished
+    assert not repository.objects.has(removed_hash)
+    check_tree(repository, second)
+
+
+def test_keeps_chunks_of_chunked_files(project, repository):
+    if not Chunking.is_available():
+        pytest.skip("chunking needs numpy")
+
+    data = bytearray(os.urandom(CHUNKING_THRESHOLD + 3 * Chunking.MAX_SIZE))
+    write(project / "big.bin", bytes(data))
+    repository.create_save("first")
+    data[len(data) // 2:len(data) // 2 + 4] = b"edit"
+    write(project / "big.bin", bytes(data))
+    repository.create_save("second")
+
+    first, second = repository.get_all_saves()
+    kept_hash = repository.load_tree(second).entries["big.bin"].hash
+    chunks = repository.objects.chunk_hashes(kept_hash)
+    assert len(chunks) > 1
+
+    repository.remove_save(first)
+    report = repository.collect_garbage(grace_period=0)
+
+    assert report.removed_objects > 0
+    assert all(repository.objects.has(chunk) for chunk in chunks)
+    assert blob(repository, kept_hash) == bytes(data)
+
+
+def test_keeps_objects_inside_grace_period(project, repository):
+    write(project / "a.txt", b"first\n")
+    repository.create_save("first")
+    write(project / "a.txt", b"second\n")
+    repository.create_save("second")
+
+    first, second = repository.get_all_saves()
+    young_hash = repository.load_tree(first).entries["a.txt"].hash
+    repository.remove_save(first)
+    # Loose object stored just now, maybe by a save which is not finished yet.
+    loose_hash = repository.objects.store_bytes(b"not referenced yet\n" * 1000).full
+
+    repository.collect_garbage()
+
+    assert repository.objects.has(young_hash)
+    assert repository.objects.has(loose_hash)
+    check_tree(repository, second)
+
+
+def test_mark_includes_chunks():
+    class Objects:
+        def chunk_hashes(self, full_hash):
+            return [full_hash + "-chunk"]
+
+    class Entry:
+        def __init__(self, full_hash, size):
+            self.hash, self.size = full_hash, size
+
+    class Tree:
+        entries = {"small": Entry("small", 1), "big": Entry("big", CHUNKING_THRESHOLD)}
+
+    assert Gc.mark(Objects(), [Tree()]) == {"small", "big", "big-chunk"}
+
+
+def test_reads_objects_of_packs_merged_by_another_process(project, repository):
+    write(project / "a.txt", b"first\n")
+    repository.create_save("first")
+    full_hash = repository.load_tree(repository.get_all_saves()[0]).entries["a.txt"].hash
+    assert repository.objects.has(full_hash)
+    loaded = [pack.index_path for pack in repository.objects.packs]
+
+    # Another process merges packs while this one has them loaded.
+    other = Repository(str(project))
+    for index in range(3):
+        write(project / f"b{index}.txt", f"{index}\n".encode())
+        other.create_save(f"other {index}")
+    assert not any(os.path.exists(path) for path in loaded)
+    assert blob(repository, full_hash) == b"first\n"
+
+
+def test_skips_packs_removed_during_collection(project, repository, monkeypatch):
+    for index in range(3):
+        write(project / "a.txt", f"{index}\n".encode())
+        repository.create_save(f"save {index}")
+    saves = repository.get_all_saves()
+    repository.remove_save(saves[0])
+
+    # Another save merges selected packs away before gc removes them.
+    select_packs = Gc.GarbageCollector._select_packs
+
+    def select_and_merge(self):
+        packs = select_packs(self)
+        for pack in packs:
+            for path in (pack.index_path, pack.pack_path):
+                os.chmod(path, 0o644)
+                os.remove(path)
+        return packs
+
+    monkeypatch.setattr(Gc.GarbageCollector, "_select_packs", select_and_merge)
+    report = repository.collect_garbage(grace_period=0)
+
+    assert report.is_finished
+    assert report.rewritten_packs > 0
+    check_tree(repository, saves[-1])
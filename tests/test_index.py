@@ -0,0 +1,60 @@
+""" Working tree index must never hide a change of the working tree. """
+import os
+
+from core.index import WorkingIndex
+from conftest import write
+
+HASH = "ab" * 32
+
+
+def _scan(index: WorkingIndex, root) -> dict:
+    return {path: full_hash for path, _, _, full_hash in index.scan(str(root), "", lambda path, is_dir: False)}
+
+
+def test_directory_changed_within_mtime_tick_is_listed_again(tmp_path):
+    root = tmp_path / "project"
+    write(root / "src" / "a.txt", b"a")
+    index = WorkingIndex(str(tmp_path / "index"))
+    assert set(_scan(index, root)) == {"src/a.txt"}
+
+    # Coarse timestamps: new file does not change mtime of it's directory.
+    directory_stat = os.stat(root / "src")
+    write(root / "src" / "b.txt", b"b")
+    os.utime(root / "src", ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+
+    assert set(_scan(index, root)) == {"src/a.txt", "src/b.txt"}
+
+
+def test_changed_file_is_read_again(tmp_path):
+    root = tmp_path / "project"
+    write(root / "a.txt", b"a")
+    index = WorkingIndex(str(tmp_path / "index"))
+    for path, _, file_stat, _ in index.scan(str(root), "", lambda path, is_dir: False):
+        index.update(path, file_stat, HASH, trusted=True)
+
+    assert _scan(index, root) == {"a.txt": HASH}
+    write(root / "a.txt", b"changed")
+    assert _scan(index, root) == {"a.txt": None}
+
+
+def test_changes_after_root_hash_are_noticed(tmp_path):
+    root = tmp_path / "project"
+    write(root / "src" / "a.txt", b"a")
+    # Paths modified just before the scan are never trusted, make them old.
+    for path in (root / "src" / "a.txt", root / "src", root):
+        os.utime(path, (1, 1))
+    index = WorkingIndex(str(tmp_path / "index"))
+    for path, _, file_stat, _ in index.scan(str(root), "", lambda path, is_dir: False):
+        index.update(path, file_stat, HASH)
+    index.remember_root_hash("root")
+    index.dump()
+
+    index = WorkingIndex(str(tmp_path / "index"))
+    assert index.root_hash == "root"
+    assert index.is_unchanged(str(root), "")
+    assert not index.is_unchanged(str(root), "other rules")
+
+    write(root / "src" / "a.txt", b"changed")
+    assert not index.is_unchanged(str(root), "")
+    assert _scan(index, root) == {"src/a.txt": None}
+    assert index.root_hash is None
@@ -0,0 +1,45 @@
+""" Pack files and lookup of objects in their index. """
+import hashlib
+
+import pytest
+
+from core.pack import PackWriter, FLAG_COMPRESSED
+
+
+def _hash(index: int) -> str:
+    return hashlib.sha256(str(index).encode()).hexdigest()
+
+
+def test_every_object_is_found(tmp_path):
+    writer = PackWriter(str(tmp_path))
+    objects = {_hash(index): str(index).encode() * (index % 7 + 1) for index in range(2000)}
+    for full_hash, data in objects.items():
+        writer.add(full_hash, data, FLAG_COMPRESSED if len(data) % 2 else 0)
+    pack = writer.finish()
+
+    assert len(pack) == len(objects)
+    assert list(pack.hashes()) == sorted(objects)
+    for full_hash, data in objects.items():
+        offset, length, flags = pack.find(full_hash)
+        assert pack.read(offset, length) == data
+        assert flags == (FLAG_COMPRESSED if len(data) % 2 else 0)
+    pack.close()
+
+
+@pytest.mark.parametrize("missing", ["00" * 32, "ff" * 32, _hash(10_000)])
+def test_missing_object_is_not_found(tmp_path, missing):
+    writer = PackWriter(str(tmp_path))
+    # Neighbours of missing hashes in the first and the last fanout bucket.
+    for full_hash in ("00" * 31 + "01", "ff" * 31 + "fe", _hash(1), _hash(2)):
+        writer.add(full_hash, b"data", 0)
+    pack = writer.finish()
+
+    assert pack.find(missing) is None
+    assert pack.find("00" * 31 + "01") is not None
+    assert pack.find("ff" * 31 + "fe") is not None
+    pack.close()
+
+
+def test_empty_pack_is_discarded(tmp_path):
+    assert PackWriter(str(tmp_path)).finish() is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,33 @@
+""" Save pipeline stores every file while holding bounded memory. """
+import os
+
+import core.pipeline as Pipeline
+from core.pipeline import SavePipeline, SaveJob
+from core.objects import ObjectStore
+from conftest import write
+
+
+def test_memory_budget_bounds_held_contents(tmp_path, monkeypatch):
+    monkeypatch.setattr(Pipeline, "MEMORY_BUDGET", 16 * 1024)
+    peak = []
+    release = Pipeline.MemoryBudget.release
+
+    def tracked_release(self, size):
+        peak.append(self.used)
+        release(self, size)
+
+    monkeypatch.setattr(Pipeline.MemoryBudget, "release", tracked_release)
+
+    objects = ObjectStore(str(tmp_path / "objects"))
+    contents = {f"file{index}": os.urandom(4096) for index in range(64)}
+    with SavePipeline(objects, jobs=8) as pipeline:
+        for name, data in contents.items():
+            path = tmp_path / "project" / name
+            write(path, data)
+            pipeline.submit(SaveJob(name, str(path), os.stat(path)))
+
+    assert max(peak) <= 16 * 1024
+    assert pipeline.memory.used == 0
+    assert len(pipeline.finished) == len(contents)
+    for job in pipeline.finished:
+        assert b"".join(objects.iter_blocks(job.hash)) == contents[job.relative_path]
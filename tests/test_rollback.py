@@ -0,0 +1,107 @@
+""" Rollback and undo of it. """
+import tarfile
+import json
+import stat
+import io
+import os
+
+from core.repository import SAVE_DATA_FILE
+from core.catalog import CatalogEntry
+from conftest import write, read, check_tree
+
+
+def test_undo_after_collecting_removed_head(project, repository):
+    write(project / "a.txt", b"first\n")
+    repository.create_save("first")
+    write(project / "a.txt", b"second\n")
+    write(project / "b.txt", b"only in second\n")
+    repository.create_save("second")
+
+    first, second = repository.get_all_saves()
+    repository.rollback_save(first)
+    # Trash generation of the rollback names the second save as it's head.
+    repository.remove_save(second)
+    repository.collect_garbage(grace_period=0)
+    repository.undo()
+
+    assert read(project / "a.txt") == b"second\n"
+    assert read(project / "b.txt") == b"only in second\n"
+    assert repository.get_head_save() is None or repository.get_head_save().hash.full == first.hash.full
+
+    # Files of the collected save are stored again by the next save.
+    repository.create_save("third")
+    check_tree(repository, repository.get_all_saves()[-1])
+
+
+def test_status_diff_and_export_after_rollback_to_legacy_save(project, repository):
+    # Save made before manifests: full copy of the project next to it's metadata.
+    legacy_hash = "ab" * 32
+    legacy_path = f"{repository.saves_path}/{legacy_hash}"
+    write(f"{legacy_path}/src/a.txt", b"legacy\n")
+    write(f"{legacy_path}/{SAVE_DATA_FILE}", json.dumps({"comment": "legacy", "date_created": 1}).encode())
+    repository.catalog.add(CatalogEntry(legacy_hash, 1, "legacy", 0, None), is_head=False)
+
+    write(project / "b.txt", b"current\n")
+    repository.create_save("current")
+    legacy = repository.find_save(legacy_hash)
+    repository.rollback_save(legacy)
+    assert read(project / "src" / "a.txt") == b"legacy\n"
+
+    head, changes = repository.status()
+    assert head.hash.full == legacy_hash
+    assert changes == []
+    check_tree(repository, legacy)
+
+    write(project / "src" / "a.txt", b"edited\n")
+    changes, _, _ = repository.diff(legacy)
+    assert [change.path for change in changes] == ["src/a.txt"]
+
+    output = io.BytesIO()
+    repository.export_save(legacy, output, "tar")
+    with tarfile.open(fileobj=io.BytesIO(output.getvalue())) as archive:
+        assert archive.extractfile("src/a.txt").read() == b"legacy\n"
+
+
+def _snapshot(root) -> dict:
+    """ Return {relative_path: (content, mode)} of files and directories outside .notty. """
+    state = {}
+    for directory, directories, files in os.walk(root):
+        directories[:] = [name for name in directories if name != ".notty"]
+        for name in directories + files:
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, root)
+            content = None if os.path.isdir(path) else read(path)
+            state[relative_path] = (content, stat.S_IMODE(os.stat(path).st_mode))
+    return state
+
+
+def test_rollback_and_undo_round_trip(project, repository):
+    write(project / "src" / "a.txt", b"a\n")
+    write(project / "src" / "deep" / "b.txt", b"b\n")
+    write(project / "run.sh", b"#!/bin/sh\n")
+    os.chmod(project / "run.sh", 0o755)
+    repository.create_save("first")
+    first_state = _snapshot(project)
+
+    write(project / "src" / "a.txt", b"changed\n")
+    os.remove(project / "src" / "deep" / "b.txt")
+    os.rmdir(project / "src" / "deep")
+    write(project / "new" / "c.txt", b"c\n")
+    os.chmod(project / "run.sh", 0o644)
+    repository.create_save("second")
+    second_state = _snapshot(project)
+
+    first, second = repository.get_all_saves()
+    methods = repository.rollback_save(first)
+    assert sum(methods.values()) == 2
+    assert _snapshot(project) == first_state
+    assert repository.get_head_save().hash.full == first.hash.full
+
+    repository.undo()
+    assert _snapshot(project) == second_state
+    assert repository.get_head_save().hash.full == second.hash.full
+
+    # Undo of the undo brings the rollback back.
+    repository.undo()
+    assert _snapshot(project) == first_state
+    assert repository.status()[1] == []
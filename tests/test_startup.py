@@ -0,0 +1,35 @@
+""" Commands must not pay for modules they do not use. Wall time of startup
+is checked against absolute targets by `python -m benchmarks check`. """
+import subprocess
+import sys
+
+from conftest import PACKAGE_ROOT
+
+HEAVY_MODULES: tuple[str, ...] = (
+    "core.archive", "core.diff", "core.files", "core.gc",
+    "core.grep", "core.todo", "core.trash", "core.watcher",
+)
+LOADED_MODULES = (
+    "import sys, types; "
+    "print(' '.join(name for name, module in sys.modules.items() "
+    "if name.startswith('core.') and type(module) is types.ModuleType), file=sys.stderr)"
+)
+
+
+def _loaded_after(code: str) -> set[str]:
+    """ Return core modules executed by code run in a new interpreter. """
+    result = subprocess.run([sys.executable, "-c", f"{code}\n{LOADED_MODULES}"],
+                            cwd=PACKAGE_ROOT, capture_output=True, text=True, check=True)
+    return set(result.stderr.split())
+
+
+def test_help_loads_no_command_modules():
+    code = (
+        "import sys, main; sys.argv = ['notty', '--help']\n"
+        "try:\n    main.main()\nexcept SystemExit:\n    pass"
+    )
+    assert _loaded_after(code) <= {"core.errors", "core.lazy", "core.path"}
+
+
+def test_repository_does_not_load_heavy_modules():
+    assert not _loaded_after("import core.repository") & set(HEAVY_MODULES)
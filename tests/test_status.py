@@ -0,0 +1,52 @@
+""" Status of the working tree against the head save. """
+import os
+
+import pytest
+
+from core.diff import ChangeKind
+from conftest import write
+
+
+def _make_old(root) -> None:
+    """ Paths modified just before a scan are never trusted by the index. """
+    for directory, _, files in os.walk(root):
+        for name in files:
+            os.utime(os.path.join(directory, name), (1, 1))
+    for directory, _, _ in os.walk(root):
+        if "/.notty" not in directory:
+            os.utime(directory, (1, 1))
+
+
+def test_clean_status_does_not_load_tree(project, repository, monkeypatch):
+    write(project / "src" / "a.txt", b"a")
+    write(project / "b.txt", b"b")
+    _make_old(project)
+    repository.create_save("first")
+
+    def load_tree(save):
+        raise AssertionError("tree of the head save was loaded")
+
+    monkeypatch.setattr(repository, "load_tree", load_tree)
+    head, changes = repository.status()
+    assert changes == []
+    assert head.hash.full == repository.catalog.head
+
+
+def test_status_reports_changes(project, repository):
+    write(project / "src" / "a.txt", b"a")
+    write(project / "b.txt", b"b")
+    _make_old(project)
+    repository.create_save("first")
+
+    write(project / "src" / "a.txt", b"changed")
+    os.remove(project / "b.txt")
+    _, changes = repository.status()
+    assert {(change.path, change.kind) for change in changes} == {
+        ("src/a.txt", ChangeKind.MODIFIED), ("b.txt", ChangeKind.DELETED)
+    }
+
+    # Working tree reverted by hand has the root hash of the head save again.
+    write(project / "src" / "a.txt", b"a")
+    write(project / "b.txt", b"b")
+    _, changes = repository.status()
+    assert changes == []
@@ -0,0 +1,38 @@
+""" Repository's metadata database. """
+import json
+import os
+
+from core.store import (
+    MetadataStore, STORE_FILE, MIGRATED_SUFFIX, DEFAULT_NOTES, LEGACY_TODO_FILE, LEGACY_NOTES_FILE, LEGACY_META_FILE
+)
+from conftest import write
+
+
+def test_legacy_files_are_imported_once(tmp_path):
+    todo = {"todo": {"write tests": [1, 3], "fix bug": [2, 1]}}
+    write(tmp_path / LEGACY_TODO_FILE, json.dumps(todo).encode())
+    write(tmp_path / LEGACY_NOTES_FILE, "old notes\n".encode())
+    write(tmp_path / LEGACY_META_FILE, json.dumps({"date_created": 123}).encode())
+
+    store = MetadataStore(str(tmp_path))
+    assert [row[1:] for row in store.query_tasks()] == [("write tests", 1, 3), ("fix bug", 2, 1)]
+    assert store.get_notes() == "old notes\n"
+    assert store.get_meta("date_created") == 123
+    store.close()
+
+    for name in (LEGACY_TODO_FILE, LEGACY_NOTES_FILE, LEGACY_META_FILE):
+        assert not os.path.exists(tmp_path / name)
+        assert os.path.exists(tmp_path / (name + MIGRATED_SUFFIX))
+    assert os.path.exists(tmp_path / STORE_FILE)
+
+    # Database already set up is not filled again.
+    store = MetadataStore(str(tmp_path))
+    assert len(list(store.query_tasks())) == 2
+    store.close()
+
+
+def test_new_repository_gets_default_notes(tmp_path):
+    store = MetadataStore(str(tmp_path))
+    assert store.get_notes() == DEFAULT_NOTES
+    assert list(store.query_tasks()) == []
+    store.close()
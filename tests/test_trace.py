@@ -0,0 +1,29 @@
+""" Instrumentation costs nothing but a clock read unless it is enabled. """
+import core.trace as Trace
+from core.visuals import ProcessCallback, OutputMode
+import core.visuals as Visuals
+
+
+def test_disabled_trace_does_not_read_proc(monkeypatch):
+    def fail():
+        raise AssertionError("/proc/self/io read while tracing is disabled")
+
+    monkeypatch.setattr(Trace, "_enabled", False)
+    monkeypatch.setattr(Trace, "_read_proc_io", fail)
+    monkeypatch.setattr(Visuals, "output_mode", OutputMode.QUIET)
+    with ProcessCallback("process") as callback:
+        callback.info("step")
+
+    name, measurement = callback.steps[0]
+    assert name == "step"
+    assert measurement["wall_s"] >= 0
+
+
+def test_enabled_trace_keeps_events(monkeypatch):
+    monkeypatch.setattr(Trace, "_enabled", True)
+    monkeypatch.setattr(Trace, "_events", [])
+    with Trace.span("work"):
+        Trace.count("things")
+
+    assert [event["name"] for event in Trace._events] == ["work"]
+    assert Trace._events[0]["args"]["things"] == 1
@@ -0,0 +1,33 @@
+""" Copying files with the fastest method filesystem supports. """
+import errno
+
+import core.transfer as Transfer
+from conftest import write, read
+
+
+def test_copy_is_exact(tmp_path):
+    data = bytes(range(256)) * 4099
+    write(tmp_path / "source", data)
+    method = Transfer.copy_file(str(tmp_path / "source"), str(tmp_path / "destination"))
+    assert method in Transfer.Method
+    assert read(tmp_path / "destination") == data
+
+
+def test_unsupported_methods_fall_back_to_buffered_copy(tmp_path, monkeypatch):
+    calls = []
+
+    def unsupported(source_fd, target_fd, size):
+        calls.append(size)
+        raise OSError(errno.EOPNOTSUPP, "not supported")
+
+    monkeypatch.setattr(Transfer, "_KERNEL_METHODS", tuple(
+        (method, unsupported) for method, _ in Transfer._KERNEL_METHODS
+    ))
+    monkeypatch.setattr(Transfer, "_unsupported", set())
+    write(tmp_path / "source", b"data" * 1000)
+
+    for name in ("first", "second"):
+        assert Transfer.copy_file(str(tmp_path / "source"), str(tmp_path / name)) == Transfer.Method.BUFFERED
+        assert read(tmp_path / name) == b"data" * 1000
+    # Methods which failed are not tried again on the same devices.
+    assert len(calls) == len(Transfer._KERNEL_METHODS)
@@ -0,0 +1,27 @@
+""" Output of long operations. """
+import json
+import time
+
+from core.visuals import Progress, OutputMode
+import core.visuals as Visuals
+
+
+def test_progress_is_redrawn_without_advancing(monkeypatch, capsys):
+    monkeypatch.setattr(Visuals, "output_mode", OutputMode.JSON)
+    monkeypatch.setattr(Visuals, "JSON_PROGRESS_INTERVAL_S", 0.01)
+    with Progress("storing", 1, 100) as progress:
+        # Single big file is being stored, nothing advances meanwhile.
+        time.sleep(0.1)
+        progress.advance(1, 100)
+
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    unfinished = [event for event in events if event["type"] == "progress" and not event["finished"]]
+    assert len(unfinished) >= 2
+    assert events[-1]["finished"] and events[-1]["files"] == 1
+
+
+def test_quiet_progress_prints_nothing(monkeypatch, capsys):
+    monkeypatch.setattr(Visuals, "output_mode", OutputMode.QUIET)
+    with Progress("storing", 1, 100) as progress:
+        progress.advance(1, 100)
+    assert capsys.readouterr().out == ""